@@ -0,0 +1,87 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+output files written under temporary names and renamed into place, so that a file (or a set of files,
+the _part_N files of an object) is seen complete or not at all
+
+  with StagedFiles() as staged:
+      obj.save(staged.temp(part_name, ('.node', '.ele', '.face')))
+      with open(staged.temp(part_name + '.npy'), 'wb') as f:
+          np.save(f, ptcloud)
+  # all renamed here, or all removed if the block raised
+
+temporary names end in .<pid>.<thread>.tmp (before the suffixes of a set), like the temporary files of
+fragment_archive.save_archive and the stage cache. an interrupted process leaves them behind, they never
+match the names readers look for
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import threading
+from contextlib import contextmanager
+
+
+def temp_filename(filename):
+    return '{:s}.{:d}.{:d}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+
+
+class StagedFiles(object):
+    """
+    files renamed together to their names on commit (at the end of the with block)
+    """
+    def __init__(self):
+        self.files = [] # (temporary name, name)
+
+    def temp(self, name, suffixes=('',)):
+        """
+        temporary name to write name + suffix under, for every suffix (a base name for writers that add
+        the suffixes, TetgenObject.save)
+        """
+        temp_name = temp_filename(name)
+        self.files.extend((temp_name + suffix, name + suffix) for suffix in suffixes)
+        return temp_name
+
+    def commit(self):
+        for temp_name, name in self.files:
+            os.rename(temp_name, name)
+        self.files = []
+
+    def discard(self):
+        for temp_name, _ in self.files:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+@contextmanager
+def atomic_open(filename, mode='w'):
+    """
+    open(filename, mode) for writing, the file appears under filename once closed without error
+    """
+    with StagedFiles() as staged:
+        with open(staged.temp(filename), mode) as f:
+            yield f
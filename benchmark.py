@@ -0,0 +1,989 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+benchmarks of the pipeline stages, against the previous (line by line) implementations where there is one,
+and scaling sweeps over the stage parameters. the end-to-end benchmark runs generate.py with fake_tetgen.py,
+no tetgen executable is needed
+
+usage: python benchmark.py [--repeat N] [--output results.json] [--compare baseline.json] [name ...]
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import re
+import shutil
+import tempfile
+import glob
+import time
+import subprocess
+from collections import OrderedDict
+import numpy as np
+
+from bezier_to_lineseg import getPointsOnBezierCurves, getPointsOnBezierCurvesBatch
+from bezier_to_lineseg import simplifyPointsMask, distanceToSegmentSq
+from tetgen_object import TetgenObject, TetgenNodes, TeggenElems, TetgenFaces
+from tetgen_object import find_element_group, extract_submesh
+from lathe_path import save_mesh, lathe_path
+from lathe_path import align_curve_for_lathe, yRotation, transformPoint, distance, lerp, DENT_CAP
+
+SAMPLE_PREFIX = 'outputs/generated_11_0_64373'
+
+BENCHMARKS = OrderedDict()
+
+# one dict per measured case, written by --output
+RESULTS = []
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, legacy_seconds, new_seconds, **params):
+    """
+    print and record a case, legacy_seconds is None for cases without a previous implementation
+    params: parameters of the case (sweep values, sizes)
+    """
+    if legacy_seconds is None:
+        print('{:<32s} legacy {:>9s}   new {:9.4f}s'.format(name, '-', new_seconds))
+    else:
+        print('{:<32s} legacy {:9.4f}s  new {:9.4f}s  x{:.1f}'.format(
+            name, legacy_seconds, new_seconds, legacy_seconds / max(new_seconds, 1e-9)))
+    result = OrderedDict(name=name, seconds=new_seconds, legacy_seconds=legacy_seconds)
+    result.update(params)
+    RESULTS.append(result)
+
+
+########################################################################################
+# previous implementations (reference)
+
+def legacy_load_nodes(filename):
+    with open(filename) as f:
+        num_points, dim, num_attrs, has_boundary_markers = [int(x) for x in re.split(r'\s+',f.readline().strip())]
+        points = np.zeros([num_points,dim],dtype=float)
+        attrs  = np.zeros([num_points,num_attrs],dtype=float) if num_attrs > 0 else np.empty(0)
+        boundary_markers = np.zeros([num_points],dtype=int) if has_boundary_markers > 0 else np.empty(0)
+        for i in range(num_points):
+            items = re.split(r'\s+',f.readline().strip())
+            assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
+            points[i,:dim] = [float(x) for x in items[1:1+dim]]
+            if num_attrs > 0:
+                attrs[i,:num_attrs] = [float(x) for x in items[1+dim:1+dim+num_attrs]]
+            if has_boundary_markers > 0:
+                boundary_markers[i] = int(items[-1])
+    return points, attrs, boundary_markers
+
+
+def legacy_load_elems(filename):
+    with open(filename) as f:
+        num_elems, num_nodes, num_attrs = [int(x) for x in re.split(r'\s+',f.readline().strip())]
+        elems = np.zeros([num_elems, num_nodes],dtype=int)
+        attrs = np.zeros([num_elems,num_attrs],dtype=int) if num_attrs > 0 else np.empty(0)
+        for i in range(num_elems):
+            items = re.split(r'\s+',f.readline().strip())
+            assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
+            elems[i,:num_nodes] = [int(x) - 1 for x in items[1:1+num_nodes]]
+            if num_attrs > 0:
+                attrs[i,:num_attrs] = [float(x) for x in items[1+num_nodes:1+num_nodes+num_attrs]]
+    return elems, attrs
+
+
+def legacy_load_faces(filename):
+    with open(filename) as f:
+        num_faces, has_boundary_markers = [int(x) for x in re.split(r'\s+',f.readline().strip())]
+        faces = np.zeros([num_faces,3],dtype=int)
+        boundary_markers = np.zeros([num_faces],dtype=int) if has_boundary_markers > 0 else np.empty(0)
+        for i in range(num_faces):
+            items = re.split(r'\s+',f.readline().strip())
+            assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
+            faces[i,:3] = [int(x)-1 for x in items[1:4]]
+            if has_boundary_markers > 0:
+                boundary_markers[i] = int(items[-1])
+    return faces, boundary_markers
+
+
+def legacy_save_nodes(part, filename):
+    with open(filename,'w') as f:
+        f.write('{:d} {:d} {:d} {:d}\n'.format(len(part.points),part.dim,part.num_attrs,part.has_boundary_markers))
+        for i,p in enumerate(part.points):
+            line = '{:d}'.format(i+1)
+            for _,v in enumerate(p):
+                line += ' {:f}'.format(v)
+            if part.num_attrs:
+                for _,a in enumerate(part.attrs[i]):
+                    line += ' {:f}'.format(a)
+            if part.has_boundary_markers:
+                line += ' {:d}'.format(part.boundary_markers[i])
+            f.write(line + '\n')
+
+
+def legacy_save_elems(part, filename):
+    with open(filename,'w') as f:
+        f.write('{:d} {:d} {:d}\n'.format(part.num_elems,part.num_nodes,part.num_attrs))
+        for i,e in enumerate(part.elems):
+            line = '{:d}'.format(i+1)
+            for _,v in enumerate(e):
+                line += ' {:d}'.format(v+1)
+            if part.num_attrs:
+                for _,a in enumerate(part.attrs[i]):
+                    line += ' {:f}'.format(a)
+            f.write(line + '\n')
+
+
+def legacy_save_faces(part, filename):
+    with open(filename,'w') as f:
+        f.write('{:d} {:d}\n'.format(part.num_faces,part.has_boundary_markers))
+        for i,face in enumerate(part.faces):
+            line = '{:d}'.format(i+1)
+            for _,v in enumerate(face):
+                line += ' {:d}'.format(v+1)
+            if part.has_boundary_markers:
+                line += ' {:d}'.format(part.boundary_markers[i])
+            f.write(line + '\n')
+
+
+def legacy_save_mesh(f, nodes, faces, node_attrs, node_boundary_markers, face_boundary_markers):
+    f.write('# part 1 - node\n')
+    f.write('# first line: #points, dimensions, #attributes, has_boundary_markers\n')
+    f.write('{:d} {:d} {:d} {:d}\n'.format(len(nodes),3,node_attrs[0].shape[-1],1))
+    f.write('# rest lines: point#, x, y, z, [attributes], [boundary marker]\n')
+    for ii,node in enumerate(nodes):
+        line = '{:d}'.format(ii+1)
+        for value in node:
+            line += ' {:f}'.format(value)
+        for value in node_attrs[ii]:
+            line += ' {:f}'.format(value)
+        line += ' {:d}'.format(node_boundary_markers[ii])
+        f.write(line + '\n')
+    f.write('# part 2 - facets\n')
+    f.write('{:d} {:d}\n'.format(len(faces) , 1))
+    for ii,face in enumerate(faces):
+        line = '{:d}'.format(3)
+        for _,v in enumerate(face):
+            line += ' {:d}'.format(v+1)
+        line += ' {:d}'.format(face_boundary_markers[ii])
+        f.write(line + '\n')
+    f.write('# part 3 - holes\n')
+    f.write('{:d}\n'.format(0))
+    f.write('# part 4 - region attr list\n')
+    f.write('{:d}\n'.format(0))
+
+
+def legacy_elems_to_faces2(elems):
+    e2f = [[0,2,1],[0,1,3],[1,2,3],[0,3,2]]
+    t_ = np.sort(np.transpose([elems[:,e2f[0]],elems[:,e2f[1]],elems[:,e2f[2]],elems[:,e2f[3]]],[1,0,2]).reshape([-1,3]),axis=-1).tolist()
+    face_dict = dict()
+    for f in t_:
+        ft = tuple(f)
+        if ft not in face_dict:
+            face_dict[ft] = 1
+        else:
+            face_dict[ft] += 1
+    faces = np.zeros([len(face_dict),3],dtype=int)
+    counts = np.zeros(len(face_dict),dtype=int)
+    for i,en in enumerate(face_dict.items()):
+        f, c = en
+        faces[i,:] = f
+        counts[i] = c
+    return faces, counts
+
+
+def legacy_extract_submesh(points, elems, elem_select):
+    vert_selected  = np.zeros(len(points),dtype=int)
+    for elem in elems[elem_select]:
+        a, b, c, d = elem
+        vert_selected[[a,b,c,d]] = 1
+    vertex_select  = vert_selected == 1
+    vertex_remap   = np.zeros(len(points),dtype=int)
+    vertex_remap[:] = -(len(points)+1)
+    for i,v in enumerate(np.arange(len(points),dtype=int)[vertex_select]):
+        vertex_remap[v] = i
+    new_points = points[vertex_select]
+    new_elems = vertex_remap[elems[elem_select]]
+    faces, counts = legacy_elems_to_faces2(new_elems)
+    ptcloud = np.mean(new_points[faces[counts == 1]],axis=1)
+    return new_points, new_elems, faces, counts, ptcloud
+
+
+def legacy_lathe_path(points_,
+                start_angle=0.0, # angle to start at (ie 0)
+                end_angle=2*np.pi, # angle to end at (ie PI * 2)
+                num_divisions=60, # how many quads to make around
+                cap_start=True, # true to cap the top
+                cap_end=True, # true to cap the bottom
+                use_map_xz=False):
+    nodes = []
+    texcoords = []
+    indices = []
+
+    points = align_curve_for_lathe(points_)
+
+    pointsPerColumn = len(points)
+
+    # generate v coordinates using topPointIndex
+    assert len(points[0]) == 2
+    topPointIndex = np.argmin(points[:,1])  # y 값이 가장 작은 point 의 index
+
+    vcoords = np.zeros([len(points)],dtype=float)
+
+    # 바깥쪽 v 좌표 계산
+    # 0..topPointIndex
+    outerLength = 0.0
+    for i in range(topPointIndex):
+        vcoords[i] = outerLength
+        outerLength += distance(points[i],points[i+1])
+    vcoords[topPointIndex] = outerLength
+    vcoords[:topPointIndex+1] /= outerLength
+
+    # 안쪽 v 좌표 계산
+    # (n-1)..(topPointIndex+1)
+    innerLength = 0.0
+    for i in range(len(points)-1,topPointIndex,-1):
+        vcoords[i] = innerLength
+        innerLength += distance(points[i],points[i-1])
+    vcoords[topPointIndex+1:] /= innerLength
+
+    # tex_eps = 1.0 / num_divisions * 1.0e-2
+
+    # generate points
+    for division in range(num_divisions):
+        u = division / num_divisions
+        angle = lerp(start_angle, end_angle, u)
+        mat = yRotation(angle)
+        for ndx, p in enumerate(points):
+            x,y,z = transformPoint(mat,[p[0],p[1],0.])
+            nodes.append([x,y,z])
+            v = vcoords[ndx]
+            texcoords.append([u,v])
+
+    if cap_start:
+        # add point on Y access at start
+        y_capstart = points[0][1]
+        if DENT_CAP: # tetgen error workaround
+            y_capstart -= 1.5
+        capStartPnt = [0., y_capstart, 0.]
+        capStartUV = [0., vcoords[0]]
+        capStartIdx = len(nodes)
+        nodes.append(capStartPnt)
+        texcoords.append(capStartUV)
+
+    if cap_end:
+        # add point on Y access at end
+        y_capend = points[len(points)-1][1]
+        if DENT_CAP:
+            y_capend += 1.5
+        capEndPnt = [0., y_capend, 0.]
+        capEndUV = [0., vcoords[-1]] # [1., 1.] # [u, 1.]
+        capEndIdx = len(nodes)
+        nodes.append(capEndPnt)
+        texcoords.append(capEndUV)
+
+
+    def add_triangle(a,b,c):
+        assert a >= 0 and a < len(nodes) , ('invalid a',a,len(nodes) )
+        assert b >= 0 and b < len(nodes) , ('invalid b',b,len(nodes) )
+        assert c >= 0 and c < len(nodes) , ('invalid c',c,len(nodes) )
+        indices.append([a,b,c])
+
+
+    # generate indices
+    for division in range(num_divisions):
+        column1Offset = division * pointsPerColumn
+        column2Offset = ( division + 1 ) % num_divisions * pointsPerColumn
+        if cap_start:
+            a,b,c = capStartIdx,column1Offset,column2Offset
+            add_triangle(a,b,c)
+
+        for quad,_ in enumerate(points[:-1]):
+            a,b,c = column1Offset+quad, column1Offset+quad+1, column2Offset+quad
+            add_triangle(a,b,c)
+            a,b,c = column1Offset+quad+1, column2Offset+quad+1, column2Offset+quad
+            add_triangle(a,b,c)
+
+        if not cap_start and not cap_end:
+            # self closing
+            last_quad = len(points) - 1
+            a,b,c = column1Offset, column2Offset, column1Offset + last_quad
+            add_triangle(a,b,c)
+            a,b,c = column2Offset, column2Offset + last_quad, column1Offset + last_quad
+            add_triangle(a,b,c)
+
+        if cap_end:
+            a,b,c = column1Offset+len(points)-1,capEndIdx,column2Offset+len(points)-1
+            add_triangle(a,b,c)
+
+    nodes, texcoords, indices = np.array(nodes), np.array(texcoords), np.array(indices)
+
+    # apply xz map instead of uv if requested
+    if use_map_xz:
+        _min = np.amin(nodes,axis=0)
+        _max = np.amax(nodes,axis=0)
+        _dim = (_max - _min)
+        texcoords[:,:] = ((nodes - _min) / _dim)[:,[0,2]]
+
+    return nodes, texcoords, indices
+
+
+def legacy_simplifyPoints(points, start, end, epsilon, newPoints=None):
+    outPoints = [] if newPoints is None else newPoints
+
+    # find the most distant point from the line formed by the endpoints
+    s = points[start]
+    e = points[end - 1]
+    maxDistSq = 0
+    maxNdx = 1
+    for i in range(start+1, end-1):
+        distSq = distanceToSegmentSq(points[i], s, e)
+        if distSq > maxDistSq:
+            maxDistSq = distSq
+            maxNdx = i
+
+    # if that point is too far
+    if np.sqrt(maxDistSq) > epsilon:
+
+        # split
+        # simplifyPoints(points, start, maxNdx + 1, epsilon, outPoints)
+        legacy_simplifyPoints(points, start, maxNdx, epsilon, outPoints)
+        legacy_simplifyPoints(points, maxNdx, end, epsilon, outPoints)
+
+    else:
+
+        if np.all(s == e):
+            outPoints.extend([s])
+        else:
+            # add the 2 end points
+            outPoints.extend([s,e])
+
+    return outPoints
+
+
+########################################################################################
+
+
+def _load(part_class, filename):
+    part = part_class()
+    part.parse(filename) # the text parser, see tetgen_sidecar for loads from the binary sidecar
+    return part
+
+
+@benchmark
+def tetgen_load(repeat):
+    """
+    load every .node/.ele/.face file of the sample object
+    """
+    cases = [
+        ('.node', legacy_load_nodes, TetgenNodes, lambda p: (p.points, p.attrs, p.boundary_markers)),
+        ('.ele',  legacy_load_elems, TeggenElems, lambda p: (p.elems, p.attrs)),
+        ('.face', legacy_load_faces, TetgenFaces, lambda p: (p.faces, p.boundary_markers)),
+    ]
+    for ext, legacy_load, part_class, arrays in cases:
+        filenames = sorted(glob.glob(SAMPLE_PREFIX + '_part_*' + ext))
+        assert len(filenames) > 0, ('no sample files',SAMPLE_PREFIX,ext)
+
+        # check results first
+        for filename in filenames:
+            expected = legacy_load(filename)
+            actual = arrays(_load(part_class, filename))
+            for e, a in zip(expected, actual):
+                assert e.dtype.kind == a.dtype.kind and np.array_equal(e, a), ('mismatch',filename)
+
+        legacy_seconds = best_of(lambda: [legacy_load(fn) for fn in filenames], repeat)
+        new_seconds = best_of(lambda: [_load(part_class, fn) for fn in filenames], repeat)
+        report('tetgen_load' + ext, legacy_seconds, new_seconds)
+
+
+@benchmark
+def tetgen_sidecar(repeat):
+    """
+    load the whole sample object (fragments merged by fake_tetgen.py): text parsing, first load
+    (parsing and writing the sidecars), later loads (memory-mapped sidecars)
+    """
+    from fake_tetgen import load_recording
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        base = os.path.join(tmp_dir, 'object.1')
+        load_recording(SAMPLE_PREFIX).save(base)
+
+        parsed = TetgenObject()
+        parsed.load(base, sidecar=False)
+        first_seconds = best_of(lambda: TetgenObject().load(base), 1)
+        mapped = TetgenObject()
+        mapped.load(base)
+        for name in ('nodes', 'elems', 'faces'):
+            for array in getattr(parsed, name).ARRAYS:
+                e, a = getattr(getattr(parsed, name), array), getattr(getattr(mapped, name), array)
+                assert e.dtype == a.dtype and np.array_equal(e, a), ('mismatch',name,array)
+
+        parse_seconds = best_of(lambda: TetgenObject().load(base, sidecar=False), repeat)
+        mmap_seconds = best_of(lambda: TetgenObject().load(base), repeat)
+        params = dict(num_points=parsed.nodes.num_points, num_elems=parsed.elems.num_elems)
+        report('tetgen_sidecar.first_load', None, first_seconds, **params)
+        report('tetgen_sidecar.load', parse_seconds, mmap_seconds, **params)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _read(filename):
+    with open(filename,'rb') as f:
+        return f.read()
+
+
+@benchmark
+def tetgen_save(repeat):
+    """
+    save every .node/.ele/.face file of the sample object, and a .smesh built from them
+    """
+    cases = [
+        ('.node', legacy_save_nodes, TetgenNodes),
+        ('.ele',  legacy_save_elems, TeggenElems),
+        ('.face', legacy_save_faces, TetgenFaces),
+    ]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for ext, legacy_save, part_class in cases:
+            parts = [_load(part_class, fn) for fn in sorted(glob.glob(SAMPLE_PREFIX + '_part_*' + ext))]
+            legacy_name = os.path.join(tmp_dir, 'legacy' + ext)
+            new_name = os.path.join(tmp_dir, 'new' + ext)
+
+            # output must be byte-compatible
+            for part in parts:
+                legacy_save(part, legacy_name)
+                part.save(new_name)
+                assert _read(legacy_name) == _read(new_name), ('mismatch',ext)
+
+            legacy_seconds = best_of(lambda: [legacy_save(part, legacy_name) for part in parts], repeat)
+            new_seconds = best_of(lambda: [part.save(new_name) for part in parts], repeat)
+            report('tetgen_save' + ext, legacy_seconds, new_seconds)
+
+        nodes = _load(TetgenNodes, SAMPLE_PREFIX + '_part_1.node')
+        faces = _load(TetgenFaces, SAMPLE_PREFIX + '_part_1.face')
+        args = (nodes.points, faces.faces, nodes.attrs, nodes.boundary_markers, faces.boundary_markers)
+        legacy_name = os.path.join(tmp_dir, 'legacy.smesh')
+        new_name = os.path.join(tmp_dir, 'new.smesh')
+
+        def legacy():
+            with open(legacy_name,'w') as f:
+                legacy_save_mesh(f, *args)
+
+        def new():
+            with open(new_name,'w') as f:
+                save_mesh(f, nodes.points, faces.faces, node_attrs=nodes.attrs,
+                          node_boundary_markers=nodes.boundary_markers, face_boundary_markers=faces.boundary_markers)
+
+        legacy()
+        new()
+        assert _read(legacy_name) == _read(new_name), ('mismatch','.smesh')
+        report('save_mesh.smesh', best_of(legacy, repeat), best_of(new, repeat))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def sample_profile(base_shape=1, tolerance=0.02, simplify_eps=0.001):
+    """
+    line segments of a base shape of generate.py, without random perturbation
+    """
+    from generate import svg_path_A, svg_path_B, svg_path_C
+    from parse_svg_path import parse_svg_path
+    from bezier_to_lineseg import bezier_to_lineseg
+    svg_path = [svg_path_A, svg_path_B, svg_path_C][base_shape - 1]
+    return bezier_to_lineseg(parse_svg_path(svg_path), tolerance=tolerance, simplify_eps=simplify_eps)
+
+
+@benchmark
+def lathe(repeat, num_divisions=360):
+    """
+    lathe the base shapes, with and without caps
+    """
+    for base_shape in (1, 2, 3):
+        points = sample_profile(base_shape)
+        for cap in (0, 1):
+            kwargs = dict(num_divisions=num_divisions, cap_start=cap, cap_end=cap)
+            expected = legacy_lathe_path(points, **kwargs)
+            actual = lathe_path(points, **kwargs)
+            for e, a in zip(expected, actual):
+                assert e.dtype == a.dtype and e.shape == a.shape and e.tobytes() == a.tobytes(), ('mismatch',base_shape,cap)
+
+            name = 'lathe_path.shape{:d}.cap{:d}'.format(base_shape, cap)
+            report(name, best_of(lambda: legacy_lathe_path(points, **kwargs), repeat), best_of(lambda: lathe_path(points, **kwargs), repeat),
+                   base_shape=base_shape, cap=cap, num_divisions=num_divisions)
+
+
+@benchmark
+def lathe_adaptive(repeat, num_divisions=360):
+    """
+    lathe the base shapes with columns per row from the chord error, at the chord error of num_divisions
+    uniform columns at the largest radius, and at 4 times that (half the columns at the rim)
+    """
+    for base_shape in (1, 2, 3):
+        points = sample_profile(base_shape)
+        uniform = lathe_path(points, num_divisions=num_divisions, cap_start=0, cap_end=0)
+        rim_error = 1 - np.cos(np.pi / num_divisions)
+        for scale in (1, 4):
+            kwargs = dict(num_divisions=num_divisions, cap_start=0, cap_end=0, chord_tolerance=rim_error * scale)
+            nodes, _, indices = lathe_path(points, **kwargs)
+            report('lathe_path.adaptive{:d}.shape{:d}'.format(scale, base_shape),
+                   best_of(lambda: lathe_path(points, num_divisions=num_divisions, cap_start=0, cap_end=0), repeat),
+                   best_of(lambda: lathe_path(points, **kwargs), repeat),
+                   base_shape=base_shape, chord_tolerance=rim_error * scale,
+                   uniform_nodes=len(uniform[0]), uniform_faces=len(uniform[2]), nodes=len(nodes), faces=len(indices))
+
+
+@benchmark
+def bezier_flatten(repeat, tolerances=(0.15, 0.02, 1e-3, 1e-4, 1e-5)):
+    """
+    flatten the base shapes with decreasing tolerance
+    """
+    from generate import svg_path_A, svg_path_B, svg_path_C
+    from parse_svg_path import parse_svg_path
+    curves = [parse_svg_path(svg_path) for svg_path in (svg_path_A, svg_path_B, svg_path_C)]
+    for tolerance in tolerances:
+        for curve_points in curves:
+            # the recursive version adds both end points of every flat curve
+            expected = np.array(getPointsOnBezierCurves(curve_points, tolerance))
+            expected = np.concatenate([expected[0::2], expected[-1:]],axis=0)
+            assert np.array_equal(expected, getPointsOnBezierCurvesBatch(curve_points, tolerance)), ('mismatch',tolerance)
+
+        name = 'bezier_flatten.tol{:g}'.format(tolerance)
+        report(name,
+               best_of(lambda: [getPointsOnBezierCurves(cp, tolerance) for cp in curves], repeat),
+               best_of(lambda: [getPointsOnBezierCurvesBatch(cp, tolerance) for cp in curves], repeat),
+               tolerance=tolerance)
+
+
+@benchmark
+def simplify(repeat, tolerances=(1e-5, 1e-9, 1e-12), simplify_eps=0.001, legacy_max_points=50000):
+    """
+    simplify the flattened base shape 2, up to 10^5 points
+    """
+    from generate import svg_path_B
+    from parse_svg_path import parse_svg_path
+    curve_points = parse_svg_path(svg_path_B)
+    for tolerance in tolerances:
+        points = getPointsOnBezierCurvesBatch(curve_points, tolerance)
+        name = 'simplify.{:d}points'.format(len(points))
+        if len(points) > legacy_max_points:
+            report(name, None, best_of(lambda: simplifyPointsMask(points, simplify_eps), repeat), num_points=len(points))
+            continue
+        expected = np.array(legacy_simplifyPoints(points, 0, len(points), simplify_eps))
+        assert np.array_equal(expected, points[simplifyPointsMask(points, simplify_eps)]), ('mismatch',name)
+        report(name,
+               best_of(lambda: legacy_simplifyPoints(points, 0, len(points), simplify_eps), repeat),
+               best_of(lambda: simplifyPointsMask(points, simplify_eps), repeat),
+               num_points=len(points))
+
+
+def synthetic_tetgen_object(num_points, seed=0):
+    """
+    delaunay tetrahedralization of random points in a cylinder shell, with u, v texcoords
+    (about 6.5 tetrahedra per point)
+    """
+    from scipy.spatial import Delaunay
+    rs = np.random.RandomState(seed)
+    u, v, r = rs.uniform(0.0,1.0,size=[3,num_points])
+    angle = 2 * np.pi * u
+    radius = 100.0 + 10.0 * r
+    points = np.stack([radius * np.cos(angle), 200.0 * v, -radius * np.sin(angle)],axis=1)
+
+    obj = TetgenObject()
+    obj.nodes.points = points
+    obj.nodes.num_points = num_points
+    obj.nodes.dim = 3
+    obj.nodes.attrs = np.stack([u, v],axis=1)
+    obj.nodes.num_attrs = 2
+    obj.nodes.boundary_markers = np.zeros(num_points,dtype=int)
+    obj.nodes.has_boundary_markers = 1
+    obj.elems.elems = Delaunay(points).simplices.astype(int)
+    obj.elems.num_elems = len(obj.elems.elems)
+    obj.elems.num_nodes = 4
+    obj.elems.attrs = np.empty(0)
+    return obj
+
+
+def mirrored_pattern(num_fracs, seed=0):
+    rs = np.random.RandomState(seed)
+    cells = rs.uniform([0.0,0.0],[1.0,1.0],size=[num_fracs,2])
+    voronoi_points = np.concatenate([cells,cells + [-1.0, 0.0],cells + [1.0, 0.0],],axis=0)
+    voronoi_group = np.arange(len(voronoi_points)) % num_fracs
+    return voronoi_points, voronoi_group
+
+
+@benchmark
+def extract_submesh_scaling(repeat, sizes=(2000, 20000, 200000), legacy_max_size=20000, num_fracs=11):
+    """
+    extract all fragments of synthetic meshes of increasing size (# of points, 1M+ tetrahedra at the largest)
+    """
+    for num_points in sizes:
+        obj = synthetic_tetgen_object(num_points)
+        voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+        selections = [-(i+2) for i in range(num_fracs)]
+        elem_group = find_element_group(obj.elems.elems,obj.nodes.attrs,voronoi_points,voronoi_group)
+
+        def new():
+            return [extract_submesh(obj,elem_group == sel,sel) for sel in selections]
+
+        name = 'extract_submesh.{:d}tets'.format(obj.elems.num_elems)
+        if num_points > legacy_max_size:
+            report(name, None, best_of(new, repeat), num_elems=obj.elems.num_elems)
+            continue
+
+        def legacy():
+            return [legacy_extract_submesh(obj.nodes.points,obj.elems.elems,elem_group == sel) for sel in selections]
+
+        for sel, (part, ptcloud), expected in zip(selections, new(), legacy()):
+            points, elems, faces, counts, expected_ptcloud = expected
+            assert np.array_equal(points, part.nodes.points), ('mismatch',name,'points')
+            assert np.array_equal(elems, part.elems.elems), ('mismatch',name,'elems')
+            assert np.array_equal(faces, part.faces.faces), ('mismatch',name,'faces')
+            assert np.array_equal(counts == 1, part.faces.boundary_markers == sel), ('mismatch',name,'markers')
+            assert np.array_equal(expected_ptcloud, ptcloud), ('mismatch',name,'ptcloud')
+
+        report(name, best_of(legacy, repeat), best_of(new, repeat), num_elems=obj.elems.num_elems)
+
+
+########################################################################################
+# stages without a previous implementation, scaling sweeps
+
+def base_svg_paths():
+    from generate import svg_path_A, svg_path_B, svg_path_C
+    return [svg_path_A, svg_path_B, svg_path_C]
+
+
+@benchmark
+def svg(repeat, rand_perturbation=0.08):
+    """
+    normalize_svg and parse_svg_path (with random perturbation) of the base shapes
+    """
+    from simple_svg import normalize_svg
+    from parse_svg_path import parse_svg_path
+    for base_shape, svg_path in enumerate(base_svg_paths(), 1):
+        report('normalize_svg.shape{:d}'.format(base_shape), None,
+               best_of(lambda: normalize_svg(svg_path), repeat), base_shape=base_shape)
+        report('parse_svg_path.shape{:d}'.format(base_shape), None,
+               best_of(lambda: parse_svg_path(svg_path, rand_perturbation=rand_perturbation, rand_seed=1), repeat),
+               base_shape=base_shape, rand_perturbation=rand_perturbation)
+
+
+@benchmark
+def lineseg_sweep(repeat, tolerances=(0.15, 0.02, 1e-3, 1e-4), simplify_eps=0.001):
+    """
+    bezier_to_lineseg (flatten and simplify) of the base shapes with decreasing tolerance
+    """
+    from parse_svg_path import parse_svg_path
+    from bezier_to_lineseg import bezier_to_lineseg
+    curves = [parse_svg_path(svg_path) for svg_path in base_svg_paths()]
+    for tolerance in tolerances:
+        num_points = sum(len(bezier_to_lineseg(cp, tolerance=tolerance, simplify_eps=simplify_eps)) for cp in curves)
+        report('bezier_to_lineseg.tol{:g}'.format(tolerance), None,
+               best_of(lambda: [bezier_to_lineseg(cp, tolerance=tolerance, simplify_eps=simplify_eps) for cp in curves], repeat),
+               tolerance=tolerance, num_points=num_points)
+
+
+@benchmark
+def lathe_sweep(repeat, divisions=(36, 90, 360, 1440, 5760)):
+    """
+    lathe_path of base shape 1 with increasing number of divisions
+    """
+    points = sample_profile(1)
+    for num_divisions in divisions:
+        nodes, _, triangles = lathe_path(points, num_divisions=num_divisions)
+        report('lathe_path.div{:d}'.format(num_divisions), None,
+               best_of(lambda: lathe_path(points, num_divisions=num_divisions), repeat),
+               num_divisions=num_divisions, num_nodes=len(nodes), num_triangles=len(triangles))
+
+
+@benchmark
+def pattern_sweep(repeat, num_cells=(4, 11, 32, 100, 1000)):
+    """
+    create_pattern (voronoi and line segments in uv space), mirrored and periodic, with increasing number of cells
+    """
+    from pattern import create_pattern
+    for n in num_cells:
+        for periodic in (False, True):
+            np.random.seed(n)
+            report('create_pattern.{:s}{:d}'.format('periodic' if periodic else 'mirrored', n), None,
+                   best_of(lambda: create_pattern(n, periodic=periodic), repeat),
+                   num_cells=n, periodic=periodic)
+
+
+@benchmark
+def element_group_sweep(repeat, fracs=(4, 11, 32, 100, 1000), num_points=200000):
+    """
+    find_element_group of a synthetic mesh (1M+ tetrahedra), mirrored and periodic patterns,
+    with increasing number of fragments
+    """
+    from site_index import UV_PERIOD
+    obj = synthetic_tetgen_object(num_points)
+    elems, texcoords = obj.elems.elems, obj.nodes.attrs
+    for num_fracs in fracs:
+        voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+        report('find_element_group.mirrored{:d}'.format(num_fracs), None,
+               best_of(lambda: find_element_group(elems, texcoords, voronoi_points, voronoi_group), repeat),
+               num_fracs=num_fracs, num_elems=len(elems), periodic=False)
+        cells, cells_group = voronoi_points[:num_fracs], voronoi_group[:num_fracs]
+        report('find_element_group.periodic{:d}'.format(num_fracs), None,
+               best_of(lambda: find_element_group(elems, texcoords, cells, cells_group, UV_PERIOD), repeat),
+               num_fracs=num_fracs, num_elems=len(elems), periodic=True)
+
+
+@benchmark
+def rebuild_submesh_sweep(repeat, fracs=(4, 11, 32)):
+    """
+    all fragments of the recorded sample mesh (see fake_tetgen.py), one rebuild_submesh2 per fragment
+    and one rebuild_submeshes for all, with increasing number of fragments
+    """
+    from fake_tetgen import load_recording
+    from tetgen_object import rebuild_submesh2, rebuild_submeshes
+    obj = load_recording(SAMPLE_PREFIX)
+    for num_fracs in fracs:
+        voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+        selections = [-(i+2) for i in range(num_fracs)]
+        params = dict(num_fracs=num_fracs, num_elems=obj.elems.num_elems)
+        report('rebuild_submesh2.{:d}fracs'.format(num_fracs), None,
+               best_of(lambda: [rebuild_submesh2(obj, sel, voronoi_points, voronoi_group) for sel in selections], repeat), **params)
+        report('rebuild_submeshes.{:d}fracs'.format(num_fracs), None,
+               best_of(lambda: rebuild_submeshes(obj, selections, voronoi_points, voronoi_group), repeat), **params)
+
+
+@benchmark
+def sample_surfaces_sweep(repeat, num_points=(1024, 4096, 16384), num_fracs=11):
+    """
+    area-weighted surface samples of all fragments of the recorded sample mesh, one batched call
+    """
+    from fake_tetgen import load_recording
+    from tetgen_object import sample_surfaces
+    obj = load_recording(SAMPLE_PREFIX)
+    voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+    elem_group = find_element_group(obj.elems.elems, obj.nodes.attrs, voronoi_points, voronoi_group)
+    selections = [-(i+2) for i in range(num_fracs)]
+    for n in num_points:
+        report('sample_surfaces.{:d}points'.format(n), None,
+               best_of(lambda: sample_surfaces(obj, elem_group, selections, n, np.random.RandomState(0)), repeat),
+               num_points=n, num_fracs=num_fracs, num_elems=obj.elems.num_elems)
+
+
+@benchmark
+def shell_preview(repeat, num_fracs=11, num_divisions=360):
+    """
+    fragment shells of the base shapes without tetgen (generate.py --preview 1)
+    """
+    from shell_preview import shatter_shells
+    voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+    for base_shape in (1, 2, 3):
+        points = sample_profile(base_shape)
+        report('shatter_shells.shape{:d}'.format(base_shape), None,
+               best_of(lambda: shatter_shells(points, voronoi_points, voronoi_group, num_fracs, num_divisions), repeat),
+               base_shape=base_shape, num_fracs=num_fracs, num_divisions=num_divisions)
+
+
+@benchmark
+def fragment_archive(repeat, num_fracs=11):
+    """
+    fragments of the recorded sample mesh as text files and as one archive (fragment_archive.py):
+    writing all, and loading a single fragment (text parsing vs memory-mapped archive)
+    """
+    from fake_tetgen import load_recording
+    from tetgen_object import rebuild_submeshes
+    from fragment_archive import save_archive, FragmentArchive
+    import generate
+    obj = load_recording(SAMPLE_PREFIX)
+    voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+    selections = [-(i+2) for i in range(num_fracs)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(tmp_dir, 'generated')
+        text_seconds = best_of(lambda: generate.save_fragments(prefix, rebuild_submeshes(obj, selections, voronoi_points, voronoi_group)), repeat)
+        archive_seconds = best_of(lambda: save_archive(prefix + '.fragments', rebuild_submeshes(obj, selections, voronoi_points, voronoi_group)), repeat)
+        params = dict(num_fracs=num_fracs, num_elems=obj.elems.num_elems)
+        report('fragment_archive.write', text_seconds, archive_seconds, **params)
+
+        last = num_fracs - 1
+        expected = TetgenObject()
+        expected.load(prefix + '_part_{:d}'.format(num_fracs), sidecar=False)
+        actual = FragmentArchive(prefix + '.fragments').fragment(last)
+        assert np.array_equal(expected.elems.elems, actual.elems.elems) and np.allclose(expected.nodes.points, actual.nodes.points, atol=1e-6)
+        text_seconds = best_of(lambda: TetgenObject().load(prefix + '_part_{:d}'.format(num_fracs), sidecar=False), repeat)
+        archive_seconds = best_of(lambda: FragmentArchive(prefix + '.fragments').fragment(last), repeat)
+        report('fragment_archive.load_one', text_seconds, archive_seconds, **params)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@benchmark
+def dataset_stream(repeat, num_objects=8, num_fracs=11):
+    """
+    every point cloud of num_objects objects (fragments of the sample mesh): one .npy file each,
+    and streamed from a packed dataset (dataset_shards.py), also with shuffling.
+    and every fragment: parsed from text files, and streamed from the packed dataset
+    """
+    from fake_tetgen import load_recording
+    from tetgen_object import rebuild_submeshes
+    from dataset_shards import pack, ShardReader
+    import generate
+    obj = load_recording(SAMPLE_PREFIX)
+    voronoi_points, voronoi_group = mirrored_pattern(num_fracs)
+    selections = [-(i+2) for i in range(num_fracs)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        outputs = os.path.join(tmp_dir, 'outputs')
+        os.makedirs(outputs)
+        for i in range(num_objects):
+            generate.save_fragments(os.path.join(outputs, 'generated_{:d}'.format(i)),
+                                    rebuild_submeshes(obj, selections, voronoi_points, voronoi_group))
+        dataset = os.path.join(tmp_dir, 'dataset')
+        pack([outputs], dataset, shard_bytes=16 * 1024**2)
+
+        filenames = sorted(glob.glob(os.path.join(outputs, '*.npy')))
+        params = dict(num_objects=num_objects, num_fracs=num_fracs)
+        files_seconds = best_of(lambda: [np.load(filename) for filename in filenames], repeat)
+        report('dataset_stream.sequential', files_seconds,
+               best_of(lambda: list(ShardReader(dataset)), repeat), **params)
+        report('dataset_stream.shuffled', files_seconds,
+               best_of(lambda: list(ShardReader(dataset, shuffle=True).epoch(1)), repeat), **params)
+
+        def load_text():
+            for filename in filenames:
+                TetgenObject().load(filename[:-len('.npy')], sidecar=False)
+                np.load(filename)
+        report('dataset_stream.fragments', best_of(load_text, repeat),
+               best_of(lambda: list(ShardReader(dataset, what='fragment')), repeat), **params)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@benchmark
+def end_to_end(repeat, fracs=(4, 11), base_shape=1):
+    """
+    generate.py with fake_tetgen.py replaying the sample mesh, total and per stage (best run)
+    """
+    import generate
+    fake_tetgen = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_tetgen.py')
+    tetgen_command = generate.TETGEN_COMMAND
+    generate.TETGEN_COMMAND = [sys.executable, fake_tetgen]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for num_fracs in fracs:
+            args = generate.parse_args(['--base_shape', str(base_shape), '--num_fracs', str(num_fracs), '--random_seed', '1',
+                                        '--output_prefix', os.path.join(tmp_dir, 'generated'), '--profile', '1'])
+            best = None
+            for _ in range(repeat):
+                run = generate.main(args)
+                if best is None or run['wall_seconds'] < best['wall_seconds']:
+                    best = run
+            name = 'end_to_end.{:d}fracs'.format(num_fracs)
+            report(name, None, best['wall_seconds'], num_fracs=num_fracs, base_shape=base_shape)
+            for record in best['stages']:
+                report(name + '.' + record['stage'], None, record['wall_seconds'], num_fracs=num_fracs, base_shape=base_shape,
+                       stage=record['stage'])
+    finally:
+        generate.TETGEN_COMMAND = tetgen_command
+        shutil.rmtree(tmp_dir)
+
+
+@benchmark
+def cold_start(repeat, modules=('generate', 'generate_many', 'pattern', 'tetgen_object'), heavy=('matplotlib', 'scipy')):
+    """
+    start-up time of a new python process that imports a module, and of `generate.py --help`.
+    what we pay for every `python generate.py` of a batch. heavy optional dependencies must
+    not be loaded at import (checked), they are imported where they are used
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(*args):
+        with open(os.devnull,'w') as devnull:
+            subprocess.check_call([sys.executable] + list(args), cwd=here, stdout=devnull)
+
+    report('cold_start.python', None, best_of(lambda: run('-c', 'pass'), repeat))
+    for module in modules:
+        code = 'import sys, {:s}; loaded = [m for m in {!r} if m in sys.modules]; assert not loaded, loaded'.format(module, heavy)
+        report('cold_start.import_' + module, None, best_of(lambda: run('-c', code), repeat), module=module)
+    report('cold_start.generate_help', None, best_of(lambda: run('generate.py', '--help'), repeat))
+
+
+def environment():
+    """
+    revision and versions, to tell results apart
+    """
+    import platform
+    import scipy
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                           universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return OrderedDict([
+        ('revision', revision),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('scipy', scipy.__version__),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+    ])
+
+
+def compare(results, baseline):
+    """
+    print the ratio of each case to the same case in baseline (a results file of another revision)
+    """
+    base_seconds = {result['name']: result['seconds'] for result in baseline['results']}
+    print()
+    print('compared to revision {}'.format(baseline['environment'].get('revision')))
+    for result in results:
+        if result['name'] in base_seconds:
+            print('{:<32s} base {:9.4f}s  now {:9.4f}s  x{:.2f}'.format(
+                result['name'], base_seconds[result['name']], result['seconds'],
+                base_seconds[result['name']] / max(result['seconds'], 1e-9)))
+
+
+from argparse import ArgumentParser
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--output',type=str,default=None) # write results as json
+    parser.add_argument('--compare',type=str,default=None) # results json of another revision
+    parser.add_argument('names',nargs='*',default=None) # default: run all
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    names = args.names or list(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name](args.repeat)
+
+    if args.output:
+        import json
+        with open(args.output,'w') as f:
+            json.dump(OrderedDict([('environment', environment()), ('repeat', args.repeat), ('results', RESULTS)]),f,indent=1)
+    if args.compare:
+        import json
+        with open(args.compare) as f:
+            compare(RESULTS, json.load(f))
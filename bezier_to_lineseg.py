@@ -22,6 +22,7 @@ import numpy as np
 
 DEFAULT_TOLERANCE = 0.15
 DEFAULT_SIMPLIFY_DISTANCE = 0.001   # range 0.001 ~ 5.0
+MAX_SUBDIVISION_DEPTH = 32 # keeps the ordering keys of getPointsOnBezierCurvesBatch exact
 
 
 
@@ -70,6 +71,66 @@ def getPointsOnBezierCurves(points, tolerance):
     return newPoints
 
 
+# gets points across all segments, subdividing all segments together
+# same points as getPointsOnBezierCurves, but the end point shared by two adjacent curves is added once
+def getPointsOnBezierCurvesBatch(points, tolerance, max_depth=MAX_SUBDIVISION_DEPTH):
+    points = np.asarray(points,dtype=float).reshape([-1,2])
+    numSegments = (len(points) - 1) // 3
+    if numSegments <= 0:
+        return np.zeros([0,2],dtype=float)
+
+    # work queue: control points of curves, shape (-1, 4, 2), all at the same depth
+    curves = points[(np.arange(numSegments) * 3).reshape([-1,1]) + np.arange(4)]
+    # segment index + start t of each curve, to restore the order of the recursive version
+    keys = np.arange(numSegments,dtype=float)
+    size = 1.0
+
+    flat_curves = []
+    flat_keys = []
+    for depth in range(max_depth + 1):
+        p1, p2, p3, p4 = curves[:,0], curves[:,1], curves[:,2], curves[:,3]
+
+        # flatness
+        u = np.square(3 * p2 - 2 * p1 - p4)
+        v = np.square(3 * p3 - 2 * p4 - p1)
+        _max = np.maximum(u,v)
+        flat = _max[:,0] + _max[:,1] < tolerance
+        if depth == max_depth:
+            flat[:] = True
+        flat_curves.append(curves[flat])
+        flat_keys.append(keys[flat])
+        if np.all(flat):
+            break
+
+        # subdivide
+        t = 0.5
+        split = ~flat
+        p1, p2, p3, p4 = p1[split], p2[split], p3[split], p4[split]
+
+        q1 = lerp(p1, p2, t)
+        q2 = lerp(p2, p3, t)
+        q3 = lerp(p3, p4, t)
+
+        r1 = lerp(q1, q2, t)
+        r2 = lerp(q2, q3, t)
+
+        red = lerp(r1, r2, t)
+
+        size *= 0.5
+        curves = np.concatenate([
+            np.stack([p1, q1, r1, red],axis=1), # 1st half
+            np.stack([red, r2, q3, p4],axis=1), # 2nd half
+        ],axis=0)
+        keys = np.concatenate([keys[split], keys[split] + size])
+
+    flat_curves = np.concatenate(flat_curves,axis=0)
+    order = np.argsort(np.concatenate(flat_keys),kind='mergesort')
+    flat_curves = flat_curves[order]
+
+    # start point of each flat curve, and the end point of the last one
+    return np.concatenate([flat_curves[:,0], flat_curves[-1:,3]],axis=0)
+
+
 def lerp(a, b, t, to_list=None):
     to_list = isinstance(a, list) if to_list is None else to_list
     result = np.add(a, np.subtract(b, a) * t)
@@ -103,42 +164,63 @@ def distanceToSegment(p, v, w):
 # Ramer Douglas Peucker algorithm
 def simplifyPoints(points, start, end, epsilon, newPoints=None):
     outPoints = [] if newPoints is None else newPoints
+    points = np.asarray(points,dtype=float)
+    outPoints.extend(points[start:end][simplifyPointsMask(points[start:end], epsilon)])
+    return outPoints
 
-    # find the most distant point from the line formed by the endpoints
-    s = points[start]
-    e = points[end - 1]
-    maxDistSq = 0
-    maxNdx = 1
-    for i in range(start+1, end-1):
-        distSq = distanceToSegmentSq(points[i], s, e)
-        if distSq > maxDistSq:
-            maxDistSq = distSq
-            maxNdx = i
-
-    # if that point is too far
-    if np.sqrt(maxDistSq) > epsilon:
-
-        # split
-        # simplifyPoints(points, start, maxNdx + 1, epsilon, outPoints)
-        simplifyPoints(points, start, maxNdx, epsilon, outPoints)
-        simplifyPoints(points, maxNdx, end, epsilon, outPoints)
 
-    else:
+# Ramer Douglas Peucker algorithm, without recursion
+# returns a mask of the points to keep, same points as the recursive version:
+# a range is split into [start, maxNdx) and [maxNdx, end), the 2 end points of every final range are kept
+def simplifyPointsMask(points, epsilon):
+    points = np.asarray(points,dtype=float)
+    keep = np.zeros(len(points),dtype=bool)
+
+    stack = [(0, len(points))] if len(points) > 0 else []
+    while stack:
+        start, end = stack.pop()
+        s = points[start]
+        e = points[end - 1]
+
+        # find the most distant point from the line formed by the endpoints
+        maxDistSq = 0
+        if end - start > 2:
+            distSq = distanceToSegmentSqArray(points[start+1:end-1], s, e)
+            maxNdx = start + 1 + np.argmax(distSq)
+            maxDistSq = distSq[maxNdx - start - 1]
+
+        # if that point is too far
+        if np.sqrt(maxDistSq) > epsilon:
+
+            # split (2nd half is pushed first, so the 1st half is done first)
+            stack.append((maxNdx, end))
+            stack.append((start, maxNdx))
 
-        if np.all(s == e):
-            outPoints.extend([s])
         else:
+
             # add the 2 end points
-            outPoints.extend([s,e])
+            keep[start] = True
+            if not np.all(s == e):
+                keep[end - 1] = True
 
-    return outPoints
+    return keep
+
+
+# compute the distance squared from each of points to the line segment
+# formed by v and w, same as distanceToSegmentSq
+def distanceToSegmentSqArray(points, v, w):
+    l2 = distanceSq(v, w)
+    if l2 == 0:
+        return np.sum(np.square(points - v),axis=1)
+    t = ((points[:,0] - v[0]) * (w[0] - v[0]) + (points[:,1] - v[1]) * (w[1] - v[1])) / l2
+    t = np.maximum(0, np.minimum(1, t)).reshape([-1,1])
+    return np.sum(np.square(points - lerp(v, w, t)),axis=1)
 
 
 def bezier_to_lineseg(curve_points, tolerance=DEFAULT_TOLERANCE, simplify_eps=DEFAULT_SIMPLIFY_DISTANCE):
-    points = getPointsOnBezierCurves(curve_points, tolerance)
+    points = getPointsOnBezierCurvesBatch(curve_points, tolerance)
     if simplify_eps > 0:
-        new_points = simplifyPoints(points, 0, len(points), simplify_eps)
-        points = new_points
+        points = points[simplifyPointsMask(points, simplify_eps)]
     return np.array(points)
 
 
@@ -1,7 +1,7 @@
 :
-for i in 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29 30
-do
-  python -u generate.py --base_shape 1
-  python -u generate.py --base_shape 2
-  python -u generate.py --base_shape 3 --map_coord xz
-done
+# 30 x (shape 1, shape 2, shape 3 in xz coords), new random seed for each object
+python -u generate_many.py --repeat 30 \
+  --job "--base_shape 1" \
+  --job "--base_shape 2" \
+  --job "--base_shape 3 --map_coords xz" \
+  "$@"
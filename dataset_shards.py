@@ -0,0 +1,256 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+generated objects packed into a few large shards, and read back as a stream
+
+a shard is a fragment archive (fragment_archive.py) holding the fragments of many objects, objects
+are never split between shards. index.json in the dataset directory lists the shards and, for every
+object, its shard, first fragment in the shard and number of fragments
+
+  python dataset_shards.py --output dataset outputs more_outputs ...   (--shard_size 256, in MB)
+
+inputs are directories of generate.py outputs, searched recursively for objects written as text
+(<prefix>_part_N.node/.ele/.face/.npy) or as archives (<prefix>.fragments)
+
+  reader = ShardReader('dataset', shuffle=True, seed=1)
+  for epoch in range(10):
+      for name, ptcloud in reader.epoch(epoch):
+          ...
+
+every shard is read with one sequential read (of the point cloud section only, when streaming point clouds),
+in background threads, ahead of use.
+shuffling permutes the shards and the fragments within a loaded shard, so it never makes small random reads
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import sys
+import json
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from tetgen_object import TetgenObject
+from fragment_archive import FragmentArchive, save_archive, ARCHIVE_SUFFIX
+
+INDEX_FILENAME = 'index.json'
+INDEX_VERSION = 1
+DEFAULT_SHARD_BYTES = 256 * 1024**2
+
+TEXT_PART_PATTERN = re.compile(r'^(.*)_part_([0-9]+)\.node$')
+
+
+def find_objects(input_dirs):
+    """
+    list of (object name, [fragment loaders]) of the generate.py outputs in input_dirs
+    an object name is the name of the input directory and the prefix relative to it (outputs/generated_11_1_5),
+    a loader returns (TetgenObject, point-cloud)
+    objects with a fragment file missing (run interrupted, ...) are skipped
+    """
+    objects = []
+    for input_dir in input_dirs:
+        for root, dirs, filenames in os.walk(input_dir):
+            dirs.sort()
+            if INDEX_FILENAME in filenames: # a packed dataset
+                dirs[:] = []
+                continue
+            parts = collections.defaultdict(list)
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                m = TEXT_PART_PATTERN.match(filename)
+                if m is not None:
+                    parts[m.group(1)].append((int(m.group(2)), path[:-len('.node')]))
+                elif filename.endswith(ARCHIVE_SUFFIX):
+                    name = _object_name(input_dir, path[:-len(ARCHIVE_SUFFIX)])
+                    objects.append((name, _archive_loaders(path)))
+            for prefix, numbered in sorted(parts.items()):
+                name = _object_name(input_dir, os.path.join(root, prefix))
+                numbers = [number for number, _ in numbered]
+                complete = all(os.path.exists(part_name + ext) for _, part_name in numbered for ext in ('.ele', '.face', '.npy'))
+                if not complete or sorted(numbers) != list(range(1, len(numbers)+1)):
+                    print('skipping incomplete object',os.path.join(root, prefix),file=sys.stderr)
+                    continue
+                objects.append((name, [_text_loader(part_name) for _, part_name in sorted(numbered)]))
+    return objects
+
+
+def _object_name(input_dir, prefix):
+    input_dir = os.path.normpath(input_dir)
+    return os.path.join(os.path.basename(os.path.abspath(input_dir)), os.path.relpath(prefix, input_dir))
+
+
+def _text_loader(part_name):
+    def load():
+        obj = TetgenObject()
+        obj.load(part_name, sidecar=False)
+        return obj, np.load(part_name + '.npy')
+    return load
+
+
+def _archive_loaders(filename):
+    archive = FragmentArchive(filename)
+    return [lambda i=i: archive[i] for i in range(len(archive))]
+
+
+def _fragment_bytes(obj, ptcloud):
+    arrays = [ptcloud] + [getattr(getattr(obj, name), key) for name in ('nodes', 'elems', 'faces')
+                          for key in getattr(obj, name).ARRAYS]
+    return sum(np.asarray(array).nbytes for array in arrays)
+
+
+def pack(input_dirs, output_dir, shard_bytes=DEFAULT_SHARD_BYTES):
+    """
+    pack all objects in input_dirs into shards of about shard_bytes each (a shard is closed
+    once it reaches shard_bytes) in output_dir, and write the index
+    returns the index
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    objects = find_objects(input_dirs)
+    index = collections.OrderedDict(version=INDEX_VERSION, shards=[], objects=[])
+    next_object = [0]
+
+    def shard_fragments(shard, names):
+        # fragments of whole objects, until the shard is full
+        size = 0
+        while next_object[0] < len(objects) and size < shard_bytes:
+            name, loaders = objects[next_object[0]]
+            next_object[0] += 1
+            index['objects'].append(collections.OrderedDict(
+                name=name, shard=shard, first=len(names), num_fragments=len(loaders)))
+            for i, load in enumerate(loaders):
+                obj, ptcloud = load()
+                size += _fragment_bytes(obj, ptcloud)
+                names.append('{:s}_part_{:d}'.format(name, i+1))
+                yield obj, ptcloud
+
+    while next_object[0] < len(objects):
+        shard = len(index['shards'])
+        filename = 'shard_{:05d}{:s}'.format(shard, ARCHIVE_SUFFIX)
+        names = []
+        save_archive(os.path.join(output_dir, filename), shard_fragments(shard, names), names=names)
+        index['shards'].append(collections.OrderedDict(
+            filename=filename, num_fragments=len(names), bytes=os.path.getsize(os.path.join(output_dir, filename))))
+        print('packed shard {:s}, {:d} fragments, {:d}/{:d} objects'.format(
+            filename, len(names), next_object[0], len(objects)),file=sys.stderr)
+
+    index_filename = os.path.join(output_dir, INDEX_FILENAME)
+    with open(index_filename + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.rename(index_filename + '.tmp', index_filename)
+    return index
+
+
+class ShardReader(object):
+    """
+    stream of the fragments of a packed dataset (pack)
+    what: 'ptcloud' yields (fragment name, point-cloud),
+          'fragment' yields (fragment name, TetgenObject, point-cloud)
+    shuffle: visit shards in random order, and fragments of a shard in random order, new order every epoch
+    prefetch: number of shards read ahead of the one in use (memory use is about prefetch+1 shards)
+    num_threads: threads reading shards
+    """
+    def __init__(self, dataset_dir, what='ptcloud', shuffle=False, seed=0, prefetch=2, num_threads=2):
+        assert what in ('ptcloud', 'fragment'), what
+        self.dataset_dir = dataset_dir
+        with open(os.path.join(dataset_dir, INDEX_FILENAME)) as f:
+            self.index = json.load(f)
+        assert self.index['version'] == INDEX_VERSION, ('unsupported index version',self.index['version'])
+        self.what = what
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        self.num_threads = num_threads
+
+    def __len__(self):
+        return sum(shard['num_fragments'] for shard in self.index['shards'])
+
+    def __iter__(self):
+        return self.epoch(0)
+
+    def load_object(self, name):
+        """
+        list of (TetgenObject, point-cloud) of the fragments of an object, by name (see find_objects)
+        memory-mapped, only the pages of the object are read
+        """
+        if not hasattr(self, '_objects'):
+            self._objects = {entry['name']: entry for entry in self.index['objects']}
+        entry = self._objects[name]
+        archive = FragmentArchive(os.path.join(self.dataset_dir, self.index['shards'][entry['shard']]['filename']))
+        return [archive[i] for i in range(entry['first'], entry['first'] + entry['num_fragments'])]
+
+    def load_shard(self, shard):
+        # point clouds are stored together at the end of a shard, and read without the meshes
+        return FragmentArchive(os.path.join(self.dataset_dir, self.index['shards'][shard]['filename']),
+                               preload='ptclouds' if self.what == 'ptcloud' else True)
+
+    def shards(self, order):
+        """
+        loaded shards (FragmentArchive) in order, read by background threads ahead of use
+        """
+        executor = ThreadPoolExecutor(self.num_threads)
+        pending = collections.deque()
+        try:
+            for shard in order:
+                pending.append(executor.submit(self.load_shard, shard))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def epoch(self, epoch=0):
+        """
+        iterator over all fragments, shuffled with seed and epoch if shuffle
+        """
+        rs = np.random.RandomState([self.seed, epoch])
+        order = np.arange(len(self.index['shards']))
+        if self.shuffle:
+            rs.shuffle(order)
+        for archive in self.shards(order):
+            names = archive.info['names']
+            fragments = np.arange(len(archive))
+            if self.shuffle:
+                rs.shuffle(fragments)
+            for i in fragments:
+                if self.what == 'ptcloud':
+                    yield names[i], archive.ptcloud(i)
+                else:
+                    obj, ptcloud = archive[i]
+                    yield names[i], obj, ptcloud
+
+
+from argparse import ArgumentParser
+
+def parse_args(argv=None):
+    parser = ArgumentParser()
+    parser.add_argument('--output',type=str,required=True) # dataset directory
+    parser.add_argument('--shard_size',type=float,default=DEFAULT_SHARD_BYTES/1024**2) # MB
+    parser.add_argument('inputs',type=str,nargs='+') # directories of generate.py outputs
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    index = pack(args.inputs, args.output, int(args.shard_size * 1024**2))
+    print('{:d} objects in {:d} shards, index {:s}'.format(
+        len(index['objects']), len(index['shards']), os.path.join(args.output, INDEX_FILENAME)),file=sys.stderr)
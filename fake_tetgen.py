@@ -0,0 +1,121 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+stand-in for the tetgen executable, for benchmarks and tests on machines without tetgen
+
+replays a recorded tetrahedral mesh instead of meshing the input: the fragments of a recorded object
+(outputs/*_part_*.node/.ele) are merged back into one mesh, and written as <input>.1.node/.ele/.face.
+the mesh does not follow the input .smesh, but has the u, v node attributes the fragment extraction needs
+
+usage: TETGEN="python fake_tetgen.py" python generate.py ...
+       python fake_tetgen.py [switches] input.smesh
+
+environment:
+  FAKE_TETGEN_RECORDING  prefix of the recorded fragments (default outputs/generated_11_0_64373)
+  FAKE_TETGEN_SECONDS    seconds to sleep, to simulate tetgen run time (default 0)
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import glob
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tetgen_object import TetgenObject, elems_to_faces2
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outputs', 'generated_11_0_64373')
+
+
+def load_recording(prefix):
+    """
+    merge the recorded fragments prefix_part_*.node/.ele into one tetrahedral mesh
+    nodes shared by fragments are merged by position
+    """
+    part_names = sorted(os.path.splitext(name)[0] for name in glob.glob(prefix + '_part_*.ele'))
+    assert len(part_names) > 0, ('no recorded fragments',prefix)
+
+    points, attrs, markers, elems = [], [], [], []
+    offset = 0
+    for part_name in part_names:
+        part = TetgenObject()
+        part.nodes.load(part_name + '.node')
+        part.elems.load(part_name + '.ele')
+        points.append(part.nodes.points)
+        attrs.append(part.nodes.attrs)
+        markers.append(part.nodes.boundary_markers)
+        elems.append(part.elems.elems + offset)
+        offset += part.nodes.num_points
+
+    points = np.concatenate(points,axis=0)
+    _, first, inverse = np.unique(points,axis=0,return_index=True,return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # keep merged nodes in order of first appearance
+    order = np.argsort(first, kind='mergesort')
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    keep = first[order]
+
+    obj = TetgenObject()
+    obj.nodes.points = points[keep]
+    obj.nodes.num_points = len(keep)
+    obj.nodes.dim = 3
+    obj.nodes.attrs = np.concatenate(attrs,axis=0)[keep]
+    obj.nodes.num_attrs = obj.nodes.attrs.shape[1]
+    obj.nodes.boundary_markers = np.concatenate(markers,axis=0)[keep]
+    obj.nodes.has_boundary_markers = 1
+    obj.elems.elems = remap[inverse[np.concatenate(elems,axis=0)]]
+    obj.elems.num_elems = len(obj.elems.elems)
+    obj.elems.num_nodes = 4
+    obj.elems.num_attrs = 0
+    obj.elems.attrs = np.empty(0)
+
+    # boundary faces: faces of a single tetrahedron
+    faces, counts = elems_to_faces2(obj.elems.elems)
+    obj.faces.faces = faces[counts == 1]
+    obj.faces.num_faces = len(obj.faces.faces)
+    obj.faces.boundary_markers = np.ones(obj.faces.num_faces,dtype=int)
+    obj.faces.has_boundary_markers = 1
+    return obj
+
+
+def main(argv):
+    inputs = [arg for arg in argv if not arg.startswith('-')]
+    assert len(inputs) == 1, 'usage: fake_tetgen.py [switches] input.smesh'
+    out_filebase = os.path.splitext(inputs[0])[0] + '.1'
+
+    start = time.time()
+    obj = load_recording(os.environ.get('FAKE_TETGEN_RECORDING', DEFAULT_RECORDING))
+    time.sleep(float(os.environ.get('FAKE_TETGEN_SECONDS', 0)))
+    meshing = time.time() - start
+
+    start = time.time()
+    obj.save(out_filebase)
+    output = time.time() - start
+
+    # timing lines in the format of tetgen (see tetgen-error.log)
+    print('Replayed {:d} nodes, {:d} tetrahedra.'.format(obj.nodes.num_points, obj.elems.num_elems))
+    print('Delaunay seconds:  {:g}'.format(meshing))
+    print('Output seconds:  {:g}'.format(output))
+    print('Total running seconds:  {:g}'.format(meshing + output))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
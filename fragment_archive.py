@@ -0,0 +1,207 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+all fragments of an object in one file, <prefix>.fragments, instead of four files per fragment
+(_part_N.node, .ele, .face, .npy)
+
+layout: magic, index offset and size (uint64 each), the mesh arrays of fragment 1, of fragment 2, ...,
+the point clouds of all fragments, and the json index at the end. the index holds, for every fragment,
+the header values and (name, dtype, shape, offset) of the arrays of its nodes, elems and faces, and of
+its point cloud, and the byte range of the point clouds (for readers of point clouds only).
+arrays are raw little-endian data, each aligned to tetgen_object.SIDECAR_ALIGN bytes.
+a reader memory-maps the file, so loading one fragment reads the pages of that fragment only
+
+usage: python fragment_archive.py archive.fragments [output_prefix]
+       writes the fragments as tetgen text files, output_prefix_part_N.node/.ele/.face/.npy
+       (default output_prefix: the archive name without .fragments)
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import json
+import mmap
+import struct
+import threading
+import numpy as np
+
+from tetgen_object import TetgenObject, little_endian, map_array, align_offset
+
+ARCHIVE_SUFFIX = '.fragments'
+ARCHIVE_MAGIC = b'TETFRAGS'
+ARCHIVE_VERSION = 2 # 2: point clouds in a section of their own (index ptclouds)
+PREAMBLE = struct.Struct('<8sQQ') # magic, index offset, index size
+
+PART_NAMES = ('nodes', 'elems', 'faces')
+
+
+def save_archive(filename, parts, **info):
+    """
+    write fragments as one archive
+    parts: list of (TetgenObject, point-cloud), as from tetgen_object.rebuild_submeshes,
+        the items are set to None once written, so that written fragments can be freed.
+        or any iterable of (TetgenObject, point-cloud)
+    info: json values stored in the index (prefix, num_fracs, ...)
+    """
+    fragments = []
+    temp_filename = '{:s}.{:d}.{:d}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(temp_filename, 'wb') as f:
+            f.write(PREAMBLE.pack(ARCHIVE_MAGIC, 0, 0))
+            offset = align_offset(PREAMBLE.size)
+
+            def write_array(value):
+                nonlocal offset
+                value = little_endian(value)
+                f.seek(offset)
+                f.write(value.data)
+                entry = [value.dtype.str, list(value.shape), offset]
+                offset = align_offset(offset + value.nbytes)
+                return entry
+
+            ptclouds = [] # small next to the meshes, kept until the meshes are written
+            for obj, ptcloud in _consume(parts):
+                fragment = {}
+                for name in PART_NAMES:
+                    part = getattr(obj, name)
+                    fragment[name] = {
+                        'header': [int(getattr(part, key)) for key in part.HEADER],
+                        'arrays': [[key] + write_array(getattr(part, key)) for key in part.ARRAYS]}
+                fragments.append(fragment)
+                ptclouds.append(ptcloud)
+                del obj, ptcloud
+
+            ptclouds_start = offset
+            for fragment, ptcloud in zip(fragments, ptclouds):
+                fragment['ptcloud'] = write_array(ptcloud)
+            del ptclouds
+
+            index = json.dumps({'version': ARCHIVE_VERSION, 'info': info, 'ptclouds': [ptclouds_start, offset],
+                                'fragments': fragments}).encode('utf-8')
+            f.seek(offset)
+            f.write(index)
+            f.seek(0)
+            f.write(PREAMBLE.pack(ARCHIVE_MAGIC, offset, len(index)))
+        # readers never see a partial archive
+        os.rename(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def _consume(parts):
+    if isinstance(parts, list):
+        for i in range(len(parts)):
+            part = parts[i]
+            parts[i] = None
+            yield part
+    else:
+        for part in parts:
+            yield part
+
+
+class FragmentArchive(object):
+    """
+    read-only view of an archive (save_archive), fragments are numbered from 0
+      archive = FragmentArchive('outputs/generated_11_1_1.fragments')
+      obj, ptcloud = archive[3] # fragment _part_4
+    arrays share the memory-mapped pages of the file (copy-on-write), nothing is read until used
+    preload: read the whole file into memory at once instead, with one sequential read
+        (for streaming through archives on network storage, see dataset_shards.py),
+        'ptclouds' == read the point clouds only, fragment() is not available then
+    """
+    def __init__(self, filename, preload=False):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, index_offset, index_size = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            assert magic == ARCHIVE_MAGIC, ('not a fragment archive',filename)
+            f.seek(index_offset)
+            index = json.loads(f.read(index_size).decode('utf-8'))
+            assert index['version'] == ARCHIVE_VERSION, ('unsupported archive version',filename,index['version'])
+            self.base = 0 # file offset of buffer
+            if preload == 'ptclouds':
+                start, end = index['ptclouds']
+                f.seek(start)
+                self.buffer = bytearray(f.read(end - start))
+                self.base = start
+            elif preload:
+                f.seek(0)
+                self.buffer = bytearray(f.read())
+            else:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.has_meshes = preload != 'ptclouds'
+        self.info = index['info']
+        self.fragments = index['fragments']
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def __getitem__(self, i):
+        return self.fragment(i), self.ptcloud(i)
+
+    def fragment(self, i):
+        """
+        TetgenObject of fragment i
+        """
+        assert self.has_meshes, ('point clouds only',self.filename)
+        obj = TetgenObject()
+        for name in PART_NAMES:
+            part = getattr(obj, name)
+            entry = self.fragments[i][name]
+            for key, value in zip(part.HEADER, entry['header']):
+                setattr(part, key, value)
+            for key, dtype, shape, offset in entry['arrays']:
+                setattr(part, key, map_array(self.buffer, dtype, shape, offset - self.base))
+        return obj
+
+    def ptcloud(self, i):
+        """
+        point cloud (boundary face centers) of fragment i
+        """
+        dtype, shape, offset = self.fragments[i]['ptcloud']
+        return map_array(self.buffer, dtype, shape, offset - self.base)
+
+    def export(self, prefix, fragments=None):
+        """
+        write fragments (default all) as tetgen text files and point clouds, the files
+        generate.py writes without an archive: prefix_part_N.node/.ele/.face/.npy, N from 1
+        """
+        if fragments is None:
+            fragments = range(len(self))
+        for i in fragments:
+            part_name = prefix + '_part_{:d}'.format(i+1)
+            obj, ptcloud = self[i]
+            obj.save(part_name)
+            with open(part_name + '.npy', 'wb') as f:
+                np.save(f, ptcloud)
+
+
+def archive_filename(prefix):
+    return prefix + ARCHIVE_SUFFIX
+
+
+if __name__ == '__main__':
+    assert len(sys.argv) in (2, 3), 'usage: fragment_archive.py archive.fragments [output_prefix]'
+    filename = sys.argv[1]
+    if len(sys.argv) == 3:
+        prefix = sys.argv[2]
+    else:
+        prefix = filename[:-len(ARCHIVE_SUFFIX)] if filename.endswith(ARCHIVE_SUFFIX) else filename
+    archive = FragmentArchive(filename)
+    archive.export(prefix)
+    print('exported {:d} fragments to {:s}_part_*'.format(len(archive), prefix),file=sys.stderr)
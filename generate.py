@@ -20,20 +20,29 @@ import sys
 from simple_svg import normalize_svg
 
 import os
-import subprocess
+import copy
+import shlex
 import json
+import hashlib
+import threading
+from io import StringIO
+from collections import OrderedDict
 import numpy as np
-import matplotlib
-from scipy.spatial import Voronoi
-
-try: matplotlib.use('Agg')
-except: pass
 
 from parse_svg_path import parse_svg_path
 from bezier_to_lineseg import bezier_to_lineseg
-from lathe_path import lathe_path
+from lathe_path import lathe_path, DEFAULT_CAP_DENT
 from lathe_path import save_mesh
-from tetgen_object import load_tetgen, find_vertex_group, find_element_group, rebuild_submesh, rebuild_submesh2
+from site_index import UV_PERIOD
+from stage_cache import StageCache, stage_key, DEFAULT_MAX_BYTES
+from profiling import Profile, tracemalloc_available, TRACEMALLOC_UNAVAILABLE
+from atomic_files import StagedFiles, atomic_open
+from tetgen_watchdog import run_supervised, TetgenFailure, RESOURCE_FAILURES, OUTPUT_TAIL_LINES
+from fragment_archive import save_archive, archive_filename
+from tetgen_object import load_tetgen, find_vertex_group, find_element_group, mark_vertex_group, rebuild_submeshes
+from tetgen_object import sample_surfaces, TetgenObject
+from shell_preview import shatter_shells, shell_point_cloud
+from mesh_budget import plan_mesh, MIN_DIVISIONS
 
 svg_path_A = '''
 m 391.70976,851.54669 c 34.27007,-0.008 71.71313,-7.19875
@@ -83,8 +92,260 @@ m 72.9375,723.4247 c 34.16543,-0.28679 68.96657,-2.44188 102.5976,4.43271
 -46.9422,1.74073 -60.93221,2.68137 -90.32973,1.20633
 '''
 
-def main(args):
+TETGEN_SWITCHES = ["-p"]
+
+# tetgen command, TETGEN="python fake_tetgen.py" replays a recorded mesh (benchmarks, machines without tetgen)
+TETGEN_COMMAND = shlex.split(os.environ.get('TETGEN', 'tetgen'))
+
+
+def make_dirs(path):
+    # concurrent jobs may create the same directory
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def make_shatter_pattern(num_groups, random_seed, use_map_xz=False, periodic_pattern=False):
+    """
+    voronoi shatter pattern of num_groups cells in uv (or xz) space
+    returns voronoi_points, voronoi_group, period (None unless periodic)
+    """
+    from scipy.spatial import Voronoi # loaded on first use, see cold_start in benchmark.py
+
+    # a generator of its own, the global one is shared by the tetgen threads of generate_many --pipeline
+    cells = np.random.RandomState(random_seed).uniform([0.0,0.0],[1.0,1.0],size=[num_groups,2])
+
+    period = None
+    if use_map_xz:
+        voronoi = Voronoi(cells)
+        voronoi_points = voronoi.points[:]
+        voronoi_group = np.arange(len(voronoi_points))
+    elif periodic_pattern:
+        # u wraps around in nearest-site lookups, no mirrored points needed
+        voronoi_points = cells
+        voronoi_group = np.arange(len(voronoi_points))
+        period = UV_PERIOD
+    else:
+        cells_mirrored = np.concatenate([cells,cells + [-1.0, 0.0],cells + [1.0, 0.0],],axis=0)
+        voronoi = Voronoi(cells_mirrored)
+        voronoi_points = voronoi.points[:]
+        voronoi_group = np.arange(len(voronoi_points))
+        voronoi_group[num_groups:num_groups*2] -= num_groups
+        voronoi_group[num_groups*2:] -= num_groups * 2
+    return voronoi_points, voronoi_group, period
+
+
+def save_shatter_pattern(shatter_filename, num_groups, voronoi_points, voronoi_group, period=None):
+    voronoi_shatter = {
+        'num_groups': num_groups,
+        'point_group': voronoi_group.tolist(),
+        'point': voronoi_points.tolist(),
+    }
+    if period is not None:
+        voronoi_shatter['period'] = list(period)
+    with atomic_open(shatter_filename,'w') as f:
+        json.dump(voronoi_shatter,f)
+
+
+def run_tetgen(smesh_filename, record=None, switches=TETGEN_SWITCHES, timeout=0, max_memory=0):
+    """
+    call `tetgen` executable to make 3-d mesh (delaunay tetrahedralization)
+    record: None, or profile record of the stage, gets tetgen phase seconds (tetgen_phases),
+        cpu time and peak memory of the tetgen process (child_cpu_seconds, child_max_rss_bytes)
+    switches: tetgen switches, see mesh_budget.plan_mesh
+    timeout, max_memory: limits of the tetgen process, seconds and bytes, 0 == none (see tetgen_watchdog.py)
+    returns base name of the generated files (.ele, .face, .node), raises TetgenFailure
+    """
+    tetgen_args = TETGEN_COMMAND + list(switches) + [smesh_filename]
+    output = run_supervised(tetgen_args, timeout, max_memory, record)
+
+    tetgen_out_filebase = os.path.splitext(smesh_filename)[0] + '.1'
+    if not tetgen_output_exists(tetgen_out_filebase):
+        if record is not None:
+            record['failure'] = 'no_output'
+        raise TetgenFailure('no_output', 0, output[-OUTPUT_TAIL_LINES:])
+    return tetgen_out_filebase
+
+
+def shape_cache_files(shape_cache_dir, nodes, texcoords, triangles, switches=TETGEN_SWITCHES):
+    """
+    .smesh of the lathed shape without pattern markers, written once into the shape cache
+    the .smesh content, the tetgen command and switches are the cache key, so any change of shape parameters
+    (or perturbation) is a miss, and meshes of fake_tetgen.py are never taken for those of tetgen
+    returns .smesh file name, base name of the tetgen output
+    """
+    smesh = StringIO()
+    save_mesh(smesh,nodes,triangles,node_attrs=texcoords)
+    smesh = smesh.getvalue()
+    shape_key = hashlib.sha1((' '.join(TETGEN_COMMAND + list(switches)) + '\n' + smesh).encode('utf-8')).hexdigest()
+
+    make_dirs(shape_cache_dir)
+    smesh_filename = os.path.join(shape_cache_dir, shape_key + '.smesh')
+    if not os.path.exists(smesh_filename):
+        # other jobs of the same shape may be reading it
+        temp_filename = '{:s}.{:d}.tmp'.format(smesh_filename, os.getpid())
+        with open(temp_filename,'w') as f:
+            f.write(smesh)
+        os.rename(temp_filename, smesh_filename)
+    return smesh_filename, os.path.join(shape_cache_dir, shape_key + '.1')
+
+
+def tetgen_output_exists(tetgen_out_filebase):
+    return all(os.path.exists(tetgen_out_filebase + ext) for ext in ('.node', '.ele', '.face'))
+
+
+def count_tets(tetgen_out_filebase):
+    # number of tetrahedra, from the header of the .ele file
+    with open(tetgen_out_filebase + '.ele') as f:
+        return int(f.readline().split()[0])
+
+
+def write_fragments(obj1, prefix, num_fracs, voronoi_points, voronoi_group, period=None, profile=None, fragment_format='text',
+                    num_sample_points=0, random_state=None):
+    """
+    fragment_format: 'text' (tetgen files and a point cloud per fragment) or 'archive' (one file, see fragment_archive.py)
+    num_sample_points: if > 0, also write <prefix>.samples.npz, that many surface points of every fragment
+        (see save_samples), drawn with random_state (numpy RandomState, needed then)
+    """
+    if profile is None:
+        profile = Profile()
+
+    # group 별로 파편 생성, 출력
+    selections = [-(i+2) for i in range(num_fracs)]
+    elem_group = None
+    if num_sample_points > 0:
+        assert random_state is not None, 'surface samples need a RandomState'
+        with profile.stage('sample_surfaces'):
+            elem_group = find_element_group(obj1.elems.elems,obj1.nodes.attrs,voronoi_points,voronoi_group,period)
+            save_samples(prefix + '.samples.npz', *sample_surfaces(obj1,elem_group,selections,num_sample_points,random_state))
+
+    with profile.stage('rebuild_submeshes'):
+        parts = rebuild_submeshes(obj1,selections,voronoi_points,voronoi_group,period,elem_group)
+
+    with profile.stage('save_fragments'):
+        if fragment_format == 'archive':
+            print('writing archive',archive_filename(prefix),file=sys.stderr)
+            save_archive(archive_filename(prefix), parts, prefix=os.path.basename(prefix), num_fracs=num_fracs)
+        else:
+            save_fragments(prefix, parts)
+
+
+def save_samples(filename, points, normals, fracture):
+    """
+    surface samples of all fragments, one row per fragment (_part_1 first):
+      points (fragments, N, 3), normals (fragments, N, 3) pointing out of the fragment,
+      fracture (fragments, N) True on fracture faces, False on the original surface
+    """
+    print('writing surface samples',filename,file=sys.stderr)
+    with atomic_open(filename,'wb') as f:
+        np.savez(f, points=points, normals=normals, fracture=fracture)
+
+
+def save_shells(prefix, shells, fragment_format='text'):
+    """
+    fragment shells (shell_preview.shatter_shells) as <prefix>_part_N.smesh, with u, v node attributes and
+    face markers -(N+1) on the original surface, -1 on fractures (like the inner faces of tetgen fragments),
+    and point clouds of their face centers <prefix>_part_N.npy
+    fragment_format 'archive': all in <prefix>.fragments instead, as tetgen objects without elements
+    """
+    if fragment_format == 'archive':
+        parts = []
+        for i, (nodes, texcoords, triangles, fracture) in enumerate(shells):
+            obj = TetgenObject()
+            obj.nodes.points, obj.nodes.attrs = nodes, texcoords
+            obj.nodes.num_points, obj.nodes.dim, obj.nodes.num_attrs = len(nodes), 3, 2
+            obj.nodes.boundary_markers = np.empty(0,dtype=int)
+            obj.elems.elems, obj.elems.attrs = np.empty([0,4],dtype=int), np.empty(0)
+            obj.elems.num_nodes = 4
+            obj.faces.faces, obj.faces.boundary_markers = triangles, np.where(fracture,-1,-(i+2))
+            obj.faces.num_faces, obj.faces.has_boundary_markers = len(triangles), 1
+            parts.append((obj, shell_point_cloud(nodes, triangles)))
+        print('writing archive',archive_filename(prefix),file=sys.stderr)
+        save_archive(archive_filename(prefix), parts, prefix=os.path.basename(prefix), num_fracs=len(shells), preview=True)
+        return
+
+    with StagedFiles() as staged:
+        for i, (nodes, texcoords, triangles, fracture) in enumerate(shells):
+            part_name = prefix + '_part_{:d}'.format(i+1)
+            print('writing shell',part_name,file=sys.stderr)
+            with open(staged.temp(part_name + '.smesh'),'w') as f:
+                save_mesh(f,nodes,triangles,node_attrs=texcoords,face_boundary_markers=np.where(fracture,-1,-(i+2)))
+            with open(staged.temp(part_name + '.npy'),'wb') as f:
+                np.save(f, shell_point_cloud(nodes, triangles))
+
+
+def save_fragments(prefix, parts):
+    # all files under temporary names, renamed once all fragments are written
+    with StagedFiles() as staged:
+        for i in range(len(parts)):
+            part_name = prefix + '_part_{:d}'.format(i+1)
+            ptcloud_name = prefix + '_part_{:d}.npy'.format(i+1)
+
+            print('writing part',part_name,file=sys.stderr)
+
+            new_obj, new_ptcloud = parts[i]
+            parts[i] = None
+            new_obj.save(staged.temp(part_name, ('.node', '.ele', '.face')))
+
+            print('writing point-cloud',ptcloud_name,file=sys.stderr)
+
+            with open(staged.temp(ptcloud_name),'wb') as f:
+                np.save(f, new_ptcloud)
+            del new_obj
+
+
+# a run is split in three stages, prepare_job -> tetrahedralize_job -> fragment_job,
+# so that a scheduler (generate_many.py) can overlap the stages of different jobs.
+# the job dict passed between stages is small and can be sent to other processes
+#
+# with a stage cache (--stage_cache_dir), the output of every step is stored under a key of its inputs,
+# see stage_cache.py. keys are computed up front, and only the steps after the last cached one are run
+#
+# every step is timed (profiling.py), the records travel with the job dict. with --profile,
+# memory is measured too and fragment_job writes the run record to <prefix>.profile.json
+
+TETGEN_SUFFIXES = ('.smesh', '.1.node', '.1.ele', '.1.face')
+
+def fragment_suffixes(num_fracs, fragment_format='text', num_sample_points=0):
+    suffixes = ['.samples.npz'] if num_sample_points > 0 else []
+    if fragment_format == 'archive':
+        return suffixes + [archive_filename('')]
+    return suffixes + ['_part_{:d}{:s}'.format(i+1, ext) for i in range(num_fracs) for ext in ('.node', '.ele', '.face', '.npy')]
+
+
+def open_stage_cache(job):
+    if not job['stage_cache_dir']:
+        return None
+    return StageCache(job['stage_cache_dir'], job['stage_cache_bytes'])
 
+
+_MISSING = object()
+
+PROFILE_MEMORY = [None, 'rss', 'tracemalloc'] # by --profile
+
+def open_profile(job):
+    return Profile(memory=PROFILE_MEMORY[job['profile']], records=job['profile_records'])
+
+
+def cached_stage(cache, profile, stage, key, compute):
+    with profile.stage(stage) as record:
+        if cache is None:
+            return compute()
+        value = cache.get(stage, key, _MISSING)
+        if value is not _MISSING:
+            print('stage cache hit',stage,key,file=sys.stderr)
+            record['cached'] = True
+            return value
+        return cache.put(stage, key, compute())
+
+
+def prepare_job(args):
+    """
+    first stage: svg path, lathe, voronoi patterns and the .smesh input of tetgen
+    returns the job dict
+    """
     num_fracs = args.num_fracs
     random_seed = args.random_seed
     output_prefix = args.output_prefix
@@ -96,7 +357,17 @@ def main(args):
     num_divisions = args.num_divisions
     cap_start = args.cap_start
     cap_end = args.cap_end
+    cap_dent = args.cap_dent
+    chord_tolerance = args.chord_tolerance
     use_map_xz = args.map_coords == 'xz'
+    periodic_pattern = args.periodic_pattern
+    shape_cache_dir = args.shape_cache_dir
+    shape_seed = args.shape_seed
+    num_patterns = args.num_patterns
+    fragment_format = args.fragment_format
+    num_sample_points = args.num_sample_points
+    preview = bool(args.preview)
+    budget = args.target_tets > 0 or args.time_budget > 0
 
     if user_shape is None:
         if 0 == base_shape:
@@ -116,115 +387,324 @@ def main(args):
         random_seed = np.random.randint(0,1000000)
         print('random_seed auto generated',random_seed,file=sys.stderr)
 
+    # the shape is perturbed with its own seed, so that it can be shared by patterns of different seeds
+    if 0 == shape_seed:
+        shape_seed = random_seed
+
     if rand_perturbation:
-        rand_perturbation = np.random.randint(0, rand_perturbation*10000)/10000
+        # reproducible from shape_seed, so that cached shapes and stages are found again
+        rand_perturbation = np.random.RandomState(shape_seed).randint(0, rand_perturbation*10000)/10000
         print('rand_perturbation will be used',rand_perturbation,file=sys.stderr)
 
-    prefix = '{:s}_{:d}_{:d}_{:d}'.format(output_prefix,num_fracs,base_shape,random_seed)
-
     # create output directory if not exists
     output_dir = os.path.dirname(output_prefix)
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    make_dirs(output_dir)
 
 
     # load svg path, extract curve points
     svg_path = normalize_svg(user_shape)
 
-    with open(prefix + '_path.svg','w') as f:
-        f.write(svg_path)
-
-    # extract curve points from svg path
-    curve_points = parse_svg_path(svg_path, rand_perturbation=rand_perturbation, rand_seed=random_seed)
-
-    # convert curves to line segments
-    points = bezier_to_lineseg(curve_points, tolerance=tolerance, simplify_eps=simplify_eps)
-    # lathe line segments to build 3-d surface mesh
-    nodes, texcoords, triangles = lathe_path(points, num_divisions=num_divisions, cap_start=cap_start, cap_end=cap_end, use_map_xz=use_map_xz)
+    job = {
+        'num_fracs': num_fracs,
+        'shape_cache': bool(shape_cache_dir),
+        'stage_cache_dir': args.stage_cache_dir,
+        'stage_cache_bytes': int(args.stage_cache_size * 1024**3),
+        'profile': args.profile,
+        'profile_records': [],
+        'fragment_format': fragment_format,
+        'num_sample_points': num_sample_points,
+        'preview': preview,
+        'tetgen_switches': TETGEN_SWITCHES,
+        'mesh_budget': None,
+        # for retries of failed tetgen runs, see retry_args
+        'args': copy.copy(args),
+        'shape_params': OrderedDict([('random_seed', random_seed), ('base_shape', base_shape), ('shape_seed', shape_seed),
+                                     ('num_divisions', num_divisions), ('cap_dent', cap_dent)]),
+        'tetgen_limits': (args.tetgen_timeout, int(args.tetgen_max_memory * 1024**3)),
+        'tetgen_retries': args.tetgen_retries,
+        'tetgen_attempts': [],
+    }
+    cache = open_stage_cache(job)
+    profile = open_profile(job)
+
+    # keys of the shape steps, each includes the key of the step before it
+    parse_key = stage_key('parse_svg_path', svg_path, rand_perturbation, shape_seed)
+
+    def extract_curve_points():
+        # extract curve points from svg path
+        return parse_svg_path(svg_path, rand_perturbation=rand_perturbation, rand_seed=shape_seed)
+
+    if budget:
+        # tolerance, divisions and tetgen switches from the target, instead of the options
+        budget_key = stage_key('mesh_budget', parse_key, simplify_eps, args.target_tets, args.time_budget)
+        plan = cached_stage(cache, profile, 'mesh_budget', budget_key, lambda: plan_mesh(
+            cached_stage(cache, profile, 'parse_svg_path', parse_key, extract_curve_points),
+            simplify_eps, args.target_tets, args.time_budget))
+        tolerance = plan['tolerance']
+        num_divisions = plan['num_divisions']
+        job['tetgen_switches'] = plan['tetgen_switches']
+        job['shape_params']['num_divisions'] = num_divisions
+        job['mesh_budget'] = plan
+        print('mesh budget: target {:d} tetrahedra, tolerance {:g}, {:d} divisions, tetgen {:s}, predicted {:d} in {:.1f}s'.format(
+            plan['target_tets'], tolerance, num_divisions, ' '.join(plan['tetgen_switches']),
+            plan['predicted_tets'], plan['predicted_seconds']),file=sys.stderr)
+
+    if args.tetgen_switches:
+        job['tetgen_switches'] = shlex.split(args.tetgen_switches)
+
+    lineseg_key = stage_key('bezier_to_lineseg', parse_key, tolerance, simplify_eps)
+    lathe_key = stage_key('lathe_path', lineseg_key, num_divisions, cap_start, cap_end, use_map_xz, cap_dent, chord_tolerance)
+
+    def convert_to_lineseg():
+        curve_points = cached_stage(cache, profile, 'parse_svg_path', parse_key, extract_curve_points)
+        # convert curves to line segments
+        return bezier_to_lineseg(curve_points, tolerance=tolerance, simplify_eps=simplify_eps)
+
+    def lathe():
+        points = cached_stage(cache, profile, 'bezier_to_lineseg', lineseg_key, convert_to_lineseg)
+        # lathe line segments to build 3-d surface mesh
+        return lathe_path(points, num_divisions=num_divisions, cap_start=cap_start, cap_end=cap_end, use_map_xz=use_map_xz,
+                          cap_dent=cap_dent, chord_tolerance=chord_tolerance)
 
     # make voronoi shatter pattern
 
 
     num_groups = num_fracs
 
-    np.random.seed(random_seed)
-    cells = np.random.uniform([0.0,0.0],[1.0,1.0],size=[num_groups,2])
-
-    if use_map_xz:
-        voronoi = Voronoi(cells)
-        voronoi_points = voronoi.points[:]
-        voronoi_group = np.arange(len(voronoi_points))
+    if not shape_cache_dir:
+        num_patterns = 1
+
+    # one pattern per seed, random_seed, random_seed+1, ... (more than one with the shape cache only)
+    patterns = []
+    pattern_keys = []
+    for pattern_seed in range(random_seed, random_seed + num_patterns):
+        prefix = '{:s}_{:d}_{:d}_{:d}'.format(output_prefix,num_fracs,base_shape,pattern_seed)
+
+        with atomic_open(prefix + '_path.svg','w') as f:
+            f.write(svg_path)
+
+        pattern_key = stage_key('pattern', num_groups, pattern_seed, use_map_xz, periodic_pattern)
+        voronoi_points, voronoi_group, period = cached_stage(cache, profile, 'pattern', pattern_key,
+            lambda: make_shatter_pattern(num_groups, pattern_seed, use_map_xz, periodic_pattern))
+        save_shatter_pattern(prefix + '.voronoi.json', num_groups, voronoi_points, voronoi_group, period)
+        patterns.append((prefix, voronoi_points, voronoi_group, period))
+        pattern_keys.append(pattern_key)
+
+    # tetgen output depends on the shape, and on the pattern markers unless the shape is shared
+    tetgen_key = stage_key('tetgen', lathe_key, None if shape_cache_dir else pattern_keys[0], ' '.join(TETGEN_COMMAND), job['tetgen_switches'])
+    job['tetgen_key'] = tetgen_key
+    job['fragment_keys'] = [stage_key('fragments', tetgen_key, pattern_key, num_fracs, fragment_format, num_sample_points) for pattern_key in pattern_keys]
+    job['patterns'] = patterns
+    job['tetgen_cached'] = False
+
+    if preview:
+        # shells of the fragments from the lathed profile, no tetgen and no fragment stage
+        points = cached_stage(cache, profile, 'bezier_to_lineseg', lineseg_key, convert_to_lineseg)
+        for prefix, voronoi_points, voronoi_group, period in patterns:
+            with profile.stage('shells'):
+                shells = shatter_shells(points, voronoi_points, voronoi_group, num_groups, num_divisions, use_map_xz, period)
+            with profile.stage('save_shells'):
+                save_shells(prefix, shells, fragment_format)
+        job['tetgen_cached'] = True
+        job['smesh_filename'] = job['tetgen_out_filebase'] = None
+        job['profile_records'] = profile.records
+        return job
+
+    if shape_cache_dir:
+        # tetrahedralize once per shape, without pattern markers
+        shape_mesh = cache.get('shape_mesh', tetgen_key) if cache else None
+        if shape_mesh is not None and tetgen_output_exists(shape_mesh[1]):
+            with profile.stage('tetgen', cached=True):
+                print('stage cache hit','shape_mesh',tetgen_key,file=sys.stderr)
+            job['tetgen_cached'] = True
+        else:
+            nodes, texcoords, triangles = cached_stage(cache, profile, 'lathe_path', lathe_key, lathe)
+            with profile.stage('smesh'):
+                shape_mesh = shape_cache_files(shape_cache_dir, nodes, texcoords, triangles, job['tetgen_switches'])
+        smesh_filename, tetgen_out_filebase = shape_mesh
     else:
-        cells_mirrored = np.concatenate([cells,cells + [-1.0, 0.0],cells + [1.0, 0.0],],axis=0)
-        voronoi = Voronoi(cells_mirrored)
-        voronoi_points = voronoi.points[:]
-        voronoi_group = np.arange(len(voronoi_points))
-        voronoi_group[num_groups:num_groups*2] -= num_groups
-        voronoi_group[num_groups*2:] -= num_groups * 2
-
-    shatter_filename = prefix + '.voronoi.json'
-    voronoi_shatter = {
-        'num_groups': num_groups,
-        'point_group': voronoi_group.tolist(),
-        'point': voronoi.points.tolist(),
-    }
-    with open(shatter_filename,'w') as f:
-        json.dump(voronoi_shatter,f)
-
-    # create boundary markers for tetgen
-    # markers are negative numbers <= -2
-    vert_group = find_vertex_group(texcoords,voronoi_points,voronoi_group)
-    face_group = find_element_group(triangles,texcoords,voronoi_points,voronoi_group)
-
-    # create .smesh file to input to tetgen
-    # put u, v coords into node attributes (#=2)
-    # put group codes into vertice boundary markers, and into face boundary markers
-    smesh_filename = prefix + '.smesh'
-    with open(smesh_filename,'w') as f:
-        save_mesh(f,nodes,triangles,node_attrs=texcoords,node_boundary_markers=vert_group,face_boundary_markers=face_group)
-
-    # call `tetgen` executable to make 3-d mesh (delaunay tetrahedralization)
-    tetgen_args = [
-        "tetgen",
-        "-p",
-        smesh_filename,
-    ]
-    proc = subprocess.Popen(tetgen_args,bufsize=0,universal_newlines=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-    while True:
-        line = proc.stdout.readline()
-        if not line:
-            break
-        print(line.strip(),file=sys.stderr)
-
-    tetgen_out_filebase = prefix + '.1'
-    assert os.path.exists(tetgen_out_filebase + '.ele')
-
-    # read generated object files (.ele, .face, .node)
-    obj1 = load_tetgen(tetgen_out_filebase)
-
-    # group 별로 파편 생성, 출력
-
-    for i in range(num_fracs):
-        part_name = prefix + '_part_{:d}'.format(i+1)
-        ptcloud_name = prefix + '_part_{:d}.npy'.format(i+1)
-
-        print('writing part',part_name,file=sys.stderr)
+        smesh_filename = prefix + '.smesh'
+        tetgen_out_filebase = prefix + '.1'
+        if cache is not None:
+            with profile.stage('tetgen') as record:
+                if cache.get_files('tetgen', tetgen_key, prefix):
+                    print('stage cache hit','tetgen',tetgen_key,file=sys.stderr)
+                    record['cached'] = job['tetgen_cached'] = True
+        if not job['tetgen_cached']:
+            nodes, texcoords, triangles = cached_stage(cache, profile, 'lathe_path', lathe_key, lathe)
+
+            with profile.stage('smesh'):
+                # create boundary markers for tetgen
+                # markers are negative numbers <= -2
+                vert_group = find_vertex_group(texcoords,voronoi_points,voronoi_group,period)
+                face_group = find_element_group(triangles,texcoords,voronoi_points,voronoi_group,period)
+
+                # create .smesh file to input to tetgen
+                # put u, v coords into node attributes (#=2)
+                # put group codes into vertice boundary markers, and into face boundary markers
+                with open(smesh_filename,'w') as f:
+                    save_mesh(f,nodes,triangles,node_attrs=texcoords,node_boundary_markers=vert_group,face_boundary_markers=face_group)
+
+    job['smesh_filename'] = smesh_filename
+    job['tetgen_out_filebase'] = tetgen_out_filebase
+    job['profile_records'] = profile.records
+    return job
+
+
+# tetgen switches of a smaller, faster mesh: no refinement, no optimization
+LEAN_TETGEN_SWITCHES = ['-p', '-O0']
+
+def retry_args(job, failure):
+    """
+    generate.py arguments of the next tetgen attempt after a failure (see tetgen_watchdog.py), None == give up
+      timeout, out_of_memory: a smaller mesh, the lean switches, then half the divisions (or target)
+      others: another input surface, the profile perturbed with the next seed, else a deeper cap dent,
+          else the lean switches
+    the pattern (random_seed) stays the same
+    """
+    if failure == 'input_error':
+        return None
+    args = copy.copy(job['args'])
+    shape = job['shape_params']
+    args.random_seed = shape['random_seed']
+    args.base_shape = shape['base_shape']
+    args.shape_seed = shape['shape_seed']
+    lean = job['tetgen_switches'] == LEAN_TETGEN_SWITCHES
+
+    if failure in RESOURCE_FAILURES:
+        if not lean:
+            args.tetgen_switches = ' '.join(LEAN_TETGEN_SWITCHES)
+        elif job['mesh_budget'] is not None:
+            args.target_tets = job['mesh_budget']['target_tets'] // 2
+        elif shape['num_divisions'] > MIN_DIVISIONS:
+            args.num_divisions = max(MIN_DIVISIONS, shape['num_divisions'] // 2)
+        else:
+            return None
+    elif args.rand_perturbation > 0:
+        args.shape_seed = shape['shape_seed'] + 1
+    elif args.cap_start or args.cap_end:
+        args.cap_dent = 2 * shape['cap_dent'] if shape['cap_dent'] > 0 else DEFAULT_CAP_DENT
+    elif not lean:
+        args.tetgen_switches = ' '.join(LEAN_TETGEN_SWITCHES)
+    else:
+        return None
+    return args
 
-        sel = -(i+2)
 
-        new_obj, new_ptcloud = rebuild_submesh2(obj1,sel,voronoi_points,voronoi_group)
-        new_obj.save(part_name)
+def tetrahedralize_job(job, tetgen_lock=None):
+    """
+    second stage: tetgen, skipped when the tetrahedral mesh is in the shape cache or the stage cache
+    a failed tetgen run is retried up to tetgen_retries times, with the job prepared again from retry_args,
+    every run is recorded in job['tetgen_attempts'] (and in the run record, see fragment_job)
+    tetgen_lock: None, or function of a .smesh filename returning the lock held while tetgen runs on it
+        (jobs sharing a shape cache entry, see generate_many.run_pipeline), a retry takes the lock of its new .smesh
+    """
+    while not job['tetgen_cached']:
+        profile = open_profile(job)
+        attempt = OrderedDict(attempt=len(job['tetgen_attempts']) + 1, tetgen_switches=job['tetgen_switches'])
+        attempt.update(job['shape_params'])
+        lock = tetgen_lock(job['smesh_filename']) if tetgen_lock is not None else threading.Lock() # unshared == no lock
+        try:
+            with lock, profile.stage('tetgen') as record:
+                if job['shape_cache'] and tetgen_output_exists(job['tetgen_out_filebase']):
+                    print('shape cache hit',job['tetgen_out_filebase'],file=sys.stderr)
+                    record['cached'] = True
+                    attempt = None
+                else:
+                    tetgen_out_filebase = run_tetgen(job['smesh_filename'], record, job['tetgen_switches'], *job['tetgen_limits'])
+                    assert tetgen_out_filebase == job['tetgen_out_filebase']
+                    record['num_tets'] = count_tets(tetgen_out_filebase)
+
+                cache = open_stage_cache(job)
+                if cache is not None:
+                    if job['shape_cache']:
+                        cache.put('shape_mesh', job['tetgen_key'], (job['smesh_filename'], job['tetgen_out_filebase']))
+                    else:
+                        cache.put_files('tetgen', job['tetgen_key'], os.path.splitext(job['smesh_filename'])[0], TETGEN_SUFFIXES)
+        except TetgenFailure as e:
+            attempt.update(failure=e.failure, returncode=e.returncode, seconds=record.get('tetgen_seconds'),
+                           output_tail=e.output_tail)
+            attempts = job['tetgen_attempts'] + [attempt]
+            args = retry_args(job, e.failure) if len(attempts) <= job['tetgen_retries'] else None
+            print('tetgen attempt {:d} failed: {:s}, {:s}'.format(
+                len(attempts), e.failure, 'retrying' if args is not None else 'giving up'),file=sys.stderr)
+            job['tetgen_attempts'] = attempts
+            if args is None:
+                raise
+            records = profile.records
+            job.update(prepare_job(args))
+            job['tetgen_attempts'] = attempts
+            job['profile_records'] = records + job['profile_records']
+            continue
+
+        if attempt is not None:
+            attempt.update(failure=None, returncode=record['tetgen_returncode'], seconds=record['tetgen_seconds'])
+            job['tetgen_attempts'].append(attempt)
+        job['profile_records'] = profile.records
+        return
+
+
+def fragment_job(job):
+    """
+    third stage: split the tetrahedral mesh into the fragments of each pattern, write fragments and point clouds
+    returns the run record (see profiling.Profile.save), None without --profile
+    """
+    cache = open_stage_cache(job)
+    profile = open_profile(job)
+    num_fracs = job['num_fracs']
+
+    obj1 = None
+    # preview shells are written by prepare_job
+    fragment_patterns = [] if job['preview'] else zip(job['patterns'], job['fragment_keys'])
+    for (prefix, voronoi_points, voronoi_group, period), fragment_key in fragment_patterns:
+        if cache is not None:
+            with profile.stage('fragments') as record:
+                if cache.get_files('fragments', fragment_key, prefix):
+                    print('stage cache hit','fragments',fragment_key,file=sys.stderr)
+                    record['cached'] = True
+                    continue
+
+        if obj1 is None:
+            with profile.stage('load_tetgen'):
+                # read generated object files (.ele, .face, .node)
+                # cached shapes are loaded by many jobs, from the memory-mapped sidecars after the first
+                obj1 = load_tetgen(job['tetgen_out_filebase'], sidecar=bool(job['shape_cache']))
+            if job['shape_cache']:
+                assert obj1.nodes.num_attrs == 2 # u, v
+            shape_markers = obj1.nodes.boundary_markers
+
+        if job['shape_cache']:
+            obj1.nodes.boundary_markers = mark_vertex_group(shape_markers,obj1.nodes.attrs,voronoi_points,voronoi_group,period)
+        # samples are drawn with a seed from the fragment key, a rerun draws the samples of the cached entry
+        write_fragments(obj1, prefix, num_fracs, voronoi_points, voronoi_group, period, profile, job['fragment_format'],
+                        job['num_sample_points'], np.random.RandomState(int(fragment_key[:8], 16)))
+
+        if cache is not None:
+            cache.put_files('fragments', fragment_key, prefix, fragment_suffixes(num_fracs, job['fragment_format'], job['num_sample_points']))
+
+    job['profile_records'] = profile.records
+    info = {}
+    if job['tetgen_attempts']:
+        info['tetgen_attempts'] = job['tetgen_attempts']
+    if job['mesh_budget'] is not None and not job['preview']:
+        info['mesh_budget'] = budget = OrderedDict(job['mesh_budget'])
+        budget['num_tets'] = count_tets(job['tetgen_out_filebase'])
+        print('mesh budget: target {:d} tetrahedra, achieved {:d}'.format(budget['target_tets'], budget['num_tets']),file=sys.stderr)
+    if not job['profile']:
+        return None
+    prefix = job['patterns'][0][0]
+    return profile.save(prefix + '.profile.json', prefix=prefix, num_fracs=num_fracs, num_patterns=len(job['patterns']), **info)
 
-        print('writing point-cloud',ptcloud_name,file=sys.stderr)
 
-        with open(ptcloud_name,'wb') as f:
-            np.save(f, new_ptcloud)
-        del new_obj
+def main(args):
+    job = prepare_job(args)
+    tetrahedralize_job(job)
+    return fragment_job(job)
 
 
 from argparse import ArgumentParser
 
-def parse_args():
+def build_parser():
     parser = ArgumentParser()
     parser.add_argument('--base_shape',type=int,default=0) # 0 == random choice([1,2,3])
     parser.add_argument('--num_fracs',type=int,default=11)
@@ -235,11 +715,35 @@ def parse_args():
     parser.add_argument('--tolerance',type=float,default=0.02)
     parser.add_argument('--simplify_eps',type=float,default=0.001)
     parser.add_argument('--num_divisions',type=int,default=360)
+    parser.add_argument('--chord_tolerance',type=float,default=0) # > 0 == fewer columns on rows near the axis, chord error / largest radius (num_divisions at most)
     parser.add_argument('--cap_start',type=int,default=0)
     parser.add_argument('--cap_end',type=int,default=0)
+    parser.add_argument('--cap_dent',type=float,default=DEFAULT_CAP_DENT) # cap centers moved into the shape by this (tetgen error workaround)
     parser.add_argument('--map_coords',type=str,default='uv') # or you can choose 'xz'
-
-    args = parser.parse_args()
+    parser.add_argument('--periodic_pattern',type=int,default=0) # 1 == wrap u around instead of mirroring voronoi points (uv only)
+    parser.add_argument('--shape_cache_dir',type=str,default='') # tetrahedralize each shape once into this directory, '' == off
+    parser.add_argument('--shape_seed',type=int,default=0) # perturbation seed of the shape, 0 == random_seed
+    parser.add_argument('--num_patterns',type=int,default=1) # patterns per cached shape, seeds random_seed, random_seed+1, ...
+    parser.add_argument('--stage_cache_dir',type=str,default='') # cache of every stage output, keyed by its inputs, '' == off
+    parser.add_argument('--stage_cache_size',type=float,default=DEFAULT_MAX_BYTES/1024**3) # GB, least recently used entries are evicted
+    parser.add_argument('--fragment_format',type=str,default='text',choices=('text','archive')) # archive == all fragments in <prefix>.fragments
+    parser.add_argument('--num_sample_points',type=int,default=0) # > 0 == that many area-weighted surface points per fragment in <prefix>.samples.npz
+    parser.add_argument('--target_tets',type=int,default=0) # > 0 == choose tolerance, num_divisions and tetgen switches for about that many tetrahedra
+    parser.add_argument('--time_budget',type=float,default=0) # > 0 == seconds of tetgen, alone or with --target_tets (see mesh_budget.py)
+    parser.add_argument('--tetgen_switches',type=str,default='') # e.g. "-pq1.4 -O0", '' == -p (or those of the mesh budget)
+    parser.add_argument('--tetgen_timeout',type=float,default=0) # seconds, a longer tetgen run is killed and retried, 0 == no limit
+    parser.add_argument('--tetgen_max_memory',type=float,default=0) # GB of address space of tetgen, 0 == no limit
+    parser.add_argument('--tetgen_retries',type=int,default=2) # retries of a failed tetgen run, with adjusted shape or switches
+    parser.add_argument('--preview',type=int,default=0) # 1 == fragment shells (<prefix>_part_N.smesh) from the surface only, without tetgen
+    parser.add_argument('--profile',type=int,default=0) # write per-stage profile to <prefix>.profile.json, 1 == sample rss, 2 == tracemalloc (slow)
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if PROFILE_MEMORY[args.profile] == 'tracemalloc' and not tracemalloc_available():
+        parser.error(TRACEMALLOC_UNAVAILABLE)
     return args
 
 
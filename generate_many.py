@@ -0,0 +1,402 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+# batch dataset generation: many generate.main jobs in a pool of worker processes,
+# each worker imports numpy, scipy, matplotlib once and runs many jobs
+#
+#   python -u generate_many.py --repeat 30 --job "--base_shape 1" --job "--base_shape 2" --job "--base_shape 3 --map_coords xz"
+#   python -u generate_many.py --base_shape 1 2 3 --random_seed 1 2 3 4 --num_fracs 8 11 --num_workers 16
+#   python -u generate_many.py --pipeline 1 --max_tetgen 8 --repeat 30 --job "--base_shape 1"
+#   python -u generate_many.py --profile 1 --repeat 10 --job "--base_shape 1"   (profile_summary.json in output dir)
+#   python -u generate_many.py --resume 1 ...   (same options again: only the jobs not done in the journal)
+#
+# every job is journaled in <output dir>/journal.jsonl (--journal): one line when it starts, one when it is
+# done (with its output prefixes) or failed. outputs are renamed into place once written (atomic_files.py),
+# so a job is either done in the journal or has no complete outputs to trust. a restart with --resume 1
+# reads the journal only, and runs the jobs that are not done
+#
+# options not known here (--num_divisions, --output_prefix, ...) are passed to every job
+
+from __future__ import print_function,division,absolute_import
+import os
+import sys
+import copy
+import json
+import time
+import shlex
+import hashlib
+import itertools
+import traceback
+import threading
+import collections
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+try: from queue import Queue, Empty
+except ImportError: from Queue import Queue, Empty
+
+import generate
+from profiling import summarize
+
+# job options that can be given as a grid (one value or more each)
+GRID_OPTIONS = ('base_shape', 'random_seed', 'num_fracs', 'map_coords')
+
+
+def make_jobs(base_args, grid=None, job_lines=(), repeat=1):
+    """
+    list of generate.main arguments
+    base_args: arguments shared by all jobs (argparse.Namespace of generate.build_parser())
+    grid: {option: [values]}, every combination is a job
+    job_lines: generate.py command lines (e.g. "--base_shape 3 --map_coords xz"), each is crossed with the grid
+        and overrides it
+    repeat: number of times the whole list is repeated (use with random_seed 0 for new seeds)
+    """
+    parser = generate.build_parser()
+    grid = grid or {}
+    names = sorted(grid)
+    jobs = []
+    for line in job_lines or ['']:
+        for values in itertools.product(*[grid[name] for name in names]):
+            args = copy.copy(base_args)
+            for name, value in zip(names, values):
+                setattr(args, name, value)
+            jobs.append(parser.parse_args(shlex.split(line), namespace=args))
+    return [copy.copy(args) for _ in range(repeat) for args in jobs]
+
+
+JOURNAL_FILENAME = 'journal.jsonl'
+
+
+def job_key(index, args):
+    """
+    key of a job in the journal: its place in the batch and all its options
+    """
+    options = json.dumps([index, sorted(vars(args).items())])
+    return hashlib.sha1(options.encode('utf-8')).hexdigest()
+
+
+class JobJournal(object):
+    """
+    append-only journal of the jobs of a batch, one json line per state of a job:
+      {"job": key, "index": 3, "state": "started" | "done" | "failed", "time": ..., ...}
+    written by the worker processes and threads, every line with one O_APPEND write, so lines of concurrent
+    writers do not mix. the object is the file name only, and can be sent to worker processes
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def append(self, state, key=None, index=None, **info):
+        entry = collections.OrderedDict([('job', key), ('index', index), ('state', state), ('time', time.time()), ('pid', os.getpid())])
+        entry.update(info)
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def states(self):
+        """
+        {job key: last state} of the journal so far
+        """
+        states = {}
+        if not os.path.exists(self.filename):
+            return states
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError: # the last line of a killed batch may be cut
+                    continue
+                if entry.get('job') is not None:
+                    states[entry['job']] = entry['state']
+        return states
+
+
+def run_job(item):
+    index, args, key, journal = item
+    # every job starts from fresh random state, like a new `python generate.py` process.
+    # forked workers share the parent state and generate.main seeds the global generator,
+    # so auto generated seeds (random_seed 0) would repeat without this
+    np.random.seed()
+    start = time.time()
+    record = None
+    if journal is not None:
+        journal.append('started', key, index)
+    try:
+        # generate.main, keeping the job dict for the journal
+        job = generate.prepare_job(args)
+        generate.tetrahedralize_job(job)
+        record = generate.fragment_job(job)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    if journal is not None:
+        if error is None:
+            journal.append('done', key, index, prefixes=job_prefixes(job), seconds=time.time() - start)
+        else:
+            journal.append('failed', key, index, error=error.strip().splitlines()[-1], seconds=time.time() - start)
+    return index, error, time.time() - start, record
+
+
+def job_prefixes(job):
+    # output prefixes of a job dict (generate.prepare_job), one per pattern
+    return [pattern[0] for pattern in job['patterns']]
+
+
+def work_items(jobs, journal=None, indices=None):
+    # (index, args, journal key, journal) of the jobs to run, indices == None: all
+    if indices is None:
+        indices = range(len(jobs))
+    return [(index, jobs[index], job_key(index, jobs[index]), journal) for index in indices]
+
+
+def run_jobs(jobs, num_workers=None, records=None, journal=None, indices=None):
+    """
+    run generate.main for all jobs, returns list of (job index, traceback) of failed jobs
+    num_workers: number of worker processes, None == cpu count, 1 == in this process
+    records: None, or list to append the profile records of the jobs to (--profile)
+    journal: None, or JobJournal to record the states of the jobs in
+    indices: None, or indices of the jobs to run (the others are done, see --resume)
+    """
+    items = work_items(jobs, journal, indices)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(1, min(num_workers, len(items)))
+
+    if num_workers == 1:
+        pool = None
+        results = map(run_job, items)
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.imap_unordered(run_job, items, chunksize=1)
+
+    failed = []
+    start = time.time()
+    try:
+        for num_done, (index, error, seconds, record) in enumerate(results, 1):
+            if records is not None and record is not None:
+                records.append(record)
+            if error is not None:
+                failed.append((index, error))
+                print(error,file=sys.stderr)
+            print('job {:d} {:s} in {:.1f}s, {:d}/{:d} done, {:.1f}s elapsed'.format(
+                index, 'failed' if error else 'done', seconds, num_done, len(items), time.time() - start),file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return failed
+
+
+def _prepare_job(args):
+    np.random.seed() # see run_job
+    return generate.prepare_job(args)
+
+
+def run_pipeline(jobs, num_workers=None, max_tetgen=None, queue_size=None, records=None, sample_interval=0.5,
+                 journal=None, indices=None):
+    """
+    run jobs as a pipeline of the stages of generate.main, connected by bounded queues:
+      prepare (worker processes) -> tetgen (subprocesses) -> fragments (worker processes)
+    while tetgen meshes job N, job N+1 is prepared and the fragments of job N-1 are written.
+    a full queue blocks the stage before it, so at most queue_size jobs wait between two stages
+    num_workers: number of python worker processes, shared by prepare and fragments, None == cpu count
+    max_tetgen: number of tetgen processes running at the same time, None == num_workers
+    queue_size: capacity of the queues between stages, None == max_tetgen
+    records: None, or list to append the profile records of the jobs to (--profile)
+    journal, indices: see run_jobs
+    returns list of (job index, traceback) of failed jobs, {queue name: depth statistics}
+    """
+    items = work_items(jobs, journal, indices)
+    keys = {index: key for index, _, key, _ in items}
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if max_tetgen is None:
+        max_tetgen = num_workers
+    if queue_size is None:
+        queue_size = max_tetgen
+
+    executor = ProcessPoolExecutor(num_workers)
+    tetgen_locks = collections.defaultdict(threading.Lock) # jobs sharing a cached shape run its tetgen once
+    tetgen_locks_guard = threading.Lock()
+
+    def tetgen_lock(smesh_filename):
+        with tetgen_locks_guard:
+            return tetgen_locks[smesh_filename]
+
+    def tetrahedralize(job):
+        generate.tetrahedralize_job(job, tetgen_lock)
+        return job
+
+    # (name, function, number of threads), each stage reads the queue of its name
+    stages = [
+        ('prepare', lambda args: executor.submit(_prepare_job, args).result(), num_workers),
+        ('tetgen', tetrahedralize, max_tetgen),
+        ('fragments', lambda job: executor.submit(generate.fragment_job, job).result(), num_workers),
+    ]
+    queues = collections.OrderedDict()
+    queues['prepare'] = Queue() # holds all jobs from the start
+    queues['tetgen'] = Queue(queue_size)
+    queues['fragments'] = Queue(queue_size)
+    for index, args, _, _ in items:
+        queues['prepare'].put((index, args))
+
+    failed = []
+    num_done = [0]
+    progress_lock = threading.Lock()
+    start = time.time()
+    job_start = {}
+
+    def depths():
+        return ' '.join('{:s}={:d}'.format(name, queue.qsize()) for name, queue in queues.items())
+
+    def stage_loop(name, func, out_queue, upstream_done):
+        while True:
+            try:
+                index, value = queues[name].get(timeout=0.1)
+            except Empty:
+                # no more puts once upstream_done is set, so an empty queue stays empty
+                if upstream_done.is_set() and queues[name].empty():
+                    break
+                continue
+            if journal is not None and name == 'prepare':
+                journal.append('started', keys[index], index)
+                job_start[index] = time.time()
+            try:
+                if out_queue is None and journal is not None:
+                    prefixes = job_prefixes(value)
+                value = func(value)
+            except Exception:
+                error = traceback.format_exc()
+                if journal is not None:
+                    journal.append('failed', keys[index], index, stage=name, error=error.strip().splitlines()[-1],
+                                   seconds=time.time() - job_start[index])
+                with progress_lock:
+                    failed.append((index, error))
+                    num_done[0] += 1
+                    print(error,file=sys.stderr)
+                    print('job {:d} failed in stage {:s}'.format(index, name),file=sys.stderr)
+                continue
+            if out_queue is not None:
+                out_queue.put((index, value)) # blocks while the next stage is full
+                continue
+            if journal is not None:
+                journal.append('done', keys[index], index, prefixes=prefixes, seconds=time.time() - job_start[index])
+            with progress_lock:
+                if records is not None and value is not None:
+                    records.append(value)
+                num_done[0] += 1
+                print('job {:d} done, {:d}/{:d} done, {:.1f}s elapsed, queue depths {:s}'.format(
+                    index, num_done[0], len(items), time.time() - start, depths()),file=sys.stderr)
+
+    # queue depth statistics, sampled every sample_interval seconds
+    samples = collections.OrderedDict((name, []) for name in queues)
+    sampling = threading.Event()
+
+    def sample_loop():
+        while not sampling.wait(sample_interval):
+            for name, queue in queues.items():
+                samples[name].append(queue.qsize())
+
+    sampler = threading.Thread(target=sample_loop)
+    sampler.daemon = True
+    sampler.start()
+
+    try:
+        workers = []
+        for i, (name, func, num_threads) in enumerate(stages):
+            out_queue = queues[stages[i+1][0]] if i+1 < len(stages) else None
+            upstream_done = threading.Event()
+            threads = [threading.Thread(target=stage_loop, args=(name, func, out_queue, upstream_done)) for _ in range(num_threads)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            workers.append((upstream_done, threads))
+        # stop the stages in order, a stage ends once the stage before it has ended and its queue is drained
+        for upstream_done, threads in workers:
+            upstream_done.set()
+            for thread in threads:
+                thread.join()
+    finally:
+        sampling.set()
+        executor.shutdown()
+
+    stats = collections.OrderedDict()
+    for name, values in samples.items():
+        values = values or [0]
+        stats[name] = {'max': max(values), 'mean': float(np.mean(values)), 'samples': len(values)}
+    for name, stat in stats.items():
+        print('queue {:s}: max depth {:d}, mean depth {:.2f}'.format(name, stat['max'], stat['mean']),file=sys.stderr)
+    return failed, stats
+
+
+from argparse import ArgumentParser
+
+def parse_args(argv=None):
+    # no abbreviations, they would take options meant for generate.py (--profile for --profile_summary)
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument('--num_workers',type=int,default=0) # 0 == cpu count
+    parser.add_argument('--repeat',type=int,default=1)
+    parser.add_argument('--pipeline',type=int,default=0) # 1 == overlap prepare, tetgen and fragment stages of jobs
+    parser.add_argument('--max_tetgen',type=int,default=0) # pipeline: tetgen processes at the same time, 0 == num_workers
+    parser.add_argument('--queue_size',type=int,default=0) # pipeline: jobs waiting between two stages, 0 == max_tetgen
+    parser.add_argument('--profile_summary',type=str,default='') # batch summary of the --profile records, '' == <output dir>/profile_summary.json
+    parser.add_argument('--journal',type=str,default='') # job journal, '' == <output dir>/journal.jsonl
+    parser.add_argument('--resume',type=int,default=0) # 1 == skip the jobs done in the journal (same options as the interrupted batch)
+    parser.add_argument('--job',type=str,action='append',default=[]) # generate.py options of one job, repeatable
+    parser.add_argument('--base_shape',type=int,nargs='+')
+    parser.add_argument('--random_seed',type=int,nargs='+')
+    parser.add_argument('--num_fracs',type=int,nargs='+')
+    parser.add_argument('--map_coords',type=str,nargs='+')
+
+    args, rest = parser.parse_known_args(argv)
+    base_args = generate.parse_args(rest)
+    return args, base_args
+
+
+if __name__ == '__main__':
+    args, base_args = parse_args()
+    grid = {name: getattr(args, name) for name in GRID_OPTIONS if getattr(args, name) is not None}
+    jobs = make_jobs(base_args, grid, args.job, args.repeat)
+
+    output_dir = os.path.dirname(base_args.output_prefix)
+    generate.make_dirs(output_dir)
+    journal = JobJournal(args.journal or os.path.join(output_dir, JOURNAL_FILENAME))
+    indices = None
+    if args.resume:
+        states = journal.states()
+        indices = [index for index, job_args in enumerate(jobs) if states.get(job_key(index, job_args)) != 'done']
+        print('resuming from {:s}: {:d} of {:d} jobs done'.format(journal.filename, len(jobs) - len(indices), len(jobs)),file=sys.stderr)
+    journal.append('batch', num_jobs=len(jobs), num_to_run=len(jobs) if indices is None else len(indices), argv=sys.argv[1:])
+
+    records = []
+    if args.pipeline:
+        failed, _ = run_pipeline(jobs, args.num_workers or None, args.max_tetgen or None, args.queue_size or None, records,
+                                 journal=journal, indices=indices)
+    else:
+        failed = run_jobs(jobs, args.num_workers or None, records, journal, indices)
+    if records:
+        summary_filename = args.profile_summary or os.path.join(output_dir, 'profile_summary.json')
+        with open(summary_filename,'w') as f:
+            json.dump(summarize(records),f,indent=1)
+        print('profile summary of {:d} runs written to {:s}'.format(len(records), summary_filename),file=sys.stderr)
+    if failed:
+        print('{:d} of {:d} jobs failed: {}'.format(len(failed), len(jobs), sorted(index for index, _ in failed)),file=sys.stderr)
+        sys.exit(1)
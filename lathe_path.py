@@ -18,10 +18,15 @@
 from __future__ import print_function,division,absolute_import
 import sys
 import numpy as np
+from table_io import save_table
 
 # tetgen error workaround
 # make cap shape like cone
 DENT_CAP = True # tetgen error workaround
+DEFAULT_CAP_DENT = 1.5 if DENT_CAP else 0.0 # depth of the cone, generate.py retries failed tetgen runs with others
+
+# fewest columns of a row of the adaptive lathe (chord_tolerance)
+MIN_ROW_DIVISIONS = 12
 
 
 # get distance from two point p1, p2
@@ -85,6 +90,38 @@ def align_curve_for_lathe(points, outPoints=None):
     return outPoints
 
 
+def profile_vcoords(points):
+    """
+    v coordinates of the points of an aligned profile (align_curve_for_lathe), by arc length:
+    0..1 from the first point to the top point (outer side), 0..1 from the last point back to the top point (inner side)
+    returns vcoords, index of the top point
+    """
+    # generate v coordinates using topPointIndex
+    assert len(points[0]) == 2
+    topPointIndex = np.argmin(points[:,1])  # y 값이 가장 작은 point 의 index
+
+    vcoords = np.zeros([len(points)],dtype=float)
+
+    # lengths of line segments, lengths[i] == distance(points[i],points[i+1])
+    lengths = np.sqrt(np.sum(np.square(np.diff(points,axis=0)),axis=1))
+
+    # 바깥쪽 v 좌표 계산
+    # 0..topPointIndex
+    outerLengths = np.cumsum(lengths[:topPointIndex])
+    outerLength = outerLengths[-1] if topPointIndex > 0 else 0.0
+    vcoords[1:topPointIndex+1] = outerLengths
+    vcoords[:topPointIndex+1] /= outerLength
+
+    # 안쪽 v 좌표 계산
+    # (n-1)..(topPointIndex+1), accumulated from the end
+    innerLengths = np.cumsum(lengths[topPointIndex:][::-1])
+    innerLength = innerLengths[-1] if len(innerLengths) > 0 else 0.0
+    vcoords[topPointIndex+1:-1] = innerLengths[:-1][::-1]
+    vcoords[topPointIndex+1:] /= innerLength
+
+    return vcoords, topPointIndex
+
+
 # rotate around Y axis
 def lathe_path(points_,
                 start_angle=0.0, # angle to start at (ie 0)
@@ -92,119 +129,193 @@ def lathe_path(points_,
                 num_divisions=60, # how many quads to make around
                 cap_start=True, # true to cap the top
                 cap_end=True, # true to cap the bottom
-                use_map_xz=False):
-    nodes = []
-    texcoords = []
-    indices = []
+                use_map_xz=False,
+                cap_dent=DEFAULT_CAP_DENT, # cap center moved into the shape by this
+                chord_tolerance=0.0): # > 0 == columns per row for this chord error (fraction of the largest radius), see row_divisions
 
     points = align_curve_for_lathe(points_)
 
     pointsPerColumn = len(points)
 
-    # generate v coordinates using topPointIndex
-    assert len(points[0]) == 2
-    topPointIndex = np.argmin(points[:,1])  # y 값이 가장 작은 point 의 index
+    vcoords, topPointIndex = profile_vcoords(points)
 
-    vcoords = np.zeros([len(points)],dtype=float)
+    if chord_tolerance > 0:
+        row_counts = row_divisions(points, chord_tolerance, num_divisions, end_angle - start_angle)
+        nodes, texcoords, indices = lathe_rows(points, vcoords, row_counts, start_angle, end_angle, cap_start, cap_end, cap_dent)
+        if use_map_xz:
+            texcoords = map_xz(nodes)
+        return nodes, texcoords, indices
 
-    # 바깥쪽 v 좌표 계산
-    # 0..topPointIndex
-    outerLength = 0.0
-    for i in range(topPointIndex):
-        vcoords[i] = outerLength
-        outerLength += distance(points[i],points[i+1])
-    vcoords[topPointIndex] = outerLength
-    vcoords[:topPointIndex+1] /= outerLength
+    # tex_eps = 1.0 / num_divisions * 1.0e-2
 
-    # 안쪽 v 좌표 계산
-    # (n-1)..(topPointIndex+1)
-    innerLength = 0.0
-    for i in range(len(points)-1,topPointIndex,-1):
-        vcoords[i] = innerLength
-        innerLength += distance(points[i],points[i-1])
-    vcoords[topPointIndex+1:] /= innerLength
+    # generate points, column by column (division)
+    # same as transformPoint(yRotation(angle),[x,y,0.]), adding 0. keeps -0. out as the matrix product does
+    us = np.arange(num_divisions) / num_divisions
+    angles = lerp(start_angle, end_angle, us)
+    c = np.cos(angles).reshape([-1,1])
+    s = np.sin(angles).reshape([-1,1])
+    x, y = points[:,0], points[:,1]
 
-    # tex_eps = 1.0 / num_divisions * 1.0e-2
+    nodes = np.zeros([num_divisions,pointsPerColumn,3],dtype=float)
+    nodes[:,:,0] = x * c + 0.
+    nodes[:,:,1] = y + 0.
+    nodes[:,:,2] = x * -s + 0.
+
+    texcoords = np.zeros([num_divisions,pointsPerColumn,2],dtype=float)
+    texcoords[:,:,0] = us.reshape([-1,1])
+    texcoords[:,:,1] = vcoords
 
-    # generate points
-    for division in range(num_divisions):
-        u = division / num_divisions
-        angle = lerp(start_angle, end_angle, u)
-        mat = yRotation(angle)
-        for ndx, p in enumerate(points):
-            x,y,z = transformPoint(mat,[p[0],p[1],0.])
-            nodes.append([x,y,z])
-            v = vcoords[ndx]
-            texcoords.append([u,v])
+    nodes = [nodes.reshape([-1,3])]
+    texcoords = [texcoords.reshape([-1,2])]
+    num_nodes = num_divisions * pointsPerColumn
 
     if cap_start:
         # add point on Y access at start
         y_capstart = points[0][1]
-        if DENT_CAP: # tetgen error workaround
-            y_capstart -= 1.5
+        y_capstart -= cap_dent # tetgen error workaround
         capStartPnt = [0., y_capstart, 0.]
         capStartUV = [0., vcoords[0]]
-        capStartIdx = len(nodes)
-        nodes.append(capStartPnt)
-        texcoords.append(capStartUV)
+        capStartIdx = num_nodes
+        nodes.append([capStartPnt])
+        texcoords.append([capStartUV])
+        num_nodes += 1
 
     if cap_end:
         # add point on Y access at end
         y_capend = points[len(points)-1][1]
-        if DENT_CAP:
-            y_capend += 1.5
+        y_capend += cap_dent
         capEndPnt = [0., y_capend, 0.]
         capEndUV = [0., vcoords[-1]] # [1., 1.] # [u, 1.]
-        capEndIdx = len(nodes)
-        nodes.append(capEndPnt)
-        texcoords.append(capEndUV)
-
-
-    def add_triangle(a,b,c):
-        assert a >= 0 and a < len(nodes) , ('invalid a',a,len(nodes) )
-        assert b >= 0 and b < len(nodes) , ('invalid b',b,len(nodes) )
-        assert c >= 0 and c < len(nodes) , ('invalid c',c,len(nodes) )
-        indices.append([a,b,c])
-
-
-    # generate indices
-    for division in range(num_divisions):
-        column1Offset = division * pointsPerColumn
-        column2Offset = ( division + 1 ) % num_divisions * pointsPerColumn
-        if cap_start:
-            a,b,c = capStartIdx,column1Offset,column2Offset
-            add_triangle(a,b,c)
-
-        for quad,_ in enumerate(points[:-1]):
-            a,b,c = column1Offset+quad, column1Offset+quad+1, column2Offset+quad
-            add_triangle(a,b,c)
-            a,b,c = column1Offset+quad+1, column2Offset+quad+1, column2Offset+quad
-            add_triangle(a,b,c)
-
-        if not cap_start and not cap_end:
-            # self closing
-            last_quad = len(points) - 1
-            a,b,c = column1Offset, column2Offset, column1Offset + last_quad
-            add_triangle(a,b,c)
-            a,b,c = column2Offset, column2Offset + last_quad, column1Offset + last_quad
-            add_triangle(a,b,c)
-
-        if cap_end:
-            a,b,c = column1Offset+len(points)-1,capEndIdx,column2Offset+len(points)-1
-            add_triangle(a,b,c)
-
-    nodes, texcoords, indices = np.array(nodes), np.array(texcoords), np.array(indices)
+        capEndIdx = num_nodes
+        nodes.append([capEndPnt])
+        texcoords.append([capEndUV])
+        num_nodes += 1
+
+    # generate indices, triangles of each column are
+    # [cap start], quads (2 triangles each), [self closing quad], [cap end]
+    column1Offset = (np.arange(num_divisions) * pointsPerColumn).reshape([-1,1])
+    column2Offset = ((np.arange(num_divisions) + 1) % num_divisions * pointsPerColumn).reshape([-1,1])
+    ones = np.ones_like(column1Offset)
+
+    columns = []
+    if cap_start:
+        columns.append(np.stack([capStartIdx*ones,column1Offset,column2Offset],axis=-1))
+
+    quad = np.arange(len(points)-1)
+    tri1 = np.stack([column1Offset+quad, column1Offset+quad+1, column2Offset+quad],axis=-1)
+    tri2 = np.stack([column1Offset+quad+1, column2Offset+quad+1, column2Offset+quad],axis=-1)
+    columns.append(np.stack([tri1,tri2],axis=2).reshape([num_divisions,-1,3]))
+
+    if not cap_start and not cap_end:
+        # self closing
+        last_quad = len(points) - 1
+        columns.append(np.stack([column1Offset, column2Offset, column1Offset + last_quad],axis=-1))
+        columns.append(np.stack([column2Offset, column2Offset + last_quad, column1Offset + last_quad],axis=-1))
+
+    if cap_end:
+        columns.append(np.stack([column1Offset+len(points)-1,capEndIdx*ones,column2Offset+len(points)-1],axis=-1))
+
+    indices = np.concatenate(columns,axis=1).reshape([-1,3]).astype(int)
+    assert np.all(indices >= 0) and np.all(indices < num_nodes), ('invalid indices',indices.min(),indices.max(),num_nodes)
+
+    nodes, texcoords = np.concatenate(nodes,axis=0), np.concatenate(texcoords,axis=0)
 
     # apply xz map instead of uv if requested
     if use_map_xz:
-        _min = np.amin(nodes,axis=0)
-        _max = np.amax(nodes,axis=0)
-        _dim = (_max - _min)
-        texcoords[:,:] = ((nodes - _min) / _dim)[:,[0,2]]
+        texcoords[:,:] = map_xz(nodes)
 
     return nodes, texcoords, indices
 
 
+def map_xz(nodes):
+    # x, z normalized to the bounding box, texcoords of --map_coords xz
+    _min = np.amin(nodes,axis=0)
+    _max = np.amax(nodes,axis=0)
+    _dim = (_max - _min)
+    return ((nodes - _min) / _dim)[:,[0,2]]
+
+
+def row_divisions(points, chord_tolerance, max_divisions, angle=2*np.pi):
+    """
+    columns of every row (profile point) of an aligned profile, so that the chords of the row circle
+    are no further than chord_tolerance * (largest radius) from the circle:
+    radius * (1 - cos(step / 2)) <= error, rows near the axis get fewer columns than the rim
+    between MIN_ROW_DIVISIONS and max_divisions
+    """
+    radius = np.abs(points[:,0])
+    error = chord_tolerance * np.amax(radius)
+    with np.errstate(divide='ignore'): # points on the axis, as few columns as allowed
+        step = 2 * np.arccos(1 - np.minimum(error / radius, 1.0))
+    counts = np.ceil(angle / step - 1e-9).astype(int)
+    return np.clip(counts, MIN_ROW_DIVISIONS, max(max_divisions, MIN_ROW_DIVISIONS))
+
+
+def lathe_rows(points, vcoords, row_counts, start_angle=0.0, end_angle=2*np.pi, cap_start=True, cap_end=True, cap_dent=DEFAULT_CAP_DENT):
+    """
+    lathe with row_counts[j] columns on the circle of profile point j, nodes row by row
+    column k of row j is at u == k / row_counts[j], so texcoords follow the positions as in lathe_path
+    neighboring rows are stitched by a strip of row_counts[j] + row_counts[j+1] triangles, walking both
+    circles in order of u (a triangle on the next edge of the row that is behind), so rows share their
+    edges with both strips and the mesh is conforming
+    returns nodes, texcoords, indices (same orientation as lathe_path)
+    """
+    num_rows = len(points)
+    offsets = np.concatenate([[0], np.cumsum(row_counts)])
+    row = np.repeat(np.arange(num_rows), row_counts)
+    column = np.arange(offsets[-1]) - offsets[row]
+    us = column / row_counts[row]
+    angles = lerp(start_angle, end_angle, us)
+
+    nodes = np.zeros([len(row),3],dtype=float)
+    nodes[:,0] = points[row,0] * np.cos(angles) + 0.
+    nodes[:,1] = points[row,1] + 0.
+    nodes[:,2] = points[row,0] * -np.sin(angles) + 0.
+    texcoords = np.stack([us, vcoords[row]],axis=-1)
+
+    # strips between rows a and b, b follows a as the columns in lathe_path (self closing: last row -> first row)
+    a = np.arange(num_rows - 1)
+    b = a + 1
+    if not cap_start and not cap_end:
+        a = np.append(a, num_rows - 1)
+        b = np.append(b, 0)
+    count_a, count_b = row_counts[a], row_counts[b]
+
+    # triangles on an edge of row a: (a[i], b[apex], a[i+1]), apex == last column of b before the middle of the edge
+    strip = np.repeat(np.arange(len(a)), count_a)
+    i = np.arange(len(strip)) - np.repeat(np.cumsum(count_a) - count_a, count_a)
+    n_a, n_b = count_a[strip], count_b[strip]
+    apex = (2 * i * n_b + n_b + n_a - 1) // (2 * n_a) % n_b
+    a_edges = np.stack([offsets[a[strip]] + i, offsets[b[strip]] + apex, offsets[a[strip]] + (i + 1) % n_a],axis=-1)
+
+    # triangles on an edge of row b: (b[m], b[m+1], a[apex]), apex == first column of a after the middle of the edge
+    strip = np.repeat(np.arange(len(b)), count_b)
+    m = np.arange(len(strip)) - np.repeat(np.cumsum(count_b) - count_b, count_b)
+    n_a, n_b = count_a[strip], count_b[strip]
+    apex = ((2 * m + 1) * n_a + n_b) // (2 * n_b) % n_a
+    b_edges = np.stack([offsets[b[strip]] + m, offsets[b[strip]] + (m + 1) % n_b, offsets[a[strip]] + apex],axis=-1)
+
+    nodes, texcoords, triangles = [nodes], [texcoords], [a_edges, b_edges]
+    num_nodes = len(row)
+
+    # caps, a fan around the first or last row
+    if cap_start:
+        k = np.arange(row_counts[0])
+        nodes.append([[0., points[0][1] - cap_dent, 0.]])
+        texcoords.append([[0., vcoords[0]]])
+        triangles.append(np.stack([num_nodes + 0*k, offsets[0] + k, offsets[0] + (k + 1) % row_counts[0]],axis=-1))
+        num_nodes += 1
+    if cap_end:
+        k = np.arange(row_counts[-1])
+        nodes.append([[0., points[-1][1] + cap_dent, 0.]])
+        texcoords.append([[0., vcoords[-1]]])
+        triangles.append(np.stack([offsets[-2] + k, num_nodes + 0*k, offsets[-2] + (k + 1) % row_counts[-1]],axis=-1))
+        num_nodes += 1
+
+    indices = np.concatenate(triangles,axis=0).astype(int)
+    assert np.all(indices >= 0) and np.all(indices < num_nodes), ('invalid indices',indices.min(),indices.max(),num_nodes)
+    return np.concatenate(nodes,axis=0), np.concatenate(texcoords,axis=0).astype(float), indices
+
+
 #
 def getExtents(nodes):
     _min = np.amin(nodes,axis=0).tolist()
@@ -229,28 +340,26 @@ def save_mesh(f, nodes, faces, dimensions = 3, node_attrs = None, node_boundary_
     f.write('{:d} {:d} {:d} {:d}\n'.format(len(nodes),dimensions,num_attrs,has_node_boundary_markers)) # 2-attribs, 1-boundary-marker
 
     f.write('# rest lines: point#, x, y, z, [attributes], [boundary marker]\n')
-    for ii,node in enumerate(nodes):
-        line = '{:d}'.format(ii+1)
-        for value in node:
-            line += ' {:f}'.format(value)
-        if num_attrs > 0:
-            for value in node_attrs[ii]:
-                line += ' {:f}'.format(value)
-        if has_node_boundary_markers:
-            line += ' {:d}'.format(node_boundary_markers[ii])
-        f.write(line + '\n')
+    columns = [np.arange(1,len(nodes)+1), nodes]
+    row_format = '%d' + ' %f' * np.shape(nodes)[1]
+    if num_attrs > 0:
+        columns.append(np.reshape(node_attrs,[len(nodes),num_attrs]))
+        row_format += ' %f' * num_attrs
+    if has_node_boundary_markers:
+        columns.append(node_boundary_markers)
+        row_format += ' %d'
+    save_table(f, row_format + '\n', columns)
 
     f.write('# part 2 - facets\n')
     f.write('{:d} {:d}\n'.format(len(faces) , has_face_boundary_markers))
 
-    for ii,face in enumerate(faces):
-        assert len(face) == 3
-        line = '{:d}'.format(3)
-        for _,v in enumerate(face):
-            line += ' {:d}'.format(v+1)
-        if has_face_boundary_markers:
-            line += ' {:d}'.format(face_boundary_markers[ii])
-        f.write(line + '\n')
+    assert len(faces) == 0 or np.shape(faces)[1] == 3
+    columns = [np.add(faces,1)]
+    row_format = '3 %d %d %d'
+    if has_face_boundary_markers:
+        columns.append(face_boundary_markers)
+        row_format += ' %d'
+    save_table(f, row_format + '\n', columns)
 
     f.write('# part 3 - holes\n')
     num_holes = 0
@@ -0,0 +1,128 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+mesh budget: flattening tolerance, lathe divisions and tetgen switches for a target number of
+tetrahedra or a tetgen time budget (generate.py --target_tets, --time_budget)
+
+tetgen -p adds few points inside the wall, the number of tetrahedra follows the number of surface nodes
+(rows of the profile * divisions). the surface is sized for the target, with about square quads:
+  the tolerance sets the rows (weakly, flattened curves have a few hundred points at any tolerance),
+  the divisions make up the rest.
+when the surface cannot grow any more, a volume constraint (-a) fills the wall up to the target.
+a time budget picks the optimization level (-O), tetgen spends most of its time optimizing
+
+the constants are from the recorded run in tetgen-error.log: 86400 input points -> 300575 tetrahedra,
+15.0s total of which 12.3s optimization (default level 2)
+"""
+
+from __future__ import print_function, division, absolute_import
+from collections import OrderedDict
+import numpy as np
+
+from bezier_to_lineseg import bezier_to_lineseg
+from lathe_path import align_curve_for_lathe
+
+TETS_PER_SURFACE_NODE = 3.5
+
+# tetrahedra per second by optimization level, 2 is the tetgen default
+TETS_PER_SECOND = OrderedDict([(2, 20000.0), (0, 110000.0)])
+DEFAULT_OPTIMIZATION = 2
+
+# flattening tolerances tried, coarse to fine
+TOLERANCES = (0.15, 0.08, 0.04, 0.02, 0.01, 0.005, 0.0025, 0.001)
+MIN_DIVISIONS = 12
+MAX_DIVISIONS = 2880
+
+# a volume constraint bounds the largest tetrahedron, refined ones end up about half of it on average
+VOLUME_SLACK = 2.0
+
+
+def profile_measures(points):
+    """
+    measures of the lathed solid of a profile (bezier_to_lineseg points)
+    returns arc length of the profile, mean radius along it, volume of the solid (Pappus)
+    """
+    points = align_curve_for_lathe(np.asarray(points,dtype=float))
+    segments = np.diff(points,axis=0)
+    lengths = np.linalg.norm(segments,axis=1)
+    length = np.sum(lengths)
+    radius = np.sum(0.5 * (points[1:,0] + points[:-1,0]) * lengths) / length
+    # closed polygon, the last point connects back to the first (bottom of the wall)
+    x, y = points[:,0], points[:,1]
+    x1, y1 = np.roll(x,-1), np.roll(y,-1)
+    cross = x * y1 - x1 * y
+    area = 0.5 * np.sum(cross)
+    centroid_x = np.sum((x + x1) * cross) / (6 * area)
+    volume = 2 * np.pi * abs(area) * centroid_x
+    return length, radius, volume
+
+
+def plan_mesh(curve_points, simplify_eps, target_tets=0, time_budget=0.0):
+    """
+    tolerance, num_divisions and tetgen switches for about target_tets tetrahedra
+    curve_points: parse_svg_path output
+    target_tets: number of tetrahedra, 0 == as many as time_budget allows at the default optimization
+    time_budget: seconds of tetgen, 0 == no limit. with target_tets too, the optimization level is lowered,
+        and then the target, until the predicted time fits
+    returns the plan, an OrderedDict (json), see generate.prepare_job
+    """
+    assert target_tets > 0 or time_budget > 0
+    optimization = DEFAULT_OPTIMIZATION
+    if target_tets <= 0:
+        target_tets = int(time_budget * TETS_PER_SECOND[optimization])
+    elif time_budget > 0:
+        fits = [level for level, rate in TETS_PER_SECOND.items() if target_tets <= time_budget * rate]
+        optimization = fits[0] if fits else max(TETS_PER_SECOND, key=TETS_PER_SECOND.get)
+        target_tets = min(target_tets, int(time_budget * TETS_PER_SECOND[optimization]))
+    surface_nodes = target_tets / TETS_PER_SURFACE_NODE
+
+    # rows for square quads: rows * divisions == surface_nodes, length / rows == 2 pi radius / divisions
+    rows_wanted = None
+    for tolerance in TOLERANCES:
+        points = bezier_to_lineseg(curve_points, tolerance=tolerance, simplify_eps=simplify_eps)
+        if rows_wanted is None:
+            length, radius, volume = profile_measures(points)
+            rows_wanted = np.sqrt(surface_nodes * length / (2 * np.pi * radius))
+        if len(points) >= rows_wanted:
+            break
+    num_rows = len(points)
+    num_divisions = int(np.clip(np.round(surface_nodes / num_rows), MIN_DIVISIONS, MAX_DIVISIONS))
+    predicted_tets = int(TETS_PER_SURFACE_NODE * num_rows * num_divisions)
+
+    switches = ['-p']
+    max_volume = None
+    if predicted_tets < 0.9 * target_tets:
+        # the surface is as fine as it gets, refine the wall
+        max_volume = VOLUME_SLACK * volume / target_tets
+        switches.append('-a{:.6g}'.format(max_volume))
+        predicted_tets = target_tets
+    if optimization != DEFAULT_OPTIMIZATION:
+        switches.append('-O{:d}'.format(optimization))
+
+    return OrderedDict([
+        ('target_tets', int(target_tets)),
+        ('time_budget', time_budget),
+        ('tolerance', tolerance),
+        ('num_divisions', num_divisions),
+        ('num_rows', num_rows),
+        ('max_volume', max_volume),
+        ('optimization', optimization),
+        ('tetgen_switches', switches),
+        ('predicted_tets', predicted_tets),
+        ('predicted_seconds', predicted_tets / TETS_PER_SECOND[optimization]),
+    ])
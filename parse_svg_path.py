@@ -160,8 +160,7 @@ def parse_svg_path(svg, auto_align=False, rand_perturbation=False, rand_seed = 0
         _range = _max - _min
         pertub_max = _range * rand_perturbation
         
-        np.random.seed(rand_seed)
-        rand_array = (np.random.rand(len(points), 2) - 0.499999999) * 1.999999999 * pertub_max
+        rand_array = (np.random.RandomState(rand_seed).rand(len(points), 2) - 0.499999999) * 1.999999999 * pertub_max
         
         print(np.amin(rand_array), np.amax(rand_array))
         
@@ -17,8 +17,8 @@
 
 from __future__ import print_function, division, absolute_import
 import numpy as np
-from scipy.spatial import Voronoi
 from clipper import liang_barsky_clipper
+from site_index import nearest_site
 
 
 def is_ccw(x0, y0, x1, y1, x2, y2):
@@ -33,18 +33,23 @@ def is_ccw(x0, y0, x1, y1, x2, y2):
     return sum_over_edges < 0
 
 
-def create_pattern(num_cells):
+def create_pattern(num_cells, periodic=False):
     """
     create cylinderical voronoi and line segments
+    periodic: mirror only the points near the seam (see periodic_voronoi) instead of all points
     """
 
     xmin, ymin, xmax, ymax = 0.0, 0.0, 1.0, 1.0
     width = xmax - xmin
 
     points = np.random.uniform([xmin,ymin],[xmax,ymax],size=[num_cells,2])
-    points_mirrored = np.concatenate([points,points + [-width, 0.0],points + [width, 0.0],],axis=0)
-
-    vor = Voronoi(points_mirrored)
+    if periodic:
+        vor, point_group = periodic_voronoi(points, width)
+    else:
+        from scipy.spatial import Voronoi
+        points_mirrored = np.concatenate([points,points + [-width, 0.0],points + [width, 0.0],],axis=0)
+        vor = Voronoi(points_mirrored)
+        point_group = np.arange(len(points_mirrored)) % num_cells
 
     # 모든 ridge_vertices 에 대해서 liang_barsky_clipper 적용 ==> clipped_linesegs
 
@@ -54,12 +59,7 @@ def create_pattern(num_cells):
     for i, xy in enumerate(vor.points):
 
         # canonical point index
-        if i >= 2 * num_cells:
-            c_i = i - 2 * num_cells
-        elif i >= num_cells:
-            c_i = i - num_cells
-        else:
-            c_i =i
+        c_i = point_group[i]
 
         vs = list(vor.regions[vor.point_region[i]])
 
@@ -102,21 +102,105 @@ def create_pattern(num_cells):
     return vor, lineseg_dict, c_point_linesegs
 
 
-import matplotlib; matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+def periodic_voronoi(points, width=1.0):
+    """
+    voronoi of points in [0, width) x [0, 1], with x wrapping around
+    only the points within a margin of the seam are mirrored to the other side,
+    the margin is doubled until the cells in [0, width) x [0, 1] are the same as
+    mirroring all points to both sides (see _band_covers_square)
+    returns voronoi, and the canonical point index of each voronoi point
+    """
+    from scipy.spatial import Voronoi
+    num_cells = len(points)
+    margin = min(width, 2.0 * width / np.sqrt(num_cells))
+    while True:
+        left  = np.flatnonzero(points[:,0] >= width - margin) # mirrored to the left
+        right = np.flatnonzero(points[:,0] < margin) # mirrored to the right
+        band_points = np.concatenate([points,points[left] + [-width, 0.0],points[right] + [width, 0.0],],axis=0)
+        vor = Voronoi(band_points)
+        point_group = np.concatenate([np.arange(num_cells),left,right])
+        if margin >= width: # all points mirrored
+            return vor, point_group
+        if _band_covers_square(vor, points, margin, width):
+            return vor, point_group
+        margin = min(width, margin * 2)
+
+
+def _band_covers_square(vor, points, margin, width):
+    """
+    check if the voronoi of a band of mirrored points is the same as the voronoi of
+    all mirrored points, inside [0, width) x [0, 1]
+    (1) every point in the square is closer than margin to its voronoi point
+        (the farthest points are cell vertices: voronoi vertices, clipped ridge ends, corners)
+    (2) infinite ridges crossing the square stay infinite with all points mirrored
+    """
+    xmin, ymin, xmax, ymax = 0.0, 0.0, width, 1.0
+
+    center = vor.points.mean(axis=0)
+    far = np.abs(vor.vertices).max() + 10.0 * width if len(vor.vertices) > 0 else 10.0 * width
+
+    # points mirrored only when all points are mirrored
+    outside = np.concatenate([
+        points[points[:,0] < width - margin] + [-width, 0.0],
+        points[points[:,0] >= margin] + [width, 0.0],
+    ],axis=0)
+
+    candidates = [[xmin, ymin], [xmax, ymin], [xmin, ymax], [xmax, ymax]]
+    for v in vor.vertices:
+        if xmin <= v[0] <= xmax and ymin <= v[1] <= ymax:
+            candidates.append(v)
+
+    for (p, q), (v1, v2) in zip(vor.ridge_points, vor.ridge_vertices):
+        infinite = v1 < 0 or v2 < 0
+        if infinite:
+            # same as scipy.spatial.voronoi_plot_2d
+            t = vor.points[q] - vor.points[p]
+            t /= np.linalg.norm(t)
+            n = np.array([-t[1], t[0]])
+            midpoint = vor.points[[p, q]].mean(axis=0)
+            direction = np.sign(np.dot(midpoint - center, n)) * n
+            x1, y1 = vor.vertices[max(v1, v2)]
+            x2, y2 = vor.vertices[max(v1, v2)] + direction * far
+        else:
+            x1, y1 = vor.vertices[v1]
+            x2, y2 = vor.vertices[v2]
+        nx1, ny1, nx2, ny2, valid = liang_barsky_clipper(xmin, ymin, xmax, ymax, x1, y1, x2, y2)
+        if not valid:
+            continue
+        candidates.append([nx1, ny1])
+        candidates.append([nx2, ny2])
+        if infinite and len(outside) > 0:
+            # p, q is a convex hull edge, no outside point should be beyond it
+            edge = vor.points[q] - vor.points[p]
+            inner = np.cross(edge, center - vor.points[p])
+            beyond = np.cross(edge, outside - vor.points[p]) * inner < 0
+            if np.any(beyond):
+                return False
+
+    from scipy.spatial import cKDTree
+    dists, _ = cKDTree(vor.points).query(np.array(candidates))
+    return np.amax(dists) < margin
+
+
+def _pyplot():
+    # matplotlib is loaded on first use, plotting is optional and the import is slow
+    import matplotlib; matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 
 def plot_pattern(voronoi, lineseg_dict, c_point_linesegs, selections=None, ax=None):
 
     xmin, ymin, xmax, ymax = 0.0, 0.0, 1.0, 1.0
 
     if ax is None:
-        fig = plt.figure()
+        fig = _pyplot().figure()
         ax = fig.add_subplot(111)
 
     ax.plot([xmin,xmax,xmax,xmin,xmin],[ymin,ymin,ymax,ymax,ymin])
 
     if selections is None:
-        selections = list(range(len(voronoi.points)//3))
+        selections = list(range(len(c_point_linesegs)))
 
     for i in selections:
         x, y = voronoi.points[i]
@@ -144,9 +228,9 @@ def plot_pattern(voronoi, lineseg_dict, c_point_linesegs, selections=None, ax=No
             ax.quiver([x1],[y1],[x2-x1],[y2-y1],scale_units='xy',angles='xy',scale=1,color='k',alpha=0.1+0.8*float(j)/num_segs)
 
 
-from scipy.spatial import voronoi_plot_2d
-
 def save_pattern_png(voronoi, figname):
+    from scipy.spatial import voronoi_plot_2d
+    plt = _pyplot()
     fig = plt.figure(frameon=False)
     fig.set_size_inches(11.5,11.5)
     ax = plt.Axes(fig, [0., 0., 1., 1.])
@@ -158,36 +242,48 @@ def save_pattern_png(voronoi, figname):
 
 import json
 
-def save_pattern_json(voronoi, filename):
-    n_groups = len(voronoi.points) // 3
-    voronoi_group = np.arange(len(voronoi.points))
-    voronoi_group[n_groups:n_groups*2] -= n_groups
-    voronoi_group[n_groups*2:] -= n_groups * 2
+def save_pattern_json(voronoi, filename, num_groups=None, period=None):
+    """
+    period: None for a mirrored pattern (create_pattern),
+            or site_index.UV_PERIOD for a periodic pattern, then only num_groups points are saved
+    """
+    if period is None:
+        n_groups = len(voronoi.points) // 3
+        voronoi_group = np.arange(len(voronoi.points))
+        voronoi_group[n_groups:n_groups*2] -= n_groups
+        voronoi_group[n_groups*2:] -= n_groups * 2
+        voronoi_points = voronoi.points
+    else:
+        n_groups = num_groups
+        voronoi_group = np.arange(n_groups)
+        voronoi_points = voronoi.points[:n_groups]
     voronoi_shatter = {
         'num_groups': n_groups,
         'point_group': voronoi_group.tolist(),
-        'point': voronoi.points.tolist(),
+        'point': voronoi_points.tolist(),
     }
+    if period is not None:
+        voronoi_shatter['period'] = list(period)
     with open(filename,'w') as f:
         json.dump(voronoi_shatter,f)
 
-def load_pattern_json(filename):
+def load_pattern_json(filename, return_period=False):
     with open(filename,'r') as f:
         voronoi_shatter = json.load(f)
 
     num_groups = voronoi_shatter['num_groups']
     voronoi_points = np.array(voronoi_shatter['point'])
     voronoi_group = np.array(voronoi_shatter['point_group'])
+    if return_period:
+        period = voronoi_shatter.get('period', None) # None == mirrored or not periodic
+        return num_groups, voronoi_points, voronoi_group, period
     return num_groups, voronoi_points, voronoi_group
 
 
-def find_voronoi_group(uvcoords, voronoi_points, voronoi_group):
+def find_voronoi_group(uvcoords, voronoi_points, voronoi_group, period=None):
     assert uvcoords.ndim == 2
     assert uvcoords.shape[1] == 2
-    uvcoords = uvcoords.reshape([-1,1,2])
-    offs = uvcoords - voronoi_points # shape (-1, N, 2)
-    dists = np.linalg.norm(offs,axis=-1) # shape (-1, N)
-    center = np.argmin(dists, axis=-1) # get nearest center, shape (-1)
+    center = nearest_site(uvcoords, voronoi_points, period) # get nearest center, shape (-1)
     group = voronoi_group[center]
     return group
 
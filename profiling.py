@@ -0,0 +1,230 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try: import tracemalloc
+except ImportError: tracemalloc = None
+
+TRACEMALLOC_UNAVAILABLE = 'tracemalloc profiling needs python 3.9+ (tracemalloc.reset_peak), use rss profiling'
+
+from atomic_files import atomic_open
+
+# per-stage profile of generate.py runs: wall time, cpu time, peak allocated memory,
+# and the phase timings tetgen reports on stdout
+
+# "Delaunay seconds:  1.0356", "Total running seconds:  14.9854" (see tetgen-error.log)
+TETGEN_PHASE_PATTERN = re.compile(r'^\s*([A-Za-z][A-Za-z ]*?)\s+seconds:\s*([-+0-9.eE]+)\s*$')
+
+def tracemalloc_available():
+    # the peak of a stage needs tracemalloc.reset_peak, without it the peak is that of the whole run
+    return tracemalloc is not None and hasattr(tracemalloc, 'reset_peak')
+
+
+def parse_tetgen_phase(line):
+    """
+    (phase name, seconds) of a tetgen timing line, None for other lines
+    """
+    m = TETGEN_PHASE_PATTERN.match(line)
+    if m is None:
+        return None
+    return m.group(1), float(m.group(2))
+
+
+def rusage_max_rss_bytes(rusage):
+    # linux reports kilobytes, macOS bytes
+    return rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class RSSSampler(object):
+    """
+    resident set size of this process, sampled every interval seconds by a background thread (linux /proc)
+    each watch() follows the peak until unwatch(), peaks shorter than interval can be missed
+    """
+    STATM = '/proc/self/statm'
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self._watchers = []
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def available(cls):
+        return os.path.exists(cls.STATM)
+
+    def current(self):
+        with open(self.STATM, 'rb') as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def watch(self):
+        watcher = [self.current()] * 2 # start, peak
+        with self._lock:
+            self._watchers.append(watcher)
+        return watcher
+
+    def unwatch(self, watcher):
+        self._sample()
+        with self._lock:
+            self._watchers = [w for w in self._watchers if w is not watcher] # equal watchers are not the same
+        return watcher[0], watcher[1]
+
+    def _sample(self):
+        rss = self.current()
+        with self._lock:
+            for watcher in self._watchers:
+                watcher[1] = max(watcher[1], rss)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if self._watchers:
+                self._sample()
+
+
+_rss_sampler = None
+
+def rss_sampler():
+    # one sampler thread per process
+    global _rss_sampler
+    if _rss_sampler is None:
+        _rss_sampler = RSSSampler()
+    return _rss_sampler
+
+
+class Profile(object):
+    """
+    records of the stages of a run, each a dict with stage, wall_seconds, cpu_seconds,
+    memory of the stage (see below), and whatever the stage adds to it.
+    stages can nest, times of a stage exclude its nested stages
+    memory:
+      None
+      'rss': peak_rss_bytes, peak_rss_increase_bytes, peak resident set size of the process during the stage
+          and its increase over the size at stage start, sampled in the background (linux only, cheap)
+      'tracemalloc': peak_alloc_bytes, peak of memory allocated by python and numpy above the level at
+          stage start, exact but slows down python heavy stages many times (python 3.9+, ValueError before)
+    """
+    def __init__(self, memory=None, records=None):
+        self.records = list(records or [])
+        if memory == 'rss' and not RSSSampler.available():
+            memory = None
+        if memory == 'tracemalloc' and not tracemalloc_available():
+            raise ValueError(TRACEMALLOC_UNAVAILABLE)
+        self.memory = memory
+        self._stack = []
+        if self.memory == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, **info):
+        record = OrderedDict(stage=name)
+        record.update(info)
+        frame = {'child_wall': 0.0, 'child_cpu': 0.0, 'peak': 0}
+        if self.memory == 'tracemalloc':
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        elif self.memory == 'rss':
+            frame['watcher'] = rss_sampler().watch()
+        self._stack.append(frame)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self._stack.pop()
+            record['wall_seconds'] = wall - frame['child_wall']
+            record['cpu_seconds'] = cpu - frame['child_cpu']
+            if self.memory == 'tracemalloc':
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_alloc_bytes'] = max(0, peak - frame['base'])
+            elif self.memory == 'rss':
+                start, peak = rss_sampler().unwatch(frame['watcher'])
+                record['peak_rss_bytes'] = peak
+                record['peak_rss_increase_bytes'] = peak - start
+            if self._stack:
+                parent = self._stack[-1]
+                parent['child_wall'] += wall
+                parent['child_cpu'] += cpu
+                if self.memory == 'tracemalloc':
+                    parent['peak'] = max(parent['peak'], peak)
+            self.records.append(record)
+
+    def save(self, filename, **info):
+        """
+        write the run record (info and stage records) as json
+        """
+        run = OrderedDict(info)
+        run['wall_seconds'] = sum(record['wall_seconds'] for record in self.records)
+        run['cpu_seconds'] = sum(record['cpu_seconds'] for record in self.records)
+        run['stages'] = self.records
+        with atomic_open(filename, 'w') as f:
+            json.dump(run, f, indent=1)
+        return run
+
+
+def summarize(runs):
+    """
+    batch summary of run records (Profile.save): per stage and per tetgen phase
+    count, total, mean and max of times, max of memory
+    """
+    stages = OrderedDict()
+    phases = OrderedDict()
+    for run in runs:
+        for record in run['stages']:
+            stage = stages.setdefault(record['stage'], OrderedDict(count=0, cached=0))
+            stage['count'] += 1
+            stage['cached'] += int(bool(record.get('cached')))
+            for name in ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds'):
+                if name in record:
+                    stage['total_' + name] = stage.get('total_' + name, 0.0) + record[name]
+                    stage['max_' + name] = max(stage.get('max_' + name, 0.0), record[name])
+            for name in ('peak_alloc_bytes', 'peak_rss_bytes', 'peak_rss_increase_bytes', 'child_max_rss_bytes'):
+                if record.get(name) is not None:
+                    stage['max_' + name] = max(stage.get('max_' + name, 0), record[name])
+            for name, seconds in record.get('tetgen_phases', {}).items():
+                phase = phases.setdefault(name, OrderedDict(count=0, total_seconds=0.0, max_seconds=0.0))
+                phase['count'] += 1
+                phase['total_seconds'] += seconds
+                phase['max_seconds'] = max(phase['max_seconds'], seconds)
+
+    for values in list(stages.values()) + list(phases.values()):
+        for name in list(values):
+            if name.startswith('total_'):
+                values['mean_' + name[len('total_'):]] = values[name] / values['count']
+
+    summary = OrderedDict()
+    summary['num_runs'] = len(runs)
+    summary['wall_seconds'] = sum(run['wall_seconds'] for run in runs)
+    summary['stages'] = stages
+    summary['tetgen_phases'] = phases
+    return summary
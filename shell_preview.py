@@ -0,0 +1,199 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+fragment shells without tetgen, for previews of shatter patterns (generate.py --preview 1)
+
+the lathed profile is a closed curve: the outer side runs from the first point to the top point,
+the inner side from the last point back to the top point, both with v from 0 to 1 (lathe_path.profile_vcoords).
+the solid is the wall between the two sides, and a point (u, v) of the pattern is a segment through
+the wall, from the outer surface at (u, v) to the inner surface at (u, v).
+
+both surfaces are sampled on one (u, v) grid (the v values of both sides), every grid triangle goes to
+the group of its uv like a tetrahedron does (tetgen_object.find_element_group), and the shell of a group is
+  its outer triangles, its inner triangles (the outer ones offset through the wall, reversed), and
+  a strip through the wall along the boundary of its triangles in uv (the fracture faces, and the bottom
+  of the profile between the first and the last point)
+shells are closed: the boundary edges of the outer triangles are the edges of the strip
+"""
+
+from __future__ import print_function, division, absolute_import
+import numpy as np
+
+from lathe_path import align_curve_for_lathe, profile_vcoords
+from tetgen_object import find_element_group, compact_vertices
+
+
+def wall_grid(points, num_divisions=360, use_map_xz=False):
+    """
+    outer and inner surface of a lathed profile on a common (u, v) grid of num_divisions columns
+    returns
+      outer, inner (columns, rows, 3) positions, rows in order of v, inner[:,-1] == outer[:,-1] (top)
+      uv ((columns+1), rows, 2) grid coordinates, the last column is u == 1 (the first column again)
+      map_coords (columns, rows, 2) coordinates of the wall for pattern lookup, uv or normalized xz
+      bottom (rows,) bool, True for the first row (v == 0)
+    """
+    points = align_curve_for_lathe(points)
+    vcoords, top = profile_vcoords(points)
+
+    # each side as a function of v, increasing
+    outer_v, outer_xy = vcoords[:top+1], points[:top+1]
+    inner_v, inner_xy = vcoords[top:][::-1], points[top:][::-1]
+    v = np.unique(np.concatenate([outer_v, inner_v]))
+
+    def side_at(side_v, side_xy):
+        # zero length segments repeat v values, np.interp needs them unique
+        side_v, first = np.unique(side_v, return_index=True)
+        side_xy = side_xy[first]
+        return np.interp(v, side_v, side_xy[:,0]), np.interp(v, side_v, side_xy[:,1])
+
+    us = np.arange(num_divisions + 1) / num_divisions
+    angles = 2 * np.pi * us[:-1]
+    c = np.cos(angles).reshape([-1,1])
+    s = np.sin(angles).reshape([-1,1])
+
+    def lathe(x, y):
+        nodes = np.zeros([num_divisions,len(v),3],dtype=float)
+        nodes[:,:,0] = x * c + 0.
+        nodes[:,:,1] = y + 0.
+        nodes[:,:,2] = x * -s + 0.
+        return nodes
+
+    outer = lathe(*side_at(outer_v, outer_xy))
+    inner = lathe(*side_at(inner_v, inner_xy))
+    inner[:,-1] = outer[:,-1]
+
+    uv = np.zeros([num_divisions+1,len(v),2],dtype=float)
+    uv[:,:,0] = us.reshape([-1,1])
+    uv[:,:,1] = v
+
+    if use_map_xz:
+        # the tetgen path maps every node by its own xz, the middle of the wall stands in for both sides here
+        middle = 0.5 * (outer + inner)
+        _min = np.minimum(np.amin(outer,axis=(0,1)), np.amin(inner,axis=(0,1)))
+        _max = np.maximum(np.amax(outer,axis=(0,1)), np.amax(inner,axis=(0,1)))
+        map_coords = ((middle - _min) / (_max - _min))[:,:,[0,2]]
+    else:
+        map_coords = uv[:-1]
+
+    bottom = np.zeros(len(v),dtype=bool)
+    bottom[0] = True
+    return outer, inner, uv, map_coords, bottom
+
+
+def grid_triangles(num_columns, num_rows):
+    """
+    triangles of a (columns+1, rows) grid, two per quad, as (column, row) index pairs flattened to
+    column * rows + row. column num_columns is the first column again (u == 1)
+    returns triangles, and the neighbor across each of their edges (triangle i, edge triangles[i,j] ->
+    triangles[i,(j+1)%3]), -1 at the first and last row
+    """
+    k = np.arange(num_columns).reshape([-1,1])
+    r = np.arange(num_rows - 1).reshape([1,-1])
+    a = k * num_rows + r
+    b = a + 1
+    c = a + num_rows
+    d = c + 1
+    tri1 = np.stack([a, b, c],axis=-1) # edges a-b (column k), b-c (diagonal), c-a (row r)
+    tri2 = np.stack([b, d, c],axis=-1) # edges b-d (row r+1), d-c (column k+1), c-b (diagonal)
+    triangles = np.stack([tri1,tri2],axis=2).reshape([-1,3])
+
+    # triangle index of (column, row, 0 == tri1 / 1 == tri2), columns wrap around
+    def index(column, row, second):
+        return ((column % num_columns) * (num_rows - 1) + row) * 2 + second
+    k, r = np.broadcast_arrays(k, r)
+    below = np.where(r > 0, index(k, r - 1, 1), -1)
+    above = np.where(r < num_rows - 2, index(k, r + 1, 0), -1)
+    neighbor1 = np.stack([index(k - 1, r, 1), index(k, r, 1), below],axis=-1)
+    neighbor2 = np.stack([above, index(k + 1, r, 0), index(k, r, 0)],axis=-1)
+    neighbors = np.stack([neighbor1,neighbor2],axis=2).reshape([-1,3])
+    return triangles, neighbors
+
+
+def shatter_shells(points, voronoi_points, voronoi_group, num_groups, num_divisions=360, use_map_xz=False, period=None):
+    """
+    closed surface of every fragment, for selections -2, -3, ..., -(num_groups+1) (see generate.write_fragments)
+    returns a list of (nodes, texcoords, triangles, fracture) per fragment,
+      fracture (triangles,) bool, True for faces on a fracture, False for the original surface
+    """
+    outer, inner, uv, map_coords, bottom = wall_grid(points, num_divisions, use_map_xz)
+    num_columns, num_rows = outer.shape[:2]
+
+    # group of every grid triangle, from the coordinates of its corners like a tetrahedron
+    triangles, neighbors = grid_triangles(num_columns, num_rows)
+    if use_map_xz:
+        coords = np.concatenate([map_coords, map_coords[:1]],axis=0).reshape([-1,2])
+    else:
+        coords = uv.reshape([-1,2])
+    tri_group = find_element_group(triangles, coords, voronoi_points, voronoi_group, period)
+
+    # grid index (with the extra column) to node index: outer nodes, then inner nodes, inner top row == outer top row
+    num_grid = num_columns * num_rows
+    column = triangles // num_rows % num_columns
+    row = triangles % num_rows
+    outer_index = column * num_rows + row
+    inner_index = np.where(row == num_rows - 1, outer_index, num_grid + outer_index)
+    nodes = np.concatenate([outer.reshape([-1,3]), inner.reshape([-1,3])],axis=0)
+    texcoords = np.concatenate([uv[:-1].reshape([-1,2])] * 2,axis=0)
+
+    # orient outer triangles out of the wall: towards the outer side, away from the inner side
+    corners = nodes[outer_index]
+    normals = np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+    through = nodes[inner_index].mean(axis=1) - corners.mean(axis=1)
+    flip = np.sum(np.einsum('ij,ij->i',normals,through)) > 0
+
+    # boundary edges of the groups: edges to a triangle of another group, or at the first and last row,
+    # edge j of a triangle is corner j -> corner j+1, reversed along with flipped triangles
+    grid_edges = np.stack([outer_index, np.roll(outer_index,-1,axis=1)],axis=-1) # (triangles, 3, 2)
+    if flip:
+        grid_edges = grid_edges[:,:,::-1]
+        outer_index = outer_index[:,[0,2,1]]
+        inner_index = inner_index[:,[0,2,1]]
+    on_boundary = (neighbors < 0) | (tri_group[neighbors] != tri_group[:,None])
+
+    shells = []
+    for g in range(num_groups):
+        select = tri_group == -(2+g)
+        outer_tris = outer_index[select]
+        inner_tris = inner_index[select][:,::-1]
+
+        boundary = grid_edges[select][on_boundary[select]]
+        # the strip through the wall: for edge a -> b, the quad b, a, a', b'
+        a, b = boundary[:,0], boundary[:,1]
+        a_in = np.where(a % num_rows == num_rows - 1, a, num_grid + a)
+        b_in = np.where(b % num_rows == num_rows - 1, b, num_grid + b)
+        strip = np.concatenate([np.stack([b, a, a_in],axis=-1), np.stack([b, a_in, b_in],axis=-1)],axis=0)
+        strip_fracture = np.tile(~(bottom[a % num_rows] & bottom[b % num_rows]),2)
+        # at the top the wall has no thickness, the strip degenerates
+        valid = (strip[:,0] != strip[:,1]) & (strip[:,1] != strip[:,2]) & (strip[:,2] != strip[:,0])
+        strip, strip_fracture = strip[valid], strip_fracture[valid]
+
+        tris = np.concatenate([outer_tris, inner_tris, strip],axis=0)
+        fracture = np.concatenate([np.zeros(len(outer_tris) + len(inner_tris),dtype=bool), strip_fracture])
+
+        vertex_select = np.zeros(len(nodes),dtype=bool)
+        vertex_select[tris.ravel()] = True
+        vertex_remap = compact_vertices(vertex_select)
+        shells.append((nodes[vertex_select], texcoords[vertex_select], vertex_remap[tris], fracture))
+    return shells
+
+
+def shell_point_cloud(nodes, triangles):
+    """
+    centers of the faces, as the point clouds of tetgen fragments (tetgen_object.extract_submesh)
+    """
+    return np.mean(nodes[triangles],axis=1)
@@ -19,7 +19,15 @@ from __future__ import print_function,division,absolute_import
 from traceback import print_exc
 import sys
 import re
-import matplotlib.path as mpath
+
+# path codes, same values as matplotlib.path.Path (importing matplotlib only for these costs most of the start-up time)
+class Path(object):
+    STOP = 0
+    MOVETO = 1
+    LINETO = 2
+    CURVE3 = 3
+    CURVE4 = 4
+    CLOSEPOLY = 79
 
 
 
@@ -35,36 +43,36 @@ def pairwise(iterable):
 
 # STOP MOVETO LINETO CURVE3 CURVE4 CLOSEPOLY
 SVG_CODE_MAP = dict(zip('MmLlCcSsQqTtHhVvZzAa', [
-    mpath.Path.MOVETO,
-    mpath.Path.MOVETO,
-    mpath.Path.LINETO,
-    mpath.Path.LINETO,
-    mpath.Path.CURVE4,
-    mpath.Path.CURVE4,
-    mpath.Path.CURVE4,
-    mpath.Path.CURVE4,
-    mpath.Path.CURVE3,
-    mpath.Path.CURVE3,
-    mpath.Path.CURVE3,
-    mpath.Path.CURVE3,
-    mpath.Path.LINETO,
-    mpath.Path.LINETO,
-    mpath.Path.LINETO,
-    mpath.Path.LINETO,
-    mpath.Path.CLOSEPOLY,
-    mpath.Path.CLOSEPOLY,
-    mpath.Path.STOP,
-    mpath.Path.STOP,
+    Path.MOVETO,
+    Path.MOVETO,
+    Path.LINETO,
+    Path.LINETO,
+    Path.CURVE4,
+    Path.CURVE4,
+    Path.CURVE4,
+    Path.CURVE4,
+    Path.CURVE3,
+    Path.CURVE3,
+    Path.CURVE3,
+    Path.CURVE3,
+    Path.LINETO,
+    Path.LINETO,
+    Path.LINETO,
+    Path.LINETO,
+    Path.CLOSEPOLY,
+    Path.CLOSEPOLY,
+    Path.STOP,
+    Path.STOP,
 ]))
 
 SVG_CODE_NAME_MAP = {
-    mpath.Path.MOVETO: 'MOVETO',
-    mpath.Path.LINETO: 'LINETO',
-    mpath.Path.CURVE4: 'CURVE4',
-    mpath.Path.CURVE3: 'CURVE3',
-    mpath.Path.LINETO: 'LINETO',
-    mpath.Path.CLOSEPOLY: 'CLOSEPOLY',
-    mpath.Path.STOP: 'STOP',
+    Path.MOVETO: 'MOVETO',
+    Path.LINETO: 'LINETO',
+    Path.CURVE4: 'CURVE4',
+    Path.CURVE3: 'CURVE3',
+    Path.LINETO: 'LINETO',
+    Path.CLOSEPOLY: 'CLOSEPOLY',
+    Path.STOP: 'STOP',
 }
 
 
@@ -216,13 +224,13 @@ def svg_to_paths(svg_str,debug_curves=False,trace_codes=False):
                 sub_list = coord_list[p:p+3]
                 # # first coordinate = move to last coordinate
                 # x, y = prev_last_coord
-                # path_code = mpath.Path.MOVETO
+                # path_code = Path.MOVETO
                 # path_codes.append(path_code)
                 # path_verts.append((x,y))
                 # if trace_codes: print(('trace',i,'code',code,'path_code',SVG_CODE_NAME_MAP[path_code],'path_vert',x,y),file=sys.stderr)
                 # rest coordinates = curve4
                 for x, y in sub_list:
-                    path_code = mpath.Path.LINETO if debug_curves else SVG_CODE_MAP[code]
+                    path_code = Path.LINETO if debug_curves else SVG_CODE_MAP[code]
                     path_codes.append(path_code)
                     path_verts.append((x,y))
                     if trace_codes: print(('trace',i,'code',code,'path_code',SVG_CODE_NAME_MAP[path_code],'path_vert',x,y),file=sys.stderr)
@@ -234,7 +242,7 @@ def svg_to_paths(svg_str,debug_curves=False,trace_codes=False):
             for p in range(0,len(coord_list),2):
                 sub_list = coord_list[p:p+2]
                 for x, y in sub_list:
-                    path_code = mpath.Path.LINETO if debug_curves else SVG_CODE_MAP[code]
+                    path_code = Path.LINETO if debug_curves else SVG_CODE_MAP[code]
                     path_codes.append(path_code)
                     path_verts.append((x,y))
                     if trace_codes: print(('trace',i,'code',code,'path_code',SVG_CODE_NAME_MAP[path_code],'path_vert',x,y),file=sys.stderr)
@@ -248,13 +256,13 @@ def svg_to_paths(svg_str,debug_curves=False,trace_codes=False):
                 sub_list = coord_list[p:p+2]
                 # # first coordinate = move
                 # x, y = prev_last_coord[0]
-                # path_code = mpath.Path.MOVETO
+                # path_code = Path.MOVETO
                 # path_codes.append(path_code)
                 # path_verts.append((x,y))
                 # if trace_codes: print(('trace',i,'code',code,'path_code',SVG_CODE_NAME_MAP[path_code],'path_vert',x,y),file=sys.stderr)
                 # rest coordinates = curve4
                 for x, y in sub_list:
-                    path_code = mpath.Path.LINETO if debug_curves else SVG_CODE_MAP[code]
+                    path_code = Path.LINETO if debug_curves else SVG_CODE_MAP[code]
                     path_codes.append(path_code)
                     path_verts.append((x,y))
                     if trace_codes: print(('trace',i,'code',code,'path_code',SVG_CODE_NAME_MAP[path_code],'path_vert',x,y),file=sys.stderr)
@@ -0,0 +1,69 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division, absolute_import
+from collections import OrderedDict
+import numpy as np
+
+# nearest voronoi site lookup, shared by find_vertex_group, find_element_group and find_voronoi_group
+
+DEFAULT_CHUNK_SIZE = 65536 # queries per chunk, caps peak memory
+
+MAX_CACHED_INDICES = 8
+
+# period of each axis for cylindrical (u wraps around) patterns, 0 == not periodic
+UV_PERIOD = (1.0, 0.0)
+
+_site_indices = OrderedDict()
+
+
+def site_index(sites, period=None):
+    """
+    kd-tree of voronoi sites, built once per set of sites (pattern) and cached
+    period: None, or period of each axis (0 == not periodic), distances wrap around periodic axes
+    """
+    sites = np.array(sites,dtype=float)
+    assert sites.ndim == 2
+    if period is not None:
+        period = np.asarray(period,dtype=float)
+        assert period.shape == (sites.shape[1],)
+        periodic = period > 0
+        sites[:,periodic] %= period[periodic] # sites should be in [0, period)
+        period = tuple(period.tolist())
+    key = (sites.shape, sites.tobytes(), period)
+    tree = _site_indices.pop(key, None)
+    if tree is None:
+        from scipy.spatial import cKDTree # loaded on first use, the import is slow
+        tree = cKDTree(sites, boxsize=period)
+    _site_indices[key] = tree # most recently used last
+    while len(_site_indices) > MAX_CACHED_INDICES:
+        _site_indices.popitem(last=False)
+    return tree
+
+
+def nearest_site(points, sites, period=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    index of the nearest site for each point, shape (-1)
+    """
+    points = np.asarray(points,dtype=float)
+    assert points.ndim == 2
+    tree = site_index(sites, period)
+    assert points.shape[1] == tree.m
+    nearest = np.zeros(len(points),dtype=int)
+    for start in range(0,len(points),chunk_size):
+        _, nearest[start:start+chunk_size] = tree.query(points[start:start+chunk_size])
+    return nearest
@@ -0,0 +1,231 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import errno
+import shutil
+import pickle
+import hashlib
+import numpy as np
+
+from atomic_files import StagedFiles
+
+# content-addressed on-disk cache of the stages of generate.py
+#
+# an entry is a directory <cache_dir>/<stage>/<key>/ holding the files of the stage output,
+# or a single pickled value. keys are hashes of the stage inputs and parameters, and the key of
+# a stage includes the key of the stage before it, so the keys of all stages are known before
+# anything is computed and any prefix of the pipeline can be skipped.
+# entries are used in least recently used order (directory mtime), and evicted once the cache
+# grows over max_bytes. the size is scanned once and then kept as a running total of the entries
+# this process stores, other processes sharing the cache are caught up with by a rescan every
+# RESCAN_PUTS entries
+
+DEFAULT_MAX_BYTES = 8 * 1024**3
+
+# bump to invalidate entries written by older code
+CACHE_VERSION = 1
+
+VALUE_FILENAME = 'value.pickle'
+
+RESCAN_PUTS = 64
+# an eviction goes down to this fraction of max_bytes, so that the next puts do not evict again
+EVICT_TO = 0.9
+
+
+def stage_key(stage, *inputs):
+    """
+    hash of stage name and inputs
+    inputs: keys of earlier stages, numbers, strings, None, numpy arrays, or lists/tuples of these
+    """
+    h = hashlib.sha1()
+
+    def update(value):
+        if isinstance(value, np.ndarray):
+            h.update('ndarray{}{}:'.format(value.dtype.str, value.shape).encode('utf-8'))
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            h.update('{}{:d}:'.format(type(value).__name__, len(value)).encode('utf-8'))
+            for item in value:
+                update(item)
+        else:
+            assert value is None or isinstance(value, (bool, int, float, str, np.number)), type(value)
+            h.update('{}{!r}:'.format(type(value).__name__, value).encode('utf-8'))
+
+    update((CACHE_VERSION, stage) + inputs)
+    return h.hexdigest()
+
+
+class StageCache(object):
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = None # running total, None == not scanned yet
+        self.puts = 0 # entries stored since the last scan
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key)
+
+    def lookup(self, stage, key):
+        """
+        directory of the entry, None if not cached. marks the entry as recently used
+        """
+        path = self.entry_dir(stage, key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def contains(self, stage, key):
+        return os.path.isdir(self.entry_dir(stage, key))
+
+    def put_files(self, stage, key, prefix, suffixes):
+        """
+        store files prefix + suffix (those that exist) as an entry
+        files are copied, not linked: outputs are rewritten in place by later runs
+        """
+        path = self.entry_dir(stage, key)
+        temp_path = self._temp_dir(path)
+        for suffix in suffixes:
+            if os.path.exists(prefix + suffix):
+                shutil.copyfile(prefix + suffix, os.path.join(temp_path, suffix))
+        self._commit(temp_path, path)
+        self._stored(path)
+
+    def get_files(self, stage, key, prefix):
+        """
+        copy all files of an entry out of the cache, to prefix + suffix
+        returns False if not cached
+        """
+        path = self.lookup(stage, key)
+        if path is None:
+            return False
+        try:
+            # renamed into place together, like the outputs they stand for
+            with StagedFiles() as staged:
+                for suffix in os.listdir(path):
+                    shutil.copyfile(os.path.join(path, suffix), staged.temp(prefix + suffix))
+        except (IOError, OSError): # evicted by another process
+            return False
+        return True
+
+    def put(self, stage, key, value):
+        """
+        store a (picklable) value as an entry
+        """
+        path = self.entry_dir(stage, key)
+        temp_path = self._temp_dir(path)
+        with open(os.path.join(temp_path, VALUE_FILENAME), 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._commit(temp_path, path)
+        self._stored(path)
+        return value
+
+    def get(self, stage, key, default=None):
+        path = self.lookup(stage, key)
+        if path is None:
+            return default
+        try:
+            with open(os.path.join(path, VALUE_FILENAME), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError): # evicted by another process
+            return default
+
+    def cached(self, stage, key, compute):
+        """
+        value of the entry, or compute() stored as the entry
+        """
+        missing = object()
+        value = self.get(stage, key, missing)
+        if value is missing:
+            return self.put(stage, key, compute())
+        print('stage cache hit',stage,key,file=sys.stderr)
+        return value
+
+    def _temp_dir(self, path):
+        temp_path = '{:s}.{:d}.tmp'.format(path, os.getpid())
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        return temp_path
+
+    def _commit(self, temp_path, path):
+        # entries appear complete or not at all, the first of concurrent writers wins
+        try:
+            os.rename(temp_path, path)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            shutil.rmtree(temp_path)
+
+    def _stored(self, path):
+        # count a new entry in the running total, evict when over max_bytes (or rescan when due)
+        self.puts += 1
+        if self.total_bytes is None or self.puts >= RESCAN_PUTS:
+            self.evict()
+            return
+        try:
+            self.total_bytes += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        except OSError: # evicted by another process
+            pass
+        if self.total_bytes > self.max_bytes:
+            self.evict(int(EVICT_TO * self.max_bytes))
+
+    def entries(self):
+        """
+        list of (last use time, size in bytes, directory) of all entries
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for stage in os.listdir(self.cache_dir):
+            stage_dir = os.path.join(self.cache_dir, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for key in os.listdir(stage_dir):
+                path = os.path.join(stage_dir, key)
+                if key.endswith('.tmp'):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                    entries.append((os.path.getmtime(path), size, path))
+                except OSError: # evicted by another process
+                    pass
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+        remove least recently used entries until the cache is at most max_bytes, scans the whole cache
+        (and resets the running total)
+        returns number of bytes removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total - removed <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            removed += size
+        self.total_bytes = total - removed
+        self.puts = 0
+        return removed
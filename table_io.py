@@ -0,0 +1,64 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+tetgen style text tables (.node, .ele, .face, .smesh parts): an index column and the values of a row per line
+"""
+
+from __future__ import print_function, division, absolute_import
+import re
+import types
+import numpy as np
+
+
+def load_table(filename, dtype=int):
+    """
+    read a tetgen text file (.node, .ele, .face) in one pass
+    returns the first line as a list of ints and the rest as an array of shape (rows, columns),
+    the number of rows is the first value of the first line
+    dtype can be a function of the first line
+    """
+    with open(filename) as f:
+        text = f.read()
+    if '#' in text:
+        text = re.sub(r'#[^\n]*', '', text) # skip comments
+    first_line, _, text = text.lstrip().partition('\n')
+    header = [int(x) for x in first_line.split()]
+    if isinstance(dtype, types.FunctionType):
+        dtype = dtype(header)
+    values = np.fromstring(text, dtype=dtype, sep=' ')
+    num_rows = header[0]
+    num_columns = len(values) // num_rows if num_rows > 0 else 1
+    assert len(values) == num_rows * num_columns, ('invalid table',filename,'values',len(values),'rows',num_rows)
+    table = values.reshape([num_rows,num_columns])
+    # check the index column all at once
+    index = table[:,0]
+    mismatch = np.flatnonzero(index != np.arange(1,num_rows+1))
+    assert len(mismatch) == 0, ('index',index[mismatch[0]],'row',mismatch[0] + 1)
+    return header, table
+
+
+def save_table(f, row_format, columns, chunk_size=65536):
+    """
+    write rows of columns (arrays of shape (rows,) or (rows, k)) in the format of row_format
+    ex) row_format '%d %f %f %f %d\n'
+    rows are formatted chunk by chunk, with one string formatting per chunk
+    """
+    table = np.column_stack(columns)
+    for start in range(0,len(table),chunk_size):
+        chunk = table[start:start+chunk_size]
+        f.write((row_format * len(chunk)) % tuple(chunk.ravel().tolist()))
@@ -17,13 +17,143 @@
 
 from __future__ import print_function, division, absolute_import
 import os
-import re
 import copy
+import json
+import mmap
+import struct
+import threading
 import numpy as np
+from site_index import nearest_site
+from table_io import load_table, save_table
 
 # NOTE array indices are converted to be zero-based
 
-class TetgenNodes:
+# binary sidecar of a tetgen text file: <filename>.mmap holds the arrays of the loaded part as raw
+# little-endian data, and later loads memory-map it instead of parsing the text again.
+# the pages are mapped copy-on-write, so processes reading the same object share them and
+# changing a loaded array does not change the sidecar.
+# a sidecar is used only while the mtime and size of its text file are those it was written from.
+#   layout: magic, header size (uint64), json header, arrays (each aligned to SIDECAR_ALIGN bytes)
+# TETGEN_SIDECAR=0 in the environment turns sidecars off (always parse, never write)
+SIDECAR_SUFFIX = '.mmap'
+SIDECAR_MAGIC = b'TETGENMM'
+SIDECAR_VERSION = 1
+SIDECAR_ALIGN = 64
+USE_SIDECAR = os.environ.get('TETGEN_SIDECAR', '1') != '0'
+
+def align_offset(offset):
+    return -(-offset // SIDECAR_ALIGN) * SIDECAR_ALIGN
+
+
+def little_endian(value):
+    value = np.asarray(value)
+    return np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<'))
+
+
+def map_array(buffer, dtype, shape, offset):
+    """
+    array of dtype and shape at offset of buffer (an mmap), sharing its memory
+    """
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def source_stamp(filename):
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_sidecar(part, filename, stamp):
+    """
+    set the header values and arrays of part from the sidecar of filename
+    returns False if there is no sidecar, or it is not from the file as of stamp (source_stamp)
+    """
+    try:
+        with open(filename + SIDECAR_SUFFIX, 'rb') as f:
+            if f.read(len(SIDECAR_MAGIC)) != SIDECAR_MAGIC:
+                return False
+            header_size, = struct.unpack('<Q', f.read(8))
+            info = json.loads(f.read(header_size).decode('utf-8'))
+            if info['version'] != SIDECAR_VERSION or info['source'] != stamp:
+                return False
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        data_start = align_offset(len(SIDECAR_MAGIC) + 8 + header_size)
+        arrays = {name: map_array(buffer, dtype, shape, data_start + offset) for name, dtype, shape, offset in info['arrays']}
+    except (IOError, OSError, ValueError, KeyError, struct.error): # missing, truncated or from other code
+        return False
+    for name, value in zip(part.HEADER, info['header']):
+        setattr(part, name, value)
+    for name, value in arrays.items():
+        setattr(part, name, value)
+    return True
+
+
+def write_sidecar(part, filename, stamp):
+    """
+    write the header values and arrays of part as the sidecar of filename, as of stamp (source_stamp)
+    returns False if it can not be written (read-only directory, ...)
+    """
+    layout, arrays, offset = [], [], 0
+    for name in part.ARRAYS:
+        value = little_endian(getattr(part, name))
+        layout.append([name, value.dtype.str, list(value.shape), offset])
+        arrays.append((offset, value))
+        offset = align_offset(offset + value.nbytes)
+    header = json.dumps({
+        'version': SIDECAR_VERSION,
+        'source': stamp,
+        'header': [int(getattr(part, name)) for name in part.HEADER],
+        'arrays': layout}).encode('utf-8')
+    data_start = align_offset(len(SIDECAR_MAGIC) + 8 + len(header))
+
+    # written whole under a temporary name, readers never see a partial sidecar
+    path = filename + SIDECAR_SUFFIX
+    temp_path = '{:s}.{:d}.{:d}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(SIDECAR_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for offset, value in arrays:
+                f.seek(data_start + offset)
+                f.write(value.data)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+class TetgenPart(object):
+    """
+    base of the parts of a tetgen object (.node, .ele, .face), loaded from the text file or its sidecar
+    subclasses name their header values (HEADER) and arrays (ARRAYS), and parse the text file (parse)
+    """
+    HEADER = ()
+    ARRAYS = ()
+
+    def load(self, filename, sidecar=True):
+        """
+        load the text file, or its binary sidecar if it is up to date
+        sidecar: False == always parse the text, and do not write a sidecar
+        """
+        if not (sidecar and USE_SIDECAR):
+            self.parse(filename)
+            return
+        stamp = source_stamp(filename) # before parsing, a file changed while parsing gets a stale stamp
+        if read_sidecar(self, filename, stamp):
+            return
+        self.parse(filename)
+        write_sidecar(self, filename, stamp)
+
+
+class TetgenNodes(TetgenPart):
+    HEADER = ('num_points', 'dim', 'num_attrs', 'has_boundary_markers')
+    ARRAYS = ('points', 'attrs', 'boundary_markers')
+
     def __init__(self):
         self.num_points = 0
         self.dim = 0
@@ -33,57 +163,51 @@ class TetgenNodes:
         self.has_boundary_markers = 0
         self.boundary_markers = None
 
-    def load(self, filename):
+    def parse(self, filename):
         # (1) read .1.node file (points)
-        with open(filename) as f:
-            # first line: <# of points> <dimension> <# of attributes> <boundary markers (0 or 1)>
-            num_points, dim, num_attrs, has_boundary_markers = [int(x) for x in re.split(r'\s+',f.readline().strip())]
-            points = np.zeros([num_points,dim],dtype=float)
-            attrs  = np.zeros([num_points,num_attrs],dtype=float) if num_attrs > 0 else np.empty(0)
-            boundary_markers = np.zeros([num_points],dtype=int) if has_boundary_markers > 0 else np.empty(0)
-            for i in range(num_points):
-                # <point #> <x> <y> <z> [attributes] [boundary marker]
-                items = re.split(r'\s+',f.readline().strip())
-                assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
-                points[i,:dim] = [float(x) for x in items[1:1+dim]]
-                if num_attrs > 0:
-                    attrs[i,:num_attrs] = [float(x) for x in items[1+dim:1+dim+num_attrs]]
-                if has_boundary_markers > 0:
-                    boundary_markers[i] = int(items[-1])
+        # first line: <# of points> <dimension> <# of attributes> <boundary markers (0 or 1)>
+        # rest lines: <point #> <x> <y> <z> [attributes] [boundary marker]
+        header, table = load_table(filename, dtype=float)
+        num_points, dim, num_attrs, has_boundary_markers = header
+        points = table[:,1:1+dim]
+        attrs  = table[:,1+dim:1+dim+num_attrs] if num_attrs > 0 else np.empty(0)
+        boundary_markers = table[:,-1].astype(int) if has_boundary_markers > 0 else np.empty(0)
 
         self.num_points = num_points
         self.dim = dim
         self.num_attrs = num_attrs
         self.has_boundary_markers = has_boundary_markers
-        self.points = points
-        self.attrs = attrs
+        self.points = np.ascontiguousarray(points)
+        self.attrs = np.ascontiguousarray(attrs)
         self.boundary_markers = boundary_markers
 
     def save(self, filename):
         with open(filename,'w') as f:
             assert len(self.points) == self.num_points
+            assert self.num_points == 0 or self.points.shape[1] == self.dim
             # first line: <# of points> <dimension> <# of attributes> <boundary markers (0 or 1)>
             f.write('{:d} {:d} {:d} {:d}\n'.format(
                 len(self.points),
                 self.dim,
                 self.num_attrs,
                 self.has_boundary_markers))
-            for i,p in enumerate(self.points):
-                assert len(p) == self.dim
-                # <point #> <x> <y> <z> [attributes] [boundary marker]
-                line = '{:d}'.format(i+1)
-                for _,v in enumerate(p):
-                    line += ' {:f}'.format(v)
-                if self.num_attrs:
-                    assert len(self.attrs[i]) == self.num_attrs
-                    for _,a in enumerate(self.attrs[i]):
-                        line += ' {:f}'.format(a)
-                if self.has_boundary_markers:
-                    line += ' {:d}'.format(self.boundary_markers[i])
-                f.write(line + '\n')
-
-
-class TeggenElems:
+            # <point #> <x> <y> <z> [attributes] [boundary marker]
+            columns = [np.arange(1,self.num_points+1), self.points]
+            row_format = '%d' + ' %f' * self.dim
+            if self.num_attrs:
+                assert self.attrs.shape == (self.num_points, self.num_attrs)
+                columns.append(self.attrs)
+                row_format += ' %f' * self.num_attrs
+            if self.has_boundary_markers:
+                columns.append(self.boundary_markers)
+                row_format += ' %d'
+            save_table(f, row_format + '\n', columns)
+
+
+class TeggenElems(TetgenPart):
+    HEADER = ('num_elems', 'num_nodes', 'num_attrs')
+    ARRAYS = ('elems', 'attrs')
+
     def __init__(self):
         self.num_elems = 0
         self.num_nodes = 0
@@ -91,20 +215,15 @@ class TeggenElems:
         self.num_attrs = 0
         self.attrs = None
 
-    def load(self,filename):
+    def parse(self,filename):
         # (3) read .1.ele file (ele == tetrahedron)
-        with open(filename) as f:
-            # first line: <# of tetrahedra> <# of nodes> <# of attributes>
-            num_elems, num_nodes, num_attrs = [int(x) for x in re.split(r'\s+',f.readline().strip())]
-            elems = np.zeros([num_elems, num_nodes],dtype=int)
-            attrs = np.zeros([num_elems,num_attrs],dtype=int) if num_attrs > 0 else np.empty(0)
-            for i in range(num_elems):
-                # <ele #> <node> <node> <node> ... [attributes]
-                items = re.split(r'\s+',f.readline().strip())
-                assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
-                elems[i,:num_nodes] = [int(x) - 1 for x in items[1:1+num_nodes]]
-                if num_attrs > 0:
-                    attrs[i,:num_attrs] = [float(x) for x in items[1+num_nodes:1+num_nodes+num_attrs]]
+        # first line: <# of tetrahedra> <# of nodes> <# of attributes>
+        # rest lines: <ele #> <node> <node> <node> ... [attributes]
+        # region attributes may be real numbers
+        header, table = load_table(filename, dtype=lambda header: float if header[2] > 0 else int)
+        num_elems, num_nodes, num_attrs = header
+        elems = table[:,1:1+num_nodes].astype(int) - 1
+        attrs = table[:,1+num_nodes:1+num_nodes+num_attrs].astype(int) if num_attrs > 0 else np.empty(0)
 
         self.num_elems = num_elems
         self.num_nodes = num_nodes
@@ -115,45 +234,40 @@ class TeggenElems:
     def save(self,filename):
         with open(filename,'w') as f:
             assert len(self.elems) == self.num_elems
+            assert self.num_elems == 0 or self.elems.shape[1] == self.num_nodes
             # first line: <# of tetrahedra> <# of nodes> <# of attributes>
             f.write('{:d} {:d} {:d}\n'.format(
                 self.num_elems,
                 self.num_nodes,
                 self.num_attrs))
-            for i,e in enumerate(self.elems):
-                assert len(e) == self.num_nodes
-                # <ele #> <node> <node> <node> ... [attributes]
-                line = '{:d}'.format(i+1)
-                for _,v in enumerate(e):
-                    line += ' {:d}'.format(v+1)
-                if self.num_attrs:
-                    assert len(self.attrs[i]) == self.num_attrs
-                    for _,a in enumerate(self.attrs[i]):
-                        line += ' {:f}'.format(a)
-                f.write(line + '\n')
-
-
-class TetgenFaces:
+            # <ele #> <node> <node> <node> ... [attributes]
+            columns = [np.arange(1,self.num_elems+1), self.elems + 1]
+            row_format = '%d' + ' %d' * self.num_nodes
+            if self.num_attrs:
+                assert self.attrs.shape == (self.num_elems, self.num_attrs)
+                columns.append(self.attrs)
+                row_format += ' %f' * self.num_attrs
+            save_table(f, row_format + '\n', columns)
+
+
+class TetgenFaces(TetgenPart):
+    HEADER = ('num_faces', 'has_boundary_markers')
+    ARRAYS = ('faces', 'boundary_markers')
+
     def __init__(self):
         self.num_faces = 0
         self.faces = None
         self.has_boundary_markers = 0
         self.boundary_markers = None
 
-    def load(self,filename):
+    def parse(self,filename):
         # (2) read .1.face file (faces == triangles)
-        with open(filename) as f:
-            # first line: <# of faces> <boundary markers (0 or 1)>
-            num_faces, has_boundary_markers = [int(x) for x in re.split(r'\s+',f.readline().strip())]
-            faces = np.zeros([num_faces,3],dtype=int)
-            boundary_markers = np.zeros([num_faces],dtype=int) if has_boundary_markers > 0 else np.empty(0)
-            for i in range(num_faces):
-                # <face #> <node> <node> <node> [boundary marker]
-                items = re.split(r'\s+',f.readline().strip())
-                assert int(items[0]) == i + 1, ('items[0]',items[0],'i + 1',i + 1)
-                faces[i,:3] = [int(x)-1 for x in items[1:4]]
-                if has_boundary_markers > 0:
-                    boundary_markers[i] = int(items[-1])
+        # first line: <# of faces> <boundary markers (0 or 1)>
+        # rest lines: <face #> <node> <node> <node> [boundary marker]
+        header, table = load_table(filename, dtype=int)
+        num_faces, has_boundary_markers = header
+        faces = table[:,1:4] - 1
+        boundary_markers = table[:,-1].copy() if has_boundary_markers > 0 else np.empty(0)
 
         self.num_faces = num_faces
         self.has_boundary_markers = has_boundary_markers
@@ -163,19 +277,24 @@ class TetgenFaces:
     def save(self,filename):
         with open(filename,'w') as f:
             assert len(self.faces) == self.num_faces
+            assert self.num_faces == 0 or self.faces.shape[1] == 3
             # first line: <# of faces> <boundary markers (0 or 1)>
             f.write('{:d} {:d}\n'.format(
                 self.num_faces,
                 self.has_boundary_markers))
-            for i,face in enumerate(self.faces):
-                assert len(face) == 3
-                # <face #> <node> <node> <node> [boundary marker]
-                line = '{:d}'.format(i+1)
-                for _,v in enumerate(face):
-                    line += ' {:d}'.format(v+1)
-                if self.has_boundary_markers:
-                    line += ' {:d}'.format(self.boundary_markers[i])
-                f.write(line + '\n')
+            # <face #> <node> <node> <node> [boundary marker]
+            columns = [np.arange(1,self.num_faces+1), self.faces + 1]
+            row_format = '%d %d %d %d'
+            if self.has_boundary_markers:
+                columns.append(self.boundary_markers)
+                row_format += ' %d'
+            save_table(f, row_format + '\n', columns)
+
+
+def _load_part(part_class, filename, sidecar=True):
+    part = part_class()
+    part.load(filename, sidecar)
+    return part
 
 
 class TetgenObject:
@@ -184,7 +303,12 @@ class TetgenObject:
         self.elems = TeggenElems()
         self.faces = TetgenFaces()
 
-    def load(self, model_file):
+    def load(self, model_file, executor=None, sidecar=True):
+        """
+        load .node, .ele and .face files
+        if executor (concurrent.futures.Executor) is given, the three files are loaded concurrently
+        sidecar: memory-map the binary sidecars of the files, written by the first load (see TetgenPart.load)
+        """
         # automatic detect filename base
         rev = model_file[::-1]
         if rev[:5] == 'edon.' or rev[:5] == 'ecaf.': # .node or .face
@@ -198,12 +322,21 @@ class TetgenObject:
         assert os.access(model_file_base + '.ele',os.R_OK)
         assert os.access(model_file_base + '.face',os.R_OK)
 
+        if executor is not None:
+            nodes = executor.submit(_load_part, TetgenNodes, model_file_base + '.node', sidecar)
+            elems = executor.submit(_load_part, TeggenElems, model_file_base + '.ele', sidecar)
+            faces = executor.submit(_load_part, TetgenFaces, model_file_base + '.face', sidecar)
+            self.nodes = nodes.result()
+            self.elems = elems.result()
+            self.faces = faces.result()
+            return
+
         if os.access(model_file_base + '.node',os.R_OK):
-            self.nodes.load(model_file_base + '.node')
+            self.nodes.load(model_file_base + '.node', sidecar)
         if os.access(model_file_base + '.ele',os.R_OK):
-            self.elems.load(model_file_base + '.ele')
+            self.elems.load(model_file_base + '.ele', sidecar)
         if os.access(model_file_base + '.face',os.R_OK):
-            self.faces.load(model_file_base + '.face')
+            self.faces.load(model_file_base + '.face', sidecar)
 
     def save(self, model_file_base):
         self.nodes.save(model_file_base + '.node')
@@ -293,45 +426,49 @@ def elems_to_faces(elems,permute=False,keepdims=False,ccw=True):
         t_ = t_.reshape([-1,3])
     return t_
 
-def load_tetgen(model_file):
+def load_tetgen(model_file, executor=None, sidecar=True):
     """
     load tetgen output ( .node & .face )
     """
 
     tetgen_obj = TetgenObject()
-    tetgen_obj.load(model_file)
+    tetgen_obj.load(model_file, executor=executor, sidecar=sidecar)
     return tetgen_obj
 
 # vertex 의 group code 결정
-def find_vertex_group(uvcoords, voronoi_points, voronoi_group):
+# period: None, or site_index.UV_PERIOD for a periodic (not mirrored) pattern
+def find_vertex_group(uvcoords, voronoi_points, voronoi_group, period=None):
     assert uvcoords.ndim == 2
     assert uvcoords.shape[1] == 2
-    uvcoords = uvcoords.reshape([-1,1,2])
-    offs = uvcoords - voronoi_points # shape (-1, N, 2)
-    dists = np.linalg.norm(offs,axis=-1) # shape (-1, N)
-    center = np.argmin(dists, axis=-1) # get nearest center, shape (-1)
+    center = nearest_site(uvcoords, voronoi_points, period) # get nearest center, shape (-1)
     v_group = voronoi_group[center]
     return -(2+v_group) # -2 부터 시작해서 감소하도록 맵
 
 
+# pattern marker 없이 tetgen 을 돌린 (shape cache) mesh 의 vertex group code 결정
+# tetgen marks boundary nodes 1 and interior nodes 0 when the .smesh has no markers,
+# boundary nodes get their group code as if the markers had been in the .smesh
+def mark_vertex_group(shape_markers, uvcoords, voronoi_points, voronoi_group, period=None):
+    v_group = find_vertex_group(uvcoords, voronoi_points, voronoi_group, period)
+    return np.where(shape_markers != 0, v_group, 0)
+
+
 # face (triangle) 혹은 element (tetra) 의 group 코드 결정
-def find_element_group(elems, texcoords, voronoi_points, voronoi_group):
+def find_element_group(elems, texcoords, voronoi_points, voronoi_group, period=None):
     assert elems.ndim == 2
     assert texcoords.ndim == 2
     assert texcoords.shape[1] == 2
     assert voronoi_points.ndim == 2
     assert voronoi_points.shape[1] == 2
-    uvcoords = np.zeros([len(elems),1,2],dtype=float) # 모든 elements 들에 대해 u, v 값
-    uvcoords[:,0,0] = np.amax(texcoords[elems][:,:,0],axis=1) # u 방향으로는 max 값 선택
-    # uvcoords[:,0,1] = np.mean(texcoords[elems][:,:,1],axis=1) # v 방향으로는 mean 값 선택
-    uvcoords[:,0,1] = np.amax(texcoords[elems][:,:,1],axis=1) # v 방향으로는 amax 값 선택
-    offs = uvcoords - voronoi_points # shape (-1, N, 2)
-    dists = np.linalg.norm(offs,axis=-1) # shape (-1, N)
-    center = np.argmin(dists, axis=-1) # get nearest center, shape (-1)
+    # 모든 elements 들에 대해 u, v 값
+    # u 방향으로는 max 값 선택
+    # v 방향으로는 amax 값 선택 (mean 값 대신)
+    uvcoords = np.amax(texcoords[elems],axis=1)
+    center = nearest_site(uvcoords, voronoi_points, period) # get nearest center, shape (-1)
     v_group = voronoi_group[center]
     return -(2+v_group) # -2 부터 시작해서 감소하도록 맵
 
-def rebuild_submesh(obj1, selection, voronoi_points, voronoi_group):
+def rebuild_submesh(obj1, selection, voronoi_points, voronoi_group, period=None):
     """
     create a new TetgenObject composed of selected_elems
     selection <= -2
@@ -348,25 +485,17 @@ def rebuild_submesh(obj1, selection, voronoi_points, voronoi_group):
     faces            = obj1.faces.faces
     face_group       = obj1.faces.boundary_markers
 
-    elem_group       = find_element_group(elems,texcoords,voronoi_points,voronoi_group)
+    elem_group       = find_element_group(elems,texcoords,voronoi_points,voronoi_group,period)
 
     elem_select    = elem_group == selection
     face_select    = face_group == selection
 
     # select relevant vertices
-    vert_selected  = np.zeros(len(points),dtype=int)
-    for elem in elems[elem_select]:
-        a, b, c, d = elem
-        vert_selected[[a,b,c,d]] = 1
-    for face in faces[face_select]:
-        a, b, c = face
-        vert_selected[[a,b,c]] = 1
-    vertex_select  = vert_selected == 1
-
-    vertex_remap   = np.zeros(len(points),dtype=int)
-    vertex_remap[:] = -(len(points)+1) # some invalid value
-    for i,v in enumerate(np.arange(len(points),dtype=int)[vertex_select]):
-        vertex_remap[v] = i
+    vertex_select  = np.zeros(len(points),dtype=bool)
+    vertex_select[elems[elem_select].ravel()] = True
+    vertex_select[faces[face_select].ravel()] = True
+
+    vertex_remap   = compact_vertices(vertex_select)
 
     obj2 = TetgenObject()
 
@@ -397,33 +526,42 @@ def rebuild_submesh(obj1, selection, voronoi_points, voronoi_group):
     return obj2
 
 
+def compact_vertices(vertex_select):
+    """
+    map selected vertex indices to 0..(# of selected - 1), in index order
+    unselected vertices are mapped to some invalid (negative) value
+    """
+    num_points     = len(vertex_select)
+    vertex_remap   = np.zeros(num_points,dtype=int)
+    vertex_remap[:] = -(num_points+1) # some invalid value
+    vertex_remap[vertex_select] = np.arange(np.count_nonzero(vertex_select))
+    return vertex_remap
+
+
 def elems_to_faces2(elems):
+    """
+    returns unique faces (sorted vertex indices, in order of first appearance) and their counts
+    a face with count 1 is on the boundary
+    """
     assert elems.ndim == 2
     assert elems.shape[1] == 4
     e2f = [[0,2,1],[0,1,3],[1,2,3],[0,3,2]] # 1-3-2, 1-2-4, 2-3-4, 1-4-3 (~4-3-1)
-    t1 = elems[:,e2f[0]]
-    t2 = elems[:,e2f[1]]
-    t3 = elems[:,e2f[2]]
-    t4 = elems[:,e2f[3]]
-    t_ = np.sort(np.transpose([t1,t2,t3,t4],[1,0,2]).reshape([-1,3]),axis=-1).tolist()
+    t_ = np.sort(elems[:,e2f].reshape([-1,3]),axis=-1)
     # count and remove duplicates
-    face_dict = dict()
-    for f in t_:
-        ft = tuple(f)
-        if ft not in face_dict:
-            face_dict[ft] = 1
-        else:
-            face_dict[ft] += 1
-    faces = np.zeros([len(face_dict),3],dtype=int)
-    counts = np.zeros(len(face_dict),dtype=int)
-    for i,en in enumerate(face_dict.items()):
-        f, c = en
-        faces[i,:] = f
-        counts[i] = c
+    # pack each face into one integer key if possible, sorting keys is much faster than sorting rows
+    n = int(t_.max()) + 1 if len(t_) > 0 else 1
+    if n < 2**21: # n ** 3 < 2 ** 63
+        keys = (t_[:,0] * n + t_[:,1]) * n + t_[:,2]
+        _, first, counts = np.unique(keys,return_index=True,return_counts=True)
+    else:
+        _, first, counts = np.unique(t_,axis=0,return_index=True,return_counts=True)
+    order  = np.argsort(first)
+    faces  = t_[first[order]]
+    counts = counts[order]
     return faces, counts
 
 
-def rebuild_submesh2(obj1, selection, voronoi_points, voronoi_group):
+def rebuild_submesh2(obj1, selection, voronoi_points, voronoi_group, period=None):
     """
     create a new TetgenObject composed of selected_elems
     selection <= -2
@@ -432,25 +570,61 @@ def rebuild_submesh2(obj1, selection, voronoi_points, voronoi_group):
     assert obj1.nodes.num_attrs > 0
     assert obj1.nodes.has_boundary_markers > 0
 
+    elems            = obj1.elems.elems
+    texcoords        = obj1.nodes.attrs
+
+    elem_group       = find_element_group(elems,texcoords,voronoi_points,voronoi_group,period)
+    elem_select      = elem_group == selection
+
+    return extract_submesh(obj1, elem_select, selection)
+
+
+def rebuild_submeshes(obj1, selections, voronoi_points, voronoi_group, period=None, elem_group=None):
+    """
+    same as rebuild_submesh2, for all selections at once
+    element groups are computed only once, and elements are sorted by group
+    elem_group: group codes of the elements (find_element_group), if already computed
+    returns a list of (TetgenObject, point-cloud) in the order of selections
+    """
+
+    assert obj1.nodes.num_attrs > 0
+    assert obj1.nodes.has_boundary_markers > 0
+
+    elems            = obj1.elems.elems
+    texcoords        = obj1.nodes.attrs
+
+    if elem_group is None:
+        elem_group   = find_element_group(elems,texcoords,voronoi_points,voronoi_group,period)
+
+    # stable sort keeps the original element order within a group
+    elem_order       = np.argsort(elem_group,kind='mergesort')
+    sorted_group     = elem_group[elem_order]
+
+    results = []
+    for selection in selections:
+        start = np.searchsorted(sorted_group,selection,side='left')
+        end   = np.searchsorted(sorted_group,selection,side='right')
+        results.append(extract_submesh(obj1, elem_order[start:end], selection))
+    return results
+
+
+def extract_submesh(obj1, elem_select, selection):
+    """
+    create a new TetgenObject composed of obj1.elems.elems[elem_select] (mask or indices)
+    faces not shared by two elements are marked with selection, the others with -1
+    returns the new TetgenObject and a point-cloud of its boundary face centers
+    """
+
     points           = obj1.nodes.points
     marks            = obj1.nodes.boundary_markers
     texcoords        = obj1.nodes.attrs
     elems            = obj1.elems.elems
 
-    elem_group       = find_element_group(elems,texcoords,voronoi_points,voronoi_group)
-    elem_select      = elem_group == selection
-
     # select relevant vertices
-    vert_selected  = np.zeros(len(points),dtype=int)
-    for elem in elems[elem_select]:
-        a, b, c, d = elem
-        vert_selected[[a,b,c,d]] = 1
-    vertex_select  = vert_selected == 1
+    vertex_select  = np.zeros(len(points),dtype=bool)
+    vertex_select[elems[elem_select].ravel()] = True
 
-    vertex_remap   = np.zeros(len(points),dtype=int)
-    vertex_remap[:] = -(len(points)+1) # some invalid value
-    for i,v in enumerate(np.arange(len(points),dtype=int)[vertex_select]):
-        vertex_remap[v] = i
+    vertex_remap   = compact_vertices(vertex_select)
 
     obj2 = TetgenObject()
 
@@ -487,3 +661,92 @@ def rebuild_submesh2(obj1, selection, voronoi_points, voronoi_group):
 
     return obj2, ptcloud
 
+
+
+def sample_surfaces(obj1, elem_group, selections, num_points, random_state):
+    """
+    num_points random points on the surface of each fragment, uniform by area, for all fragments at once
+    the fragment of selection s is made of the elements of obj1 with elem_group == s (see rebuild_submeshes)
+    its surface is made of original faces (on the surface of obj1) and fracture faces (shared with an element
+    of another group)
+    random_state: numpy RandomState, seeded by the caller (per job, see generate.fragment_job)
+    returns arrays, with one row per selection:
+      points   (fragments, num_points, 3)
+      normals  (fragments, num_points, 3), unit normals of the faces, pointing out of the fragment
+      fracture (fragments, num_points), True for points on fracture faces, False for the original surface
+    points and normals of a fragment without elements are nan
+    """
+    points    = obj1.nodes.points
+    elems     = obj1.elems.elems
+    selections = np.asarray(selections)
+    num_fracs = len(selections)
+
+    # fragment of every element, -1 if not selected
+    order     = np.argsort(selections)
+    pos       = np.clip(np.searchsorted(selections[order],elem_group),0,num_fracs-1)
+    elem_frag = np.where(selections[order][pos] == elem_group,order[pos],-1)
+
+    # all faces of all elements, with the vertex opposite to each
+    e2f       = [[0,2,1],[0,1,3],[1,2,3],[0,3,2]]
+    opposite  = [3,2,0,1]
+    tris      = elems[:,e2f].reshape([-1,3])
+    apex      = elems[:,opposite].reshape(-1)
+    face_frag = np.repeat(elem_frag,4)
+
+    # a face is on the surface of a fragment if no other element of the fragment has it:
+    # either no other element has it (original surface), or one of another fragment does (fracture)
+    # (a face has at most two elements, the other element of a shared face is next to it in order of vertices)
+    t_ = np.sort(tris,axis=-1)
+    n = len(points)
+    if n < 2**21: # see elems_to_faces2
+        by_key = np.argsort((t_[:,0] * n + t_[:,1]) * n + t_[:,2])
+    else:
+        by_key = np.lexsort(t_.T[::-1])
+    sorted_t = t_[by_key]
+    same    = np.all(sorted_t[:-1] == sorted_t[1:],axis=1)
+    partner = np.arange(len(tris))
+    partner[by_key[:-1][same]] = by_key[1:][same]
+    partner[by_key[1:][same]]  = by_key[:-1][same]
+    shared  = partner != np.arange(len(tris))
+    keep    = (face_frag >= 0) & (~shared | (face_frag[partner] != face_frag))
+
+    # surface triangles grouped by fragment
+    keep      = np.flatnonzero(keep)
+    keep      = keep[np.argsort(face_frag[keep],kind='mergesort')]
+    tri_frag  = face_frag[keep]
+    corners   = points[tris[keep]]
+    normals   = np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+    outward   = np.einsum('ij,ij->i',normals,points[apex[keep]] - corners[:,0]) < 0
+    normals[~outward] *= -1
+    lengths   = np.linalg.norm(normals,axis=1)
+    areas     = 0.5 * lengths
+    normals   = normals / np.maximum(lengths,1e-300)[:,None]
+
+    if len(keep) == 0:
+        return (np.full([num_fracs,num_points,3],np.nan), np.full([num_fracs,num_points,3],np.nan),
+                np.zeros([num_fracs,num_points],dtype=bool))
+
+    # pick triangles by area, one searchsorted for all fragments
+    num_tris  = np.bincount(tri_frag,minlength=num_fracs)
+    ends      = np.cumsum(num_tris)
+    cumulative = np.cumsum(areas)
+    starts    = np.concatenate([[0.0],cumulative])[ends - num_tris]
+    totals    = np.concatenate([[0.0],cumulative])[ends] - starts
+    draws     = starts[:,None] + random_state.random_sample([num_fracs,num_points]) * totals[:,None]
+    picked    = np.searchsorted(cumulative,draws,side='right')
+    # rounding can step over the end of a fragment
+    picked    = np.clip(picked,(ends - num_tris)[:,None],np.maximum(ends - 1,0)[:,None])
+
+    # uniform point in each picked triangle
+    r1, r2    = random_state.random_sample([2,num_fracs,num_points,1])
+    s1        = np.sqrt(r1)
+    a, b, c   = corners[picked,0], corners[picked,1], corners[picked,2]
+    sample_points  = (1 - s1) * a + s1 * (1 - r2) * b + s1 * r2 * c
+    sample_normals = normals[picked]
+    fracture  = shared[keep][picked]
+
+    empty = totals <= 0
+    sample_points[empty]  = np.nan
+    sample_normals[empty] = np.nan
+    fracture[empty] = False
+    return sample_points, sample_normals, fracture
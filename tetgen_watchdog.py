@@ -0,0 +1,190 @@
+# coding: utf-8
+# Copyright 2018 Artificial Intelligence Research Institute(AIRI), Korea
+#
+# This file is part of lathe-and-shatter.
+# lathe-and-shatter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# lathe-and-shatter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with lathe-and-shatter.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+tetgen runs under a wall-clock and memory limit, and the classification of failed runs
+
+the memory limit is an address space limit of the tetgen process (RLIMIT_AS), set by a small python
+launcher that then execs tetgen, so it is in place from the start (preexec_fn is not safe in the threads
+of generate_many --pipeline). tetgen then fails to allocate and stops with "Error:  Out of memory."
+(or std::bad_alloc). the time limit kills tetgen, with its process group (processes of a TETGEN wrapper).
+failures (see generate.tetrahedralize_job for the retries):
+  timeout, out_of_memory          the mesh is too large for the limits
+  self_intersection, close_facets, small_feature, internal_error, crashed, no_output, error
+                                  the input surface trips tetgen, a slightly different one may not
+  input_error                     the .smesh is malformed, no retry helps
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import sys
+import signal
+import time
+import threading
+import subprocess
+from collections import OrderedDict
+
+try: import resource
+except ImportError: resource = None # windows, no memory limit
+
+from profiling import parse_tetgen_phase, rusage_max_rss_bytes
+
+# tetgen exit codes (terminatetetgen in tetgen.cxx)
+EXIT_CODE_FAILURES = {
+    1: 'out_of_memory',
+    2: 'internal_error',
+    3: 'self_intersection',
+    4: 'small_feature',
+    5: 'close_facets',
+    10: 'input_error',
+}
+
+# checked in order, for exit codes not in the table (other tetgen versions, wrappers)
+OUTPUT_FAILURES = [
+    ('out_of_memory', re.compile(r'out of memory|bad_alloc|cannot allocate|MemoryError', re.I)),
+    ('self_intersection', re.compile(r'self-intersect|intersecting facets', re.I)),
+    ('close_facets', re.compile(r'very close input facets', re.I)),
+    ('small_feature', re.compile(r'small input feature', re.I)),
+    ('internal_error', re.compile(r'report this bug', re.I)),
+    ('input_error', re.compile(r'input error', re.I)),
+]
+
+RESOURCE_FAILURES = ('timeout', 'out_of_memory')
+
+OUTPUT_TAIL_LINES = 10
+
+
+class TetgenFailure(Exception):
+    """
+    failed tetgen run, failure is one of the classes above
+    """
+    def __init__(self, failure, returncode, output_tail):
+        Exception.__init__(self, 'tetgen failed: {:s} (exit code {}): {:s}'.format(
+            failure, returncode, ' | '.join(output_tail)))
+        self.failure = failure
+        self.returncode = returncode
+        self.output_tail = output_tail
+
+
+def classify_failure(returncode, output, timed_out=False):
+    """
+    failure class of a finished tetgen run, None if it succeeded
+    output: lines tetgen printed
+    """
+    if returncode == 0:
+        return None
+    if timed_out:
+        return 'timeout'
+    if returncode in EXIT_CODE_FAILURES:
+        return EXIT_CODE_FAILURES[returncode]
+    text = '\n'.join(output)
+    for failure, pattern in OUTPUT_FAILURES:
+        if pattern.search(text):
+            return failure
+    if returncode < 0:
+        return 'crashed' # killed by a signal
+    return 'error'
+
+
+# python -c launcher: limit the address space to argv[1] bytes, then exec the command in argv[2:]
+LIMIT_MEMORY_LAUNCHER = ('import os, sys, resource; limit = int(sys.argv[1]); '
+                         'resource.setrlimit(resource.RLIMIT_AS, (limit, limit)); os.execvp(sys.argv[2], sys.argv[2:])')
+
+
+def _limit_memory(args, max_memory):
+    return [sys.executable, '-c', LIMIT_MEMORY_LAUNCHER, str(int(max_memory))] + list(args)
+
+
+def run_supervised(args, timeout=0, max_memory=0, record=None, echo=True):
+    """
+    run tetgen (args: command line) and wait for it, no longer than timeout seconds
+    timeout: seconds, 0 == no limit
+    max_memory: bytes of address space, 0 == no limit
+    record: None, or profile record, gets tetgen phase seconds (tetgen_phases), exit code, wall seconds,
+        cpu time and peak memory of the tetgen process (child_cpu_seconds, child_max_rss_bytes)
+    echo: print the output of tetgen to stderr
+    returns the output lines, raises TetgenFailure
+    """
+    if max_memory and resource is not None:
+        args = _limit_memory(args, max_memory)
+    start = time.time()
+    # a session of its own: a kill reaches the processes a TETGEN wrapper starts, which hold the output open too
+    proc = subprocess.Popen(args,bufsize=0,universal_newlines=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+    # the output is read here until tetgen exits or is killed, the timer kills it
+    timed_out = threading.Event()
+    def kill():
+        timed_out.set()
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+
+    output = []
+    phases = OrderedDict()
+    try:
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                break
+            line = line.rstrip()
+            if echo:
+                print(line,file=sys.stderr)
+            output.append(line)
+            phase = parse_tetgen_phase(line)
+            if phase is not None:
+                phases[phase[0]] = phase[1]
+
+        if hasattr(os, 'wait4'):
+            # wait4 gives resource usage of this child only
+            _, status, rusage = os.wait4(proc.pid, 0)
+            # as Popen.returncode (os.waitstatus_to_exitcode is python 3.9+)
+            proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            if record is not None:
+                record['child_cpu_seconds'] = rusage.ru_utime + rusage.ru_stime
+                record['child_max_rss_bytes'] = rusage_max_rss_bytes(rusage)
+        else:
+            proc.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if proc.returncode is None:
+            # interrupted while waiting, no tetgen left behind
+            kill()
+            proc.wait()
+        proc.stdout.close()
+
+    if record is not None:
+        record['tetgen_phases'] = phases
+        record['tetgen_returncode'] = proc.returncode
+        record['tetgen_seconds'] = time.time() - start
+
+    failure = classify_failure(proc.returncode, output, timed_out.is_set())
+    if failure is not None:
+        if record is not None:
+            record['failure'] = failure
+        raise TetgenFailure(failure, proc.returncode, output[-OUTPUT_TAIL_LINES:])
+    return output